@@ -2,18 +2,18 @@ import typing as T
 import logging
 
 import os
+import sys
 
 from xml.dom import pulldom
-from xml.sax import make_parser
-from xml.sax.handler import feature_external_ges
 
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'loading'))
+
+from entities import DecodedDocument  # noqa: E402
 
-log = logging.getLogger(__name__)
 
-parser = make_parser()
-parser.setFeature(feature_external_ges, True)
+log = logging.getLogger(__name__)
 
 note_types = set()
 ee_types = set()
@@ -28,8 +28,7 @@ def analyze_document(filename: str = "data/dblp.xml", expected_event_count: T.Op
     :param expected_event_count:
     :return:
     """
-    os.chdir(os.path.dirname(filename))  # so that relative reference to dtd file can be read by XML parser
-    doc = pulldom.parse(filename, parser=parser, bufsize=2 ** 14)
+    doc = pulldom.parse(DecodedDocument(filename), bufsize=2 ** 14)  # entities are expanded without the dtd file
 
     for event, node in tqdm(doc, total=expected_event_count):
         if event == pulldom.START_ELEMENT:
@@ -0,0 +1,356 @@
+"""
+Single pass profile of dblp XML, used to size columns and choose types of the schema.
+The document is split into byte ranges aligned to publications (the same way as by the sharded parser,
+see loading/engines.py), which are profiled by a pool of processes. For every publication tag it counts
+publications and tags inside them, for every tag and attribute it collects the number of values, approximate
+number of distinct values (HyperLogLog), histogram of lengths, counts of values while there are only a few of them
+and, for tags mapped to integers by the parser (INT_MAPPING_TAGS), values which cannot be parsed.
+Values are measured as the parser writes them (inner XML of a tag, with nested tags and escaped characters).
+Profiles of shards (and JSON reports of separate runs, eg. of different releases of dblp) are merged exactly,
+except for distinct counts, which are approximate with the relative error of about 1.04 / sqrt(2 ** HLL_PRECISION).
+"""
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import time
+import typing as T
+import zlib
+from functools import partial
+from multiprocessing import Pool, cpu_count
+
+import click
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'loading'))
+
+from engines import END_PUBLICATION, FIELD, START_PUBLICATION, ExpatEngine, split_document  # noqa: E402
+from xml_to_csv import INT_MAPPING_TAGS, PUBLICATION_TAGNAMES  # noqa: E402
+
+log = logging.getLogger(__name__)
+
+""" Number of bits of a hash used as an index of a HyperLogLog register (2 ** HLL_PRECISION registers) """
+HLL_PRECISION = 14
+
+""" Maximal number of distinct values counted exactly, values of tags with more of them are dropped from the report """
+VALUE_COUNTS_LIMIT = 64
+
+""" Number of examples of values which are not valid integers kept for every tag in INT_MAPPING_TAGS """
+INVALID_INT_EXAMPLES = 16
+
+""" Number of shards per process, smaller shards balance the work better when some parts are denser than others """
+SHARDS_PER_PROCESS = 4
+
+
+class AllTags(object):
+    """ Set of all tag names, so that the engine emits every tag inside a publication as a field """
+
+    def __contains__(self, tag: str) -> bool:
+        return True
+
+
+class HyperLogLog(object):
+    """ Approximate counter of distinct values, merged by taking maximum of every register """
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: T.Optional[bytearray] = None):
+        """
+        :param precision: number of bits of a hash selecting the register
+        :param registers: registers of a saved counter (see to_dict)
+        """
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(2 ** precision)
+        self._shift = 64 - precision
+        self._mask = 2 ** self._shift - 1
+
+    def add(self, value: str):
+        # hash of python strings differs between processes, values have to be hashed the same way in every run
+        h = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+        i, rank = h >> self._shift, self._shift - (h & self._mask).bit_length() + 1
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HyperLogLog of precision {other.precision} into {self.precision}")
+        registers = np.maximum(np.frombuffer(self.registers, np.uint8), np.frombuffer(other.registers, np.uint8))
+        self.registers = bytearray(registers.tobytes())
+
+    def cardinality(self) -> int:
+        m = len(self.registers)
+        registers = np.frombuffer(self.registers, np.uint8)
+        estimate = 0.7213 / (1 + 1.079 / m) * m ** 2 / float(np.sum(np.exp2(-registers.astype(np.float64))))
+        n_empty = int(np.count_nonzero(registers == 0))
+        if estimate <= 2.5 * m and n_empty > 0:
+            estimate = m * math.log(m / n_empty)  # linear counting is more accurate for small cardinalities
+        return round(estimate)
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        registers = base64.b64encode(zlib.compress(bytes(self.registers))).decode('ascii')
+        return {'precision': self.precision, 'registers': registers}
+
+    @classmethod
+    def from_dict(cls, d: T.Dict[str, T.Any]) -> 'HyperLogLog':
+        return cls(d['precision'], bytearray(zlib.decompress(base64.b64decode(d['registers']))))
+
+
+class ValueStats(object):
+    """ Statistics of values of a tag or an attribute """
+
+    def __init__(self, parse_int: bool = False):
+        """
+        :param parse_int: count values which are not valid integers (as mapped by the parser)
+        """
+        self.count = 0
+        self.max_length = 0
+        self.length_histogram = [0]  # i-th bucket counts lengths with i bits: 0, 1, 2-3, 4-7, 8-15, ...
+        self.distinct = HyperLogLog()
+        self.value_counts = dict()  # None once there are more than VALUE_COUNTS_LIMIT distinct values
+        self.parse_int = parse_int
+        self.invalid_int = 0
+        self.invalid_int_examples = list()
+
+    def add(self, value: str):
+        self.count += 1
+        length = len(value)
+        bucket = length.bit_length()
+        if bucket >= len(self.length_histogram):
+            self.length_histogram.extend([0] * (bucket + 1 - len(self.length_histogram)))
+        self.length_histogram[bucket] += 1
+        if length > self.max_length:
+            self.max_length = length
+        self.distinct.add(value)
+
+        if self.value_counts is not None:
+            self.value_counts[value] = self.value_counts.get(value, 0) + 1
+            if len(self.value_counts) > VALUE_COUNTS_LIMIT:
+                self.value_counts = None
+        if self.parse_int:
+            try:
+                int(value)
+            except ValueError:
+                self.invalid_int += 1
+                if len(self.invalid_int_examples) < INVALID_INT_EXAMPLES:
+                    self.invalid_int_examples.append(value)
+
+    def merge(self, other: 'ValueStats'):
+        self.count += other.count
+        self.max_length = max(self.max_length, other.max_length)
+        if len(other.length_histogram) > len(self.length_histogram):
+            self.length_histogram.extend([0] * (len(other.length_histogram) - len(self.length_histogram)))
+        for bucket, count in enumerate(other.length_histogram):
+            self.length_histogram[bucket] += count
+        self.distinct.merge(other.distinct)
+
+        if self.value_counts is not None and other.value_counts is not None:
+            for value, count in other.value_counts.items():
+                self.value_counts[value] = self.value_counts.get(value, 0) + count
+            if len(self.value_counts) > VALUE_COUNTS_LIMIT:
+                self.value_counts = None
+        else:
+            self.value_counts = None
+        self.parse_int = self.parse_int or other.parse_int
+        self.invalid_int += other.invalid_int
+        examples = self.invalid_int_examples + other.invalid_int_examples
+        self.invalid_int_examples = examples[:INVALID_INT_EXAMPLES]
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        d = {
+            'count': self.count,
+            'distinct': len(self.value_counts) if self.value_counts is not None else self.distinct.cardinality(),
+            'max_length': self.max_length,
+            'length_histogram': self.length_histogram,
+            'value_counts': (
+                dict(sorted(self.value_counts.items(), key=lambda item: -item[1]))
+                if self.value_counts is not None else None
+            ),
+            'hll': self.distinct.to_dict(),
+        }
+        if self.parse_int:
+            d['invalid_int'] = self.invalid_int
+            d['invalid_int_rate'] = self.invalid_int / self.count if self.count > 0 else 0.0
+            d['invalid_int_examples'] = self.invalid_int_examples
+        return d
+
+    @classmethod
+    def from_dict(cls, d: T.Dict[str, T.Any]) -> 'ValueStats':
+        stats = cls(parse_int='invalid_int' in d)
+        stats.count = d['count']
+        stats.max_length = d['max_length']
+        stats.length_histogram = list(d['length_histogram'])
+        stats.distinct = HyperLogLog.from_dict(d['hll'])
+        stats.value_counts = dict(d['value_counts']) if d['value_counts'] is not None else None
+        stats.invalid_int = d.get('invalid_int', 0)
+        stats.invalid_int_examples = list(d.get('invalid_int_examples', []))
+        return stats
+
+
+class Profile(object):
+    """ Mergeable profile of (a part of) the document """
+
+    def __init__(self):
+        self.n_bytes = 0
+        self.publications = dict()  # publication tag => number of publications
+        self.tags = dict()  # publication tag => {tag => {'count', 'publications', 'max_per_publication'}}
+        self.values = dict()  # tag => ValueStats of inner XML
+        self.attributes = dict()  # tag@attribute => ValueStats
+
+    def _attribute_stats(self, tag: str, attributes: T.Dict[str, str]):
+        for name, value in attributes.items():
+            key = f'{tag}@{name}'
+            try:
+                self.attributes[key].add(value)
+            except KeyError:
+                self.attributes[key] = ValueStats(parse_int=name in INT_MAPPING_TAGS)
+                self.attributes[key].add(value)
+
+    def add_publication(self, tag: str, attributes: T.Dict[str, str], fields: T.List[T.Tuple[str, T.Dict, str]]):
+        """
+        :param tag: publication tag
+        :param attributes: attributes of the publication tag
+        :param fields: (tag, attributes, inner XML) of tags inside the publication
+        """
+        self.publications[tag] = self.publications.get(tag, 0) + 1
+        self._attribute_stats(tag, attributes)
+
+        counts = dict()
+        for field_tag, field_attributes, text in fields:
+            counts[field_tag] = counts.get(field_tag, 0) + 1
+            try:
+                self.values[field_tag].add(text)
+            except KeyError:
+                self.values[field_tag] = ValueStats(parse_int=field_tag in INT_MAPPING_TAGS)
+                self.values[field_tag].add(text)
+            self._attribute_stats(field_tag, field_attributes)
+
+        tags = self.tags.setdefault(tag, dict())
+        for field_tag, count in counts.items():
+            try:
+                field = tags[field_tag]
+            except KeyError:
+                field = tags[field_tag] = {'count': 0, 'publications': 0, 'max_per_publication': 0}
+            field['count'] += count
+            field['publications'] += 1
+            field['max_per_publication'] = max(field['max_per_publication'], count)
+
+    def merge(self, other: 'Profile'):
+        self.n_bytes += other.n_bytes
+        for tag, count in other.publications.items():
+            self.publications[tag] = self.publications.get(tag, 0) + count
+        for tag, fields in other.tags.items():
+            tags = self.tags.setdefault(tag, dict())
+            for field_tag, field in fields.items():
+                if field_tag not in tags:
+                    tags[field_tag] = dict(field)
+                    continue
+                tags[field_tag]['count'] += field['count']
+                tags[field_tag]['publications'] += field['publications']
+                tags[field_tag]['max_per_publication'] = max(
+                    tags[field_tag]['max_per_publication'], field['max_per_publication']
+                )
+        for own, others in ((self.values, other.values), (self.attributes, other.attributes)):
+            for key, stats in others.items():
+                if key in own:
+                    own[key].merge(stats)
+                else:
+                    own[key] = stats
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            'bytes': self.n_bytes,
+            'publications': dict(sorted(self.publications.items())),
+            'tags': {tag: dict(sorted(fields.items())) for tag, fields in sorted(self.tags.items())},
+            'values': {tag: stats.to_dict() for tag, stats in sorted(self.values.items())},
+            'attributes': {key: stats.to_dict() for key, stats in sorted(self.attributes.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, d: T.Dict[str, T.Any]) -> 'Profile':
+        profile = cls()
+        profile.n_bytes = d['bytes']
+        profile.publications = dict(d['publications'])
+        profile.tags = {tag: {k: dict(v) for k, v in fields.items()} for tag, fields in d['tags'].items()}
+        profile.values = {tag: ValueStats.from_dict(stats) for tag, stats in d['values'].items()}
+        profile.attributes = {key: ValueStats.from_dict(stats) for key, stats in d['attributes'].items()}
+        return profile
+
+
+def profile_range(filename: str, byte_range: T.Tuple[int, int]) -> Profile:
+    """ Profiles publications in a byte range of the document (see split_document) """
+    profile = Profile()
+    engine = ExpatEngine(filename, PUBLICATION_TAGNAMES, AllTags(), byte_range=byte_range)
+    publication, fields = None, list()
+    for event, node in engine:
+        if event == START_PUBLICATION:
+            publication, fields = node, list()
+        elif event == FIELD:
+            fields.append((node.tagName, node.attributes, node.text))
+        elif event == END_PUBLICATION:
+            profile.add_publication(publication.tagName, publication.attributes, fields)
+    profile.n_bytes = byte_range[1] - byte_range[0]
+    return profile
+
+
+def print_summary(report: T.Dict[str, T.Any]):
+    print(f"{sum(report['publications'].values())} publications: " + ", ".join(
+        f"{tag} {count}" for tag, count in sorted(report['publications'].items(), key=lambda item: -item[1])
+    ))
+    print(f"{'tag/attribute':<24} {'count':>10} {'distinct':>10} {'max_len':>8} {'invalid_int':>12}")
+    for key, stats in list(report['values'].items()) + list(report['attributes'].items()):
+        invalid = f"{100 * stats['invalid_int_rate']:.3f}%" if 'invalid_int' in stats else ''
+        print(f"{key:<24} {stats['count']:>10} {stats['distinct']:>10} {stats['max_length']:>8} {invalid:>12}")
+
+
+@click.group()
+def main():
+    """ Single pass profile of dblp XML and merging of saved profiles """
+    logging.basicConfig(level=logging.INFO)
+
+
+@main.command()
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("output", type=click.Path(dir_okay=False), default='exploration/profile.json')
+@click.option("-j", "--jobs", type=int, default=cpu_count(), help="number of processes")
+def profile(path: str, output: str, jobs: int):
+    """ Profiles XML document PATH and saves JSON report to OUTPUT """
+    start = time.time()
+    byte_ranges = split_document(path, jobs * SHARDS_PER_PROCESS, PUBLICATION_TAGNAMES)
+    log.info(f"Profiling {len(byte_ranges)} shards with {jobs} processes")
+    result = Profile()
+    with Pool(jobs) as pool, tqdm(total=os.path.getsize(path), unit='B', unit_scale=True) as pbar:
+        for shard in pool.imap_unordered(partial(profile_range, path), byte_ranges):
+            result.merge(shard)
+            pbar.update(shard.n_bytes)
+
+    report = {'documents': [os.path.abspath(path)], 'wall_time_s': time.time() - start, **result.to_dict()}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_summary(report)
+    log.info(f"Profile of {path} ({report['wall_time_s']:.1f}s) saved to {output}")
+
+
+@main.command()
+@click.argument("reports", type=click.Path(exists=True, dir_okay=False), nargs=-1, required=True)
+@click.option("-o", "--output", type=click.Path(dir_okay=False), required=True, help="path to merged report")
+def merge(reports: T.Tuple[str, ...], output: str):
+    """ Merges JSON REPORTS of profiled documents (or their parts) into a single report """
+    result, documents, wall_time = Profile(), list(), 0.0
+    for file_name in reports:
+        with open(file_name) as f:
+            report = json.load(f)
+        result.merge(Profile.from_dict(report))
+        documents += report['documents']
+        wall_time += report['wall_time_s']
+
+    merged = {'documents': documents, 'wall_time_s': wall_time, **result.to_dict()}
+    with open(output, 'w') as f:
+        json.dump(merged, f, indent=2)
+    print_summary(merged)
+    log.info(f"{len(reports)} reports merged into {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
 """
 Parse provided XML and calculate counts of top-level keys specified in
 DTD (data model definition).
-To prevent XML parser from throwing errors, need to replace all custom XML entities
-before running the script.
+Custom XML entities are expanded while reading the file (see loading/entities.py).
 """
-
-from xml.etree.cElementTree import iterparse, XMLParser
+import os
+import sys
+from xml.etree.ElementTree import iterparse
 
 import click
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'loading'))
+
+from entities import DecodedDocument  # noqa: E402
+
 
 toplevel_keys = {
     'article',
@@ -31,7 +35,7 @@ def parse_file(path: str, expected_lines: int) -> dict:
     frequency_per_top_key = {k: {'freq': 0, 'keys_freq': dict()} for k in
                              toplevel_keys}  # top_key: (frequency, { sub_key: frequency })
 
-    with open(path, 'r') as f:
+    with DecodedDocument(path) as f:
         context = iterparse(f, events=("start", "end"))
         context = iter(context)
 
@@ -542,6 +542,14 @@ I'm going to leave the computation running until tomorrow afternoon to see if it
 Also, important note: this is the *ONLY* query still runs slower on neo4j than on postgres
 */
 
+// with files exported by graph/export.py (neo4j-admin import with integer ids, without duplicate relationships),
+// every authored relationship already has weight 1 / number of authors of the publication,
+// so n_authors does not have to be set on all publications first and weights are read from relationships:
+match (a1:Person)-[r:authored]->(p:Publication)<-[:authored]-(a2:Person)
+where id(a2) > id(a1)
+with a1, a2, sum(r.weight) as coauthor_weight, count(p) as coauthor_count
+merge (a1)-[:is_coauthor { weight: coauthor_weight, common_publications: coauthor_count }]->(a2);
+
 // ----------------------------------------------------------------------------------------------------------------
 // 3. running unionFind algorithm
 // ----------------------------------------------------------------------------------------------------------------
@@ -583,6 +591,17 @@ CALL algo.graph.load(
 1 row available after 161698 ms, consumed after another 12 ms
 */
 
+// the same projection with weights of relationships exported by graph/export.py (no n_authors property needed)
+CALL algo.graph.load(
+  'authors_weighted',
+  'match (p:Person)-[:authored]->(:Publication) return id(p) as id
+    union
+    match (:Person)-[:authored]->(p:Publication) return id(p) as id',
+  'match (person:Person)-[r:authored]->(pub:Publication)
+    return id(person) as source, id(pub) as target, r.weight as weight',
+  { graph: 'cypher' }
+);
+
 call algo.unionFind.memrec(null, null, { graph: 'authors_weighted' }) yield requiredMemory;
 /*
 +-------------------------+
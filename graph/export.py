@@ -0,0 +1,266 @@
+"""
+Export of parsed tables (CSV files written by loading/xml_to_csv.py) into files ready for `neo4j-admin import`,
+reading every table once and writing it in chunks of at most CHUNK_ROWS rows (separate header files),
+so that nothing has to be sorted or rewritten before the import (see load.sh).
+Publication keys are mapped to dense integer ids (row numbers in publication.csv) by 64 bit hashes of keys,
+so the import uses `--id-type INTEGER` instead of keeping all string keys in memory. Duplicate authored/edited
+relationships are removed while streaming (rows of a publication have to be consecutive, as written by the parser
+and by utils/remove_duplicates.py, which is checked)
+and every authored relationship gets weight 1 / number of authors of the publication, which the projections
+in algo.cypher used to compute on the whole graph.
+"""
+import csv
+import os
+import sys
+import typing as T
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from headers import map_colname
+
+""" Maximal number of rows in one file of a table """
+CHUNK_ROWS = 2 ** 20
+
+""" Tables of relationships between persons and publications, with names of the relationships """
+RELATIONSHIP_TABLES = {'author': 'authored', 'editor': 'edited'}
+
+""" Arrays of the mapping of publication keys, saved as {name}.npy files in the output directory """
+PUBLICATION_ID_ARRAYS = ('publication_key_hashes', 'publication_key_ids')
+
+
+def key_hashes(keys: T.Sequence[str]) -> np.ndarray:
+    return pd.util.hash_array(np.asarray(keys, dtype=object), categorize=False)
+
+
+class PublicationIds(object):
+    """ Maps publication keys to dense ids, hashes of keys are sorted and searched with their ids """
+
+    def __init__(self, hashes: np.ndarray, ids: np.ndarray):
+        """
+        :param hashes: uint64 sorted hashes of all publication keys
+        :param ids: int64 ids of publications of hashes
+        """
+        self.hashes = hashes
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, keys: T.Sequence[str]) -> np.ndarray:
+        """ Returns ids of publication keys, -1 for unknown keys """
+        hashes = key_hashes(keys)
+        if len(self.hashes) == 0:
+            return np.full(len(hashes), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        return np.where(self.hashes[positions] == hashes, self.ids[positions], -1)
+
+    @classmethod
+    def from_hashes(cls, hashes: np.ndarray) -> 'PublicationIds':
+        """ :param hashes: hashes of keys of publications in order of their ids """
+        order = np.argsort(hashes, kind='stable')
+        hashes = hashes[order]
+        if np.any(hashes[1:] == hashes[:-1]):
+            raise ValueError("Hashes of publication keys are not unique (colliding or duplicate keys)")
+        return cls(hashes, order.astype(np.int64))
+
+    def save(self, directory: str):
+        np.save(os.path.join(directory, f'{PUBLICATION_ID_ARRAYS[0]}.npy'), self.hashes)
+        np.save(os.path.join(directory, f'{PUBLICATION_ID_ARRAYS[1]}.npy'), self.ids)
+
+    @classmethod
+    def load(cls, directory: str) -> 'PublicationIds':
+        return cls(*[np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in PUBLICATION_ID_ARRAYS])
+
+
+class ChunkedCsvWriter(object):
+    """ Writes rows of a table into {name}-0000.csv, {name}-0001.csv, ... with the header in {name}.header.csv """
+
+    def __init__(self, out_dir: str, name: str, header: T.Sequence[str], chunk_rows: int = CHUNK_ROWS):
+        self.out_dir = out_dir
+        self.name = name
+        self.chunk_rows = chunk_rows
+        self.n_rows = 0
+        self.files = [f'{name}.header.csv']
+        with open(os.path.join(out_dir, self.files[0]), 'w', newline='') as f:
+            csv.writer(f).writerow(header)
+
+    def write(self, df: pd.DataFrame):
+        start = 0
+        while start < len(df):
+            if self.n_rows % self.chunk_rows == 0:
+                self.files.append(f'{self.name}-{len(self.files) - 1:04d}.csv')
+            end = start + self.chunk_rows - self.n_rows % self.chunk_rows
+            df.iloc[start:end].to_csv(
+                os.path.join(self.out_dir, self.files[-1]), mode='a', header=False, index=False
+            )
+            self.n_rows += len(df.iloc[start:end])
+            start = end
+
+
+def read_columns(data_dir: str, table_name: str) -> T.List[str]:
+    return pd.read_csv(os.path.join(data_dir, f'{table_name}.csv'), nrows=0).columns.tolist()
+
+
+def read_table(data_dir: str, table_name: str) -> T.Iterator[pd.DataFrame]:
+    """ Reads chunks of a table with all values as strings, empty values stay empty """
+    return pd.read_csv(
+        os.path.join(data_dir, f'{table_name}.csv'), dtype=str, keep_default_na=False, chunksize=CHUNK_ROWS
+    )
+
+
+def export_nodes(data_dir: str, out_dir: str, table_name: str) -> T.Tuple[str, T.List[str], int]:
+    """
+    Copies rows of a node table (ids of all tables except publication are already integers).
+    :return: (label, files, number of rows)
+    """
+    header = [map_colname(table_name, column) for column in read_columns(data_dir, table_name)]
+    writer = ChunkedCsvWriter(out_dir, table_name, header)
+    for df in read_table(data_dir, table_name):
+        writer.write(df)
+    print(f"{table_name}: {writer.n_rows} nodes")
+    return table_name.capitalize(), writer.files, writer.n_rows
+
+
+def export_publications(data_dir: str, out_dir: str) -> T.Tuple[str, T.List[str], int]:
+    """ Copies publications with their row numbers as ids, saves the mapping of their keys (see PublicationIds) """
+    # the key stays a property of publications
+    header = ['id:ID(publication-ID)'] + [
+        'key' if column == 'key' else map_colname('publication', column)
+        for column in read_columns(data_dir, 'publication')
+    ]
+    writer, hashes = ChunkedCsvWriter(out_dir, 'publication', header), [np.empty(0, dtype=np.uint64)]
+    for df in read_table(data_dir, 'publication'):
+        df.insert(0, 'id', np.arange(writer.n_rows, writer.n_rows + len(df), dtype=np.int64))
+        hashes.append(key_hashes(df['key'].values))
+        writer.write(df)
+
+    PublicationIds.from_hashes(np.concatenate(hashes)).save(out_dir)
+    print(f"publication: {writer.n_rows} nodes")
+    return 'Publication', writer.files, writer.n_rows
+
+
+def close_publications(closed: np.ndarray, ids: np.ndarray):
+    """
+    Marks publications whose rows ended as closed.
+    :param closed: flags of publications by their ids
+    :param ids: publication ids of complete groups of consecutive rows
+    :raises ValueError: when rows of a publication are not consecutive (a publication is closed again)
+    """
+    group_ids, n_groups = np.unique(ids[np.append(True, ids[1:] != ids[:-1])], return_counts=True)
+    repeated = group_ids[(n_groups > 1) | closed[group_ids]]
+    if len(repeated) > 0:
+        raise ValueError(
+            f"Rows of publication {repeated[0]} (row of publication.csv) are not consecutive, "
+            f"deduplicate the table with utils/remove_duplicates.py or sort it by publication_key"
+        )
+    closed[group_ids] = True
+
+
+def complete_publications(chunks: T.Iterable[pd.DataFrame], n_publications: int) -> T.Iterator[pd.DataFrame]:
+    """
+    Re-chunks rows with publication_id, so that rows of a publication are never split between chunks.
+    :param chunks: rows with publication_id, rows of a publication have to be consecutive
+    :param n_publications: number of publication ids
+    :raises ValueError: when rows of a publication are not consecutive
+    """
+    closed = np.zeros(n_publications, dtype=bool)
+    carry = None
+    for df in chunks:
+        if carry is not None:
+            df = pd.concat([carry, df], ignore_index=True)
+        if len(df) == 0:
+            continue
+        ids = df['publication_id'].values
+        last_start = len(ids) - int(np.argmax(ids[::-1] != ids[-1])) if np.any(ids != ids[-1]) else 0
+        carry = df.iloc[last_start:]
+        if last_start > 0:
+            close_publications(closed, ids[:last_start])
+            yield df.iloc[:last_start]
+    if carry is not None and len(carry) > 0:
+        close_publications(closed, carry['publication_id'].values[:1])
+        yield carry
+
+
+def export_relationships(data_dir: str, out_dir: str, table_name: str) -> T.Tuple[str, T.List[str], int]:
+    """
+    Writes person => publication relationships with integer ids, without duplicates.
+    :return: (type of relationships, files, number of rows)
+    """
+    publication_ids = PublicationIds.load(out_dir)
+    counts = {'rows': 0, 'unknown publications': 0, 'duplicates': 0}
+
+    def with_publication_ids(chunks):
+        for df in chunks:
+            counts['rows'] += len(df)
+            df.insert(1, 'publication_id', publication_ids.get(df.pop('publication_key').values))
+            known = df['publication_id'].values >= 0
+            counts['unknown publications'] += int((~known).sum())
+            yield df[known]
+
+    # publication_key column is replaced with publication_id, authored relationships get weights
+    columns = read_columns(data_dir, table_name) + (['weight'] if table_name == 'author' else [])
+    writer = ChunkedCsvWriter(out_dir, table_name, [map_colname(table_name, column) for column in columns])
+    for df in complete_publications(with_publication_ids(read_table(data_dir, table_name)), len(publication_ids)):
+        n_rows = len(df)
+        df = df.drop_duplicates(['person_id', 'publication_id'])
+        counts['duplicates'] += n_rows - len(df)
+        if table_name == 'author':
+            df = df.assign(weight=1.0 / df.groupby('publication_id')['person_id'].transform('size'))
+        writer.write(df[[c.replace('publication_key', 'publication_id') for c in columns]])
+
+    print(f"{table_name}: {writer.n_rows} relationships of {counts['rows']} rows, "
+          f"{counts['duplicates']} duplicates and {counts['unknown publications']} of unknown publications removed")
+    return RELATIONSHIP_TABLES[table_name], writer.files, writer.n_rows
+
+
+def build_import_command(nodes: T.List[T.Tuple[str, T.List[str], int]],
+                         relationships: T.List[T.Tuple[str, T.List[str], int]]) -> str:
+    """
+    Creates a bash script for data loading, intended to be executed from a location
+    directly above neo4j import directory (see headers.py)
+    """
+    cmd = """#!/bin/bash
+set -euo pipefail
+IFS=$'\\n\\t'
+neo4j-admin import --id-type INTEGER \\\n"""
+    for label, files, _ in nodes:
+        cmd += f'--nodes:{label} "{",".join(f"./import/{f}" for f in files)}" \\\n'
+    for relationship, files, n_rows in relationships:
+        if n_rows > 0:
+            cmd += f'--relationships:{relationship} "{",".join(f"./import/{f}" for f in files)}" \\\n'
+    return cmd
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} [data_dir] [output_dir] [number of processes (optional)]")
+        exit(2)
+    data_dir, out_dir = sys.argv[1], sys.argv[2]
+    if os.path.realpath(data_dir) == os.path.realpath(out_dir):
+        print("Output directory has to be different from data_dir (its CSV files are replaced)")
+        exit(2)
+    jobs = int(sys.argv[3]) if len(sys.argv) > 3 else cpu_count()
+    os.makedirs(out_dir, exist_ok=True)
+    for file_name in os.listdir(out_dir):
+        if file_name.endswith('.csv'):
+            os.remove(os.path.join(out_dir, file_name))
+
+    tables = sorted(f[:-len('.csv')] for f in os.listdir(data_dir) if f.endswith('.csv'))
+    node_tables = [t for t in tables if t not in RELATIONSHIP_TABLES and t != 'publication']
+    with Pool(jobs) as pool:
+        # relationships need ids of publications, other tables are exported meanwhile
+        publications = pool.apply_async(export_publications, (data_dir, out_dir))
+        node_results = [pool.apply_async(export_nodes, (data_dir, out_dir, t)) for t in node_tables]
+        publications_result = publications.get()
+        relationship_results = [
+            pool.apply_async(export_relationships, (data_dir, out_dir, t)) for t in tables if t in RELATIONSHIP_TABLES
+        ]
+        nodes = [publications_result] + [r.get() for r in node_results]
+        relationships = [r.get() for r in relationship_results]
+
+    with open(Path(out_dir) / 'import.sh', 'w') as f:
+        f.write(build_import_command(nodes, relationships))
+    print(f"Files for neo4j-admin import and import.sh saved to: {out_dir}")
@@ -19,6 +19,7 @@ type_map = {
     "publnr": "publnr:short",
     "cdate": "cdate:date",
     "mdate": "mdate:date",
+    "weight": "weight:double",
     # TODO: translate type_enums and month to points in graph
 }
 rel_type_map = {
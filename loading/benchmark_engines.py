@@ -0,0 +1,68 @@
+"""
+Compare throughput of XML engines (see engines.py) by parsing all tables from a given file with each of them.
+Outputs of all engines are compared to make sure they produce exactly the same CSV files.
+"""
+import filecmp
+import logging
+import os
+import tempfile
+import time
+
+import click
+
+from engines import ENGINES
+from xml_to_csv import MultiTableParser, TABLE_COLUMNS, get_all_tables_parser_classes
+
+
+def benchmark_engine(engine: str, filename: str, out_dir: str) -> dict:
+    cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        start = time.time()
+        parser = MultiTableParser(filename, get_all_tables_parser_classes(), use_pbar=False, engine=ENGINES[engine])
+        parser()
+        end = time.time()
+    finally:
+        os.chdir(cwd)
+
+    size_mb = os.path.getsize(filename) / 2 ** 20
+    return {
+        'engine': engine,
+        'time_s': end - start,
+        'mb_per_s': size_mb / (end - start),
+        'publications_per_s': parser.n_total_publciations / (end - start),
+    }
+
+
+@click.command()
+@click.argument("filename", type=str)
+@click.option("-r", "--repeat", type=int, default=3, help="number of runs per engine, the fastest one is reported")
+def compare_engines(filename: str, repeat: int):
+    filename = os.path.abspath(filename)
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for engine in sorted(ENGINES.keys()):
+            out_dir = os.path.join(tmp_dir, engine)
+            os.mkdir(out_dir)
+            runs = [benchmark_engine(engine, filename, out_dir) for _ in range(repeat)]
+            results[engine] = min(runs, key=lambda r: r['time_s'])
+
+        tables = [f"{table_name}.csv" for table_name in TABLE_COLUMNS]
+        engines = sorted(ENGINES.keys())
+        for engine in engines[1:]:
+            _, mismatch, errors = filecmp.cmpfiles(
+                os.path.join(tmp_dir, engines[0]), os.path.join(tmp_dir, engine), tables, shallow=False
+            )
+            if len(mismatch) > 0 or len(errors) > 0:
+                raise ValueError(f"Outputs of {engines[0]} and {engine} differ: {mismatch + errors}")
+
+    print(f"File: {filename} ({os.path.getsize(filename) / 2 ** 20:.1f}MB), best of {repeat} runs")
+    for engine, r in results.items():
+        print(
+            f"{engine}: {r['time_s']:.2f}s, {r['mb_per_s']:.2f}MB/s, {r['publications_per_s']:.0f} publications/s"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    compare_engines()
@@ -0,0 +1,70 @@
+"""
+Periodic checkpoints of long-running parse jobs (see load_dblp), which allow to resume them after a crash.
+Checkpoint is taken right after a publication is concluded and contains: offset of its closing tag in the document,
+state of the parsers (counters and id allocation) and positions of all outputs after flushing them.
+Resumed job produces exactly the same output as a job which was never stopped.
+"""
+import logging
+import os
+import pickle
+import time
+import typing as T
+
+log = logging.getLogger(__name__)
+
+""" Minimal number of seconds between two checkpoints """
+DEFAULT_INTERVAL_S = 300
+
+
+class Checkpointer(object):
+    """ Saves checkpoints of a parser (see TagParser.get_state) to a file, replaced atomically """
+
+    def __init__(self, file_name: str, interval_s: float = DEFAULT_INTERVAL_S, info: T.Dict[str, T.Any] = None):
+        """
+        :param file_name: path to checkpoint file
+        :param interval_s: minimal number of seconds between two checkpoints
+        :param info: description of the job (eg. target and document), saved with every checkpoint
+        """
+        self.file_name = file_name
+        self.interval_s = interval_s
+        self.info = info or dict()
+        self.n_checkpoints = 0
+        self._last_save = time.time()
+
+    def maybe_save(self, parser, offset: int):
+        """
+        Saves checkpoint if the interval has passed since the previous one.
+        :param parser: TagParser which has just concluded a publication
+        :param offset: byte offset of the closing tag of the publication
+        """
+        if time.time() - self._last_save >= self.interval_s:
+            self.save(parser, offset)
+
+    def save(self, parser, offset: int):
+        start = time.time()
+        checkpoint = {
+            **self.info,
+            'offset': offset,
+            'writers': {table_name: writer.checkpoint() for table_name, writer in parser.get_writers().items()},
+            'parser': parser.get_state(),
+        }
+        tmp_file_name = f"{self.file_name}.tmp"
+        with open(tmp_file_name, 'wb') as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file_name, self.file_name)  # previous checkpoint stays valid until the new one is complete
+
+        self.n_checkpoints += 1
+        self._last_save = time.time()
+        log.info(f"Checkpoint at byte {offset} saved in {self._last_save - start:.2f}s")
+
+    def remove(self):
+        """ Called after the job is completed """
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+
+def load_checkpoint(file_name: str) -> T.Dict[str, T.Any]:
+    with open(file_name, 'rb') as f:
+        return pickle.load(f)
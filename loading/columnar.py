@@ -0,0 +1,157 @@
+"""
+Typed columnar output of the parsers: one Arrow IPC file per table ({table_name}.arrow), with the same rows as CSV files.
+Files are memory-mapped by the readers, so downstream tools load only the columns they use, without parsing or copying
+(unless files are compressed, which makes them smaller but requires decompression of every read column).
+CSV files for psql can be produced from them (see arrow_to_csv).
+"""
+import logging
+import os
+import time
+import typing as T
+
+import click
+import pyarrow as pa
+
+from writers import CsvTableWriter, TableWriter
+
+log = logging.getLogger(__name__)
+
+""" Types of columns, other columns are strings """
+COLUMN_TYPES = {
+    'id': pa.int32(),
+    'person_id': pa.int32(),
+    'school_id': pa.int32(),
+    'publisher_id': pa.int32(),
+    'series_id': pa.int32(),
+    'year': pa.int32(),
+    'volume': pa.int32(),
+    'month': pa.int32(),
+    'is_archive': pa.bool_(),
+    'is_oa': pa.bool_(),
+    'cdate': pa.date32(),
+    'mdate': pa.date32(),
+}
+
+""" Number of rows in a single record batch """
+ARROW_BATCH_SIZE = 2 ** 16
+
+""" Compression of record batches: None (files can be read without copying), 'lz4' or 'zstd' """
+DEFAULT_COMPRESSION = None
+
+
+def get_table_file_name(data_dir: str, table_name: str) -> str:
+    return os.path.join(data_dir, f"{table_name}.arrow")
+
+
+def get_schema(columns: T.Sequence[str]) -> pa.Schema:
+    return pa.schema([pa.field(c, COLUMN_TYPES.get(c, pa.string())) for c in columns])
+
+
+def to_array(values: T.Sequence[T.Any], data_type: pa.DataType) -> pa.Array:
+    if data_type == pa.date32():
+        return pa.array(values, type=pa.string()).cast(data_type)  # dates are parsed as ISO strings
+    return pa.array(values, type=data_type)
+
+
+class ArrowTableWriter(TableWriter):
+    """ Writes rows to an Arrow IPC file, in record batches of buffer_size rows """
+
+    def __init__(self, file_name: str, *args, compression: T.Optional[str] = DEFAULT_COMPRESSION, **kwargs):
+        """
+        :param file_name: path to Arrow IPC file
+        :param compression: compression of record batches (None, 'lz4' or 'zstd')
+        """
+        kwargs.setdefault('buffer_size', ARROW_BATCH_SIZE)
+        super(ArrowTableWriter, self).__init__(*args, **kwargs)
+        self.file_name = file_name
+        self.schema = get_schema(self.columns)
+        self._start_time = time.time()
+        self._file = pa.OSFile(file_name, 'wb')
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        self._writer = pa.ipc.new_file(self._file, self.schema, options=options)
+
+    def _write_rows(self, rows: T.List[T.Tuple]):
+        arrays = [to_array(values, field.type) for values, field in zip(zip(*rows), self.schema)]
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+
+    def _close(self):
+        self._writer.close()
+        self._file.close()
+        end_time = time.time()
+        log.info(f"{self.file_name} saved ({self.n_rows} rows) in {end_time - self._start_time:.2f}s")
+
+
+def open_arrow_table(table_columns: T.Dict[str, T.List[str]], table_name: str, **kwargs) -> TableWriter:
+    """
+    Columnar output of the parsers, in the current working directory, use with functools.partial as open_table.
+    :param table_columns: mapping table name => columns, in the order in which they are written
+    :param table_name: name of the table in DB schema
+    :param kwargs: passed to ArrowTableWriter
+    :return: writer streaming rows to {table_name}.arrow
+    """
+    columns = table_columns[table_name]
+    index_label = 'id' if columns[0] == 'id' else None
+    file_name = get_table_file_name(os.getcwd(), table_name)
+    return ArrowTableWriter(file_name, table_name, columns, index_label=index_label, **kwargs)
+
+
+def open_table_file(data_dir: str, table_name: str) -> pa.ipc.RecordBatchFileReader:
+    """ Opens memory-mapped table, record batches are read lazily """
+    return pa.ipc.open_file(pa.memory_map(get_table_file_name(data_dir, table_name)))
+
+
+def read_table(data_dir: str, table_name: str, columns: T.Optional[T.Sequence[str]] = None) -> pa.Table:
+    """
+    Reads a table saved by ArrowTableWriter, columns which are not selected are never read from disk.
+    :param data_dir: directory with {table_name}.arrow files
+    :param table_name: name of the table in DB schema
+    :param columns: names of columns to read, all by default
+    :return: table backed by memory-mapped file (without copies, unless the file is compressed)
+    """
+    table = open_table_file(data_dir, table_name).read_all()
+    return table if columns is None else table.select(list(columns))
+
+
+def read_dataframe(data_dir: str, table_name: str, columns: T.Optional[T.Sequence[str]] = None):
+    """
+    Reads selected columns of a table into a pandas DataFrame with types of the table: integers and booleans
+    become pandas nullable dtypes (Int32, boolean) instead of floats or objects, dates stay datetime.date objects.
+    """
+    import pandas as pd  # pandas is only needed for DataFrames
+
+    pandas_types = {pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype()}
+    return read_table(data_dir, table_name, columns).to_pandas(types_mapper=pandas_types.get)
+
+
+def arrow_to_csv(data_dir: str, table_name: str, file_name: T.Optional[str] = None) -> int:
+    """
+    Converts a table to CSV, exactly the same as CSV written by the parsers (see CsvTableWriter).
+    :param data_dir: directory with {table_name}.arrow files
+    :param table_name: name of the table in DB schema
+    :param file_name: path to CSV file, by default {table_name}.csv in data_dir
+    :return: number of rows
+    """
+    reader = open_table_file(data_dir, table_name)
+    columns = reader.schema.names
+    writer = CsvTableWriter(file_name or os.path.join(data_dir, f"{table_name}.csv"), table_name, columns)
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        writer.extend(zip(*[column.to_pylist() for column in batch.columns]))
+    writer.close()
+    return writer.n_rows
+
+
+@click.command()
+@click.argument("data_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument("tables", nargs=-1)
+def main(data_dir: str, tables: T.Tuple[str, ...]):
+    """ Converts tables (all by default) saved in DATA_DIR as Arrow files to CSV files """
+    if len(tables) == 0:
+        tables = sorted(f[:-len(".arrow")] for f in os.listdir(data_dir) if f.endswith(".arrow"))
+    for table_name in tables:
+        arrow_to_csv(data_dir, table_name)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,70 @@
+"""
+Character entities declared in dblp.dtd, generated by entities.py (do not edit).
+"""
+ENTITIES = {
+    'AElig': 'Æ',
+    'Aacute': 'Á',
+    'Acirc': 'Â',
+    'Agrave': 'À',
+    'Aring': 'Å',
+    'Atilde': 'Ã',
+    'Auml': 'Ä',
+    'Ccedil': 'Ç',
+    'ETH': 'Ð',
+    'Eacute': 'É',
+    'Ecirc': 'Ê',
+    'Egrave': 'È',
+    'Euml': 'Ë',
+    'Iacute': 'Í',
+    'Icirc': 'Î',
+    'Igrave': 'Ì',
+    'Iuml': 'Ï',
+    'Ntilde': 'Ñ',
+    'Oacute': 'Ó',
+    'Ocirc': 'Ô',
+    'Ograve': 'Ò',
+    'Oslash': 'Ø',
+    'Otilde': 'Õ',
+    'Ouml': 'Ö',
+    'THORN': 'Þ',
+    'Uacute': 'Ú',
+    'Ucirc': 'Û',
+    'Ugrave': 'Ù',
+    'Uuml': 'Ü',
+    'Yacute': 'Ý',
+    'aacute': 'á',
+    'acirc': 'â',
+    'aelig': 'æ',
+    'agrave': 'à',
+    'aring': 'å',
+    'atilde': 'ã',
+    'auml': 'ä',
+    'ccedil': 'ç',
+    'eacute': 'é',
+    'ecirc': 'ê',
+    'egrave': 'è',
+    'eth': 'ð',
+    'euml': 'ë',
+    'iacute': 'í',
+    'icirc': 'î',
+    'igrave': 'ì',
+    'iuml': 'ï',
+    'micro': 'µ',
+    'ntilde': 'ñ',
+    'oacute': 'ó',
+    'ocirc': 'ô',
+    'ograve': 'ò',
+    'oslash': 'ø',
+    'otilde': 'õ',
+    'ouml': 'ö',
+    'reg': '®',
+    'szlig': 'ß',
+    'thorn': 'þ',
+    'times': '×',
+    'uacute': 'ú',
+    'ucirc': 'û',
+    'ugrave': 'ù',
+    'uuml': 'ü',
+    'yacute': 'ý',
+    'yuml': 'ÿ',
+}
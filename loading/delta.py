@@ -0,0 +1,220 @@
+"""
+Applies a new release of dblp.xml to an already loaded database, without rebuilding it.
+Publications are compared by key and mdate: only new and modified publications are parsed, their previous rows
+(and rows of publications removed from the release) are deleted and new rows inserted in a single transaction.
+Ids of already loaded persons, schools, publishers and series are reused, new rows get ids after the largest one.
+"""
+import csv
+import logging
+import os
+import tempfile
+import time
+import typing as T
+
+import click
+import psycopg2
+
+from xml_to_csv import (
+    GENERIC_DATA_TABLES, MultiTableParser, PersonTagParser, PublicationParser, TABLE_COLUMNS, DimensionTable,
+    get_all_tables_parser_classes,
+)
+
+log = logging.getLogger(__name__)
+
+""" Tables with rows of a single publication, deleted and inserted again when the publication changes """
+DEPENDENT_TABLES = ['author', 'editor'] + sorted(GENERIC_DATA_TABLES)
+
+""" Tables in order of insertion (referenced tables first) """
+INSERT_ORDER = ['person', 'school', 'publisher', 'series', 'publication'] + DEPENDENT_TABLES
+
+""" Functions of incrementally maintained derived tables (see queries/), called if they are installed """
+REFRESH_FUNCTIONS = {
+    'refresh_coauthor_graph': "coauthor_graph (queries/authors_graph_incremental.sql)",
+    'refresh_author_publications': "author_publications (queries/author_publications_read_model.sql)",
+}
+
+""" Number of rows fetched at once when reading loaded tables """
+FETCH_SIZE = 2 ** 16
+
+
+def fetch_rows(connection, query: str) -> T.Iterator[T.Tuple]:
+    """ Reads results of a query using server side cursor, so that large tables are not kept in memory twice """
+    with connection.cursor(name="delta_fetch") as cursor:
+        cursor.itersize = FETCH_SIZE
+        cursor.execute(query)
+        yield from cursor
+
+
+def fetch_max_id(connection, table_name: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f"select coalesce(max(id), -1) from {table_name}")
+        return cursor.fetchone()[0]
+
+
+class DeltaParser(MultiTableParser):
+    """
+    Parses all tables of publications which are new or modified in comparison to the loaded database.
+    Loaded publications which are not in the document are left in loaded_mdates after parsing.
+    """
+
+    _tqdm_prefix: str = "delta_parser"
+
+    def __init__(self, filename: str, connection, **kwargs):
+        """
+        :param filename: path to XML document
+        :param connection: psycopg2 connection to the loaded database
+        :param kwargs: passed to MultiTableParser
+        """
+        super(DeltaParser, self).__init__(filename, get_all_tables_parser_classes(), **kwargs)
+        self.changed_keys = list()  # modified publications, rows loaded before have to be deleted
+
+        start = time.time()
+        self.loaded_mdates = {
+            key: mdate for key, mdate in fetch_rows(connection, "select key, mdate::text from publication")
+        }
+        for parser in self.parsers:
+            if isinstance(parser, PersonTagParser):
+                for person_id, full_name, orcid in fetch_rows(connection, "select id, full_name, orcid from person"):
+                    parser._person_id[(full_name, orcid)] = person_id
+                parser._next_person_id = fetch_max_id(connection, 'person') + 1
+
+            elif isinstance(parser, PublicationParser):
+                for table_name in parser.dimensions:
+                    existing_ids = {
+                        name: relation_id
+                        for relation_id, name in fetch_rows(connection, f"select id, name from {table_name}")
+                    }
+                    parser.dimensions[table_name] = DimensionTable(
+                        TABLE_COLUMNS[table_name][1:],
+                        existing_ids=existing_ids,
+                        first_id=fetch_max_id(connection, table_name) + 1,
+                    )
+
+            else:
+                # generic parsers use the counter as id
+                parser.n_rows = fetch_max_id(connection, parser._tables[0]) + 1
+        connection.rollback()  # do not keep the snapshot open while parsing
+        end = time.time()
+        log.info(f"Loaded state of {len(self.loaded_mdates)} publications read in {end - start:.2f}s")
+
+    def _skip_publication(self, node) -> bool:
+        attributes = dict(node.attributes.items())
+        if attributes['key'] not in self.loaded_mdates:
+            return False  # new publication
+        # mdate is nullable, missing mdates are equal only to each other
+        mdate = self.loaded_mdates.pop(attributes['key'])
+        if mdate == attributes.get('mdate'):
+            return True
+        self.changed_keys.append(attributes['key'])
+        return False
+
+
+def copy_file(cursor, table_name: str, columns: T.Sequence[str], file_name: str):
+    columns = ", ".join(columns)
+    with open(file_name, newline='', encoding='utf-8') as f:
+        cursor.copy_expert(
+            f"copy {table_name} ({columns}) from stdin with (format csv, header true, force_null ({columns}))", f
+        )
+
+
+def apply_delta(connection, removed_keys_file: str, data_dir: str) -> T.Dict[str, int]:
+    """
+    Replaces rows of removed and modified publications with parsed ones in a single transaction.
+    :param connection: psycopg2 connection to the loaded database
+    :param removed_keys_file: CSV file (with header) with keys of publications which rows have to be deleted
+    :param data_dir: directory with {table_name}.csv files of new and modified publications
+    :return: mapping table name => number of inserted rows
+    """
+    n_inserted = dict()
+    with connection.cursor() as cursor:
+        cursor.execute("create temp table delta_removed (key varchar(80) primary key) on commit drop")
+        copy_file(cursor, "delta_removed", ['key'], removed_keys_file)
+        for table_name in INSERT_ORDER:
+            cursor.execute(f"create temp table delta_{table_name} (like {table_name}) on commit drop")
+            file_name = os.path.join(data_dir, f"{table_name}.csv")
+            copy_file(cursor, f"delta_{table_name}", TABLE_COLUMNS[table_name], file_name)
+
+        for table_name in DEPENDENT_TABLES:
+            cursor.execute(f"delete from {table_name} where publication_key in (select key from delta_removed)")
+            log.info(f"{table_name}: {cursor.rowcount} rows deleted")
+        cursor.execute("delete from publication where key in (select key from delta_removed)")
+        log.info(f"publication: {cursor.rowcount} rows deleted")
+
+        for table_name in INSERT_ORDER:
+            columns = ", ".join(TABLE_COLUMNS[table_name])
+            cursor.execute(f"insert into {table_name} ({columns}) select {columns} from delta_{table_name}")
+            n_inserted[table_name] = cursor.rowcount
+            log.info(f"{table_name}: {cursor.rowcount} rows inserted")
+
+            if TABLE_COLUMNS[table_name][0] == 'id':
+                # ids are assigned by the parser, serial sequences have to follow them
+                cursor.execute(
+                    f"select setval(pg_get_serial_sequence('{table_name}', 'id'), max(id)) from {table_name} "
+                    f"having max(id) is not null"
+                )
+
+        for function_name, description in REFRESH_FUNCTIONS.items():
+            cursor.execute("select to_regproc(%s) is not null", (function_name,))
+            if cursor.fetchone()[0]:
+                cursor.execute(f"select {function_name}()")
+                log.info(f"{description}: {cursor.fetchone()[0]} changes applied")
+    connection.commit()
+    return n_inserted
+
+
+def load_delta(filename: str, conninfo: str, dry_run: bool = False) -> T.Dict[str, int]:
+    """
+    Updates database (loaded from an older release) to the content of a given XML document.
+    :param filename: path to XML document
+    :param conninfo: postgres connection string
+    :param dry_run: only parse and report changes, do not modify the database
+    :return: mapping table name => number of inserted rows
+    """
+    filename = os.path.abspath(filename)
+    start = time.time()
+    connection = psycopg2.connect(conninfo)
+    connection.set_client_encoding('UTF8')
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory(prefix="delta-") as tmp_dir:
+            os.chdir(tmp_dir)  # parsers write {table_name}.csv files to current working directory
+            try:
+                parser = DeltaParser(filename, connection)
+                parser()
+            finally:
+                os.chdir(cwd)
+
+            removed_keys = parser.changed_keys + list(parser.loaded_mdates.keys())
+            log.info(
+                f"Publications: {parser.n_total_publciations} new or modified ({len(parser.changed_keys)} modified), "
+                f"{parser.n_skipped_publications} unchanged, {len(parser.loaded_mdates)} removed"
+            )
+            removed_keys_file = os.path.join(tmp_dir, "removed_keys.csv")
+            with open(removed_keys_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['key'])
+                writer.writerows([key] for key in removed_keys)
+
+            if dry_run:
+                return dict()
+            n_inserted = apply_delta(connection, removed_keys_file, tmp_dir)
+    finally:
+        connection.close()
+
+    end = time.time()
+    log.info(f"Delta applied in {end - start:.2f}s")
+    return n_inserted
+
+
+@click.command()
+@click.argument("filename", type=click.Path(exists=True, dir_okay=False))
+@click.argument("conninfo", type=str)
+@click.option("--dry-run", is_flag=True, help="only report the number of changed publications")
+def main(filename: str, conninfo: str, dry_run: bool):
+    """ Updates database (CONNINFO) to a new release of dblp (FILENAME) """
+    load_delta(filename, conninfo, dry_run)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,349 @@
+"""
+Streaming engines, which read dblp XML and produce publication-level events consumed by TagParser.
+Every engine emits the same events and nodes with the same interface (tagName, attributes and inner text),
+so parsers do not depend on the engine they are used with.
+Character entities are taken from the table generated from dblp.dtd (see entities.py), the DTD is never loaded.
+"""
+import os
+import re
+import time
+import typing as T
+from xml.dom import pulldom
+from xml.dom.minidom import Element
+from xml.parsers import expat
+
+from entities import ENTITIES, DecodedDocument, with_internal_subset
+
+""" Events emitted by the engines """
+START_PUBLICATION = 'START_PUBLICATION'
+END_PUBLICATION = 'END_PUBLICATION'
+FIELD = 'FIELD'  # one of the requested tags inside a publication, with its entire content
+OMITTED = 'OMITTED'  # tag outside of any publication
+
+
+""" Size of chunks in which the file is searched for boundaries of publications """
+SEARCH_CHUNK_SIZE = 2 ** 20
+
+
+def _record_start_regex(record_tags: T.Set[str]) -> T.Pattern:
+    """ Start tags of publications, which always begin in a new line of dblp.xml """
+    tags = b"|".join(re.escape(t.encode()) for t in sorted(record_tags))
+    return re.compile(b"\n<(?:" + tags + b")[\s>]")
+
+
+def find_record_start(f: T.BinaryIO, offset: int, record_tags: T.Set[str]) -> T.Optional[int]:
+    """
+    Finds the first start tag of a publication after a given offset.
+    :param f: XML document opened in binary mode
+    :param offset: byte offset from which the search starts
+    :param record_tags: names of top-level tags containing a single publication
+    :return: byte offset of the start tag, None if there are no more publications
+    """
+    regex = _record_start_regex(record_tags)
+    f.seek(max(offset - 1, 0))  # new line preceding the tag may be right before the offset
+    position = f.tell()
+    tail = b""
+    while True:
+        chunk = f.read(SEARCH_CHUNK_SIZE)
+        if len(chunk) == 0:
+            return None
+        data = tail + chunk
+        match = regex.search(data)
+        if match is not None:
+            return position - len(tail) + match.start() + 1
+        tail = data[-64:]  # so that tags split between chunks are found
+        position += len(chunk)
+
+
+def find_tag_end(filename: str, offset: int) -> int:
+    """ Returns byte offset right after a tag starting at a given offset (eg. closing tag of a publication). """
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        position = offset
+        while True:
+            chunk = f.read(2 ** 10)
+            if len(chunk) == 0:
+                raise ValueError(f"Tag starting at {offset} is not closed")
+            end = chunk.find(b">")
+            if end >= 0:
+                return position + end + 1
+            position += len(chunk)
+
+
+def read_prolog(filename: str, record_tags: T.Set[str]) -> bytes:
+    """ Returns everything before the first publication: XML declaration, doctype and opening tag of the root. """
+    with open(filename, 'rb') as f:
+        start = find_record_start(f, 0, record_tags)
+        f.seek(0)
+        return f.read(start)
+
+
+def split_document(filename: str, n_shards: int, record_tags: T.Set[str]) -> T.List[T.Tuple[int, int]]:
+    """
+    Splits document into byte ranges of similar size, aligned to start tags of publications.
+    Every range can be parsed independently by ExpatEngine, ranges are returned in document order.
+    :param filename: path to XML document
+    :param n_shards: maximum number of returned ranges
+    :param record_tags: names of top-level tags containing a single publication
+    :return: list of (start, end) byte offsets
+    """
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        boundaries = [find_record_start(f, 0, record_tags)]
+        for i in range(1, n_shards):
+            boundary = find_record_start(f, max(size * i // n_shards, boundaries[-1] + 1), record_tags)
+            if boundary is None:
+                break
+            boundaries.append(boundary)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+class Node(object):
+    """ Lightweight replacement of minidom Element, storing XML contained within the tag as a string. """
+    __slots__ = ('tagName', 'attributes', 'text', 'offset')
+
+    def __init__(
+            self,
+            tag_name: str,
+            attributes: T.Dict[str, str],
+            text: T.Optional[str] = None,
+            offset: T.Optional[int] = None,
+    ):
+        self.tagName = tag_name
+        self.attributes = attributes
+        self.text = text
+        self.offset = offset  # byte offset of the closing tag in the document (END_PUBLICATION only)
+
+    def __repr__(self):
+        return f"<Node {self.tagName} {self.attributes}>"
+
+
+def escape_text(data: str) -> str:
+    """ Escapes text the same way as minidom does when serializing a node (toxml). """
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+class PulldomEngine(object):
+    """
+    Original engine: pulldom events, every requested tag is expanded to a minidom Element.
+    The document is read through DecodedDocument, which expands entities before they reach the parser.
+    """
+
+    def __init__(
+            self,
+            filename: str,
+            record_tags: T.Set[str],
+            field_tags: T.Set[str],
+            entities: T.Dict[str, str] = ENTITIES,
+    ):
+        """
+        :param filename: path to XML document
+        :param record_tags: names of top-level tags containing a single publication
+        :param field_tags: names of tags inside a publication which should be emitted as FIELD events
+        :param entities: mapping of character entities used in the document
+        """
+        self.record_tags = record_tags
+        self.field_tags = field_tags
+        self.start, self.end = 0, os.path.getsize(filename)  # parsed part of the document
+        self.parse_time = 0.0  # seconds spent reading and parsing the document
+        self._file = DecodedDocument(filename, entities)
+        self.doc = pulldom.parse(self._file, bufsize=2 ** 14)
+        # pulldom reads and parses the document in chunks (also when expanding nodes), which are timed instead of events
+        self.doc.stream.read = self._timed(self.doc.stream.read)
+        self.doc.parser.feed = self._timed(self.doc.parser.feed)  # also called by close of the parser
+
+    def _timed(self, function: T.Callable) -> T.Callable:
+        """ Wraps a function, so that time of its calls is added to parse_time """
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.parse_time += clock() - start
+
+        return timed
+
+    @property
+    def position(self) -> int:
+        """ Byte offset up to which the document was read """
+        return self.end if self._file.closed else self._file.tell()
+
+    def __iter__(self) -> T.Iterator[T.Tuple[str, Element]]:
+        in_record = False
+        try:
+            for event, node in self.doc:
+                if event == pulldom.START_ELEMENT:
+                    if node.tagName in self.record_tags:
+                        in_record = True
+                        yield START_PUBLICATION, node
+                    elif not in_record:
+                        yield OMITTED, node
+                    elif node.tagName in self.field_tags:
+                        self.doc.expandNode(node)
+                        yield FIELD, node
+
+                elif event == pulldom.END_ELEMENT and node.tagName in self.record_tags:
+                    in_record = False
+                    yield END_PUBLICATION, node
+        finally:
+            self._file.close()
+
+
+class ExpatEngine(object):
+    """
+    Lightweight engine using expat callbacks directly: no DOM is built, inner text of requested tags
+    is collected while parsing and every publication is discarded right after its events are consumed.
+    Prolog of the document is replaced with one declaring entities from the table, so expat expands them itself
+    and offsets of publications are offsets in the document.
+    """
+
+    def __init__(
+            self,
+            filename: str,
+            record_tags: T.Set[str],
+            field_tags: T.Set[str],
+            bufsize: int = 2 ** 16,
+            byte_range: T.Optional[T.Tuple[int, int]] = None,
+            entities: T.Dict[str, str] = ENTITIES,
+    ):
+        """
+        :param filename: path to XML document
+        :param record_tags: names of top-level tags containing a single publication
+        :param field_tags: names of tags inside a publication which should be emitted as FIELD events
+        :param bufsize: size of chunks read from the file
+        :param byte_range: (start, end) offsets of a part of the document to parse (see split_document)
+        :param entities: mapping of character entities used in the document
+        """
+        self.filename = filename
+        self.record_tags = record_tags
+        self.field_tags = field_tags
+        self.bufsize = bufsize
+        self.byte_range = byte_range
+        self.entities = entities
+        # parsed part of the document and offset up to which it was read
+        self.start, self.end = byte_range if byte_range is not None else (0, os.path.getsize(filename))
+        self.position = self.start
+        self.parse_time = 0.0  # seconds spent reading and parsing the document (including collecting inner text)
+
+        self._events = list()
+        self._in_record = False
+        self._field = None  # currently collected field
+        self._field_depth = 0  # depth of tags nested within currently collected field
+        self._pieces = list()  # inner XML of currently collected field
+        self._open_tag_pending = False  # nested start tag written without closing '>' (to write empty tags as minidom)
+        self._offset_shift = 0  # difference between offsets in the document and offsets in data passed to expat
+
+    def _create_parser(self):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._character_data
+        return parser
+
+    def _close_pending_tag(self):
+        if self._open_tag_pending:
+            self._pieces.append(">")
+            self._open_tag_pending = False
+
+    def _start_element(self, tag: str, attrs: T.Dict[str, str]):
+        if self._field is not None:
+            self._close_pending_tag()
+            self._pieces.append("<" + tag)
+            for k, v in attrs.items():
+                self._pieces.append(f" {k}=\"{escape_text(v)}\"")
+            self._open_tag_pending = True
+            self._field_depth += 1
+        elif tag in self.record_tags:
+            self._in_record = True
+            self._events.append((START_PUBLICATION, Node(tag, attrs)))
+        elif not self._in_record:
+            self._events.append((OMITTED, Node(tag, attrs)))
+        elif tag in self.field_tags:
+            self._field = Node(tag, attrs)
+            self._field_depth = 0
+
+    def _end_element(self, tag: str):
+        if self._field is not None:
+            if self._field_depth == 0:
+                self._field.text = "".join(self._pieces)
+                self._events.append((FIELD, self._field))
+                self._field = None
+                self._pieces = list()
+            else:
+                if self._open_tag_pending:
+                    self._pieces.append("/>")
+                    self._open_tag_pending = False
+                else:
+                    self._pieces.append(f"</{tag}>")
+                self._field_depth -= 1
+        elif tag in self.record_tags:
+            self._in_record = False
+            offset = self._parser.CurrentByteIndex + self._offset_shift
+            self._events.append((END_PUBLICATION, Node(tag, {}, offset=offset)))
+
+    def _character_data(self, data: str):
+        if self._field is not None:
+            self._close_pending_tag()
+            self._pieces.append(escape_text(data))
+
+    def _parse(self, data: bytes, final: bool):
+        try:
+            self._parser.Parse(data, final)
+        except expat.ExpatError as e:
+            if e.code == expat.errors.codes[expat.errors.XML_ERROR_UNDEFINED_ENTITY]:
+                raise ValueError(
+                    f"{e} of {self.filename}, regenerate the table of entities from its DTD (see entities.py)"
+                ) from e
+            raise
+
+    def _get_range_wrapper(self) -> T.Tuple[T.Tuple[int, int], bytes, bytes]:
+        """
+        Returns parsed byte range (publications of the whole document, if no range was given) with prolog
+        and closing tag of the root, which make it a complete XML document (with entities declared in the prolog)
+        """
+        prolog = read_prolog(self.filename, self.record_tags)
+        size = os.path.getsize(self.filename)
+        start, end = self.byte_range if self.byte_range is not None else (len(prolog), size)
+        if end == size:
+            return (start, end), with_internal_subset(prolog, self.entities), b""  # last part contains closing tag
+        root_tag = re.search(rb"<([^\s<>/?!]+)[^<>]*>\s*$", prolog).group(1)
+        return (start, end), with_internal_subset(prolog, self.entities), b"</" + root_tag + b">"
+
+    def __iter__(self) -> T.Iterator[T.Tuple[str, Node]]:
+        start = time.perf_counter()
+        self._parser = self._create_parser()
+        with open(self.filename, 'rb') as f:
+            (range_start, range_end), prefix, suffix = self._get_range_wrapper()
+            f.seek(range_start)
+            self.position = range_start
+            remaining = range_end - range_start
+            self._offset_shift = range_start - len(prefix)
+
+            self._parse(prefix, False)
+            while remaining > 0:
+                chunk = f.read(min(self.bufsize, remaining))
+                if len(chunk) == 0:
+                    break
+                remaining -= len(chunk)
+                self._parse(chunk, False)
+                self.position += len(chunk)
+                self.parse_time += time.perf_counter() - start
+                yield from self._events
+                self._events.clear()
+                start = time.perf_counter()
+
+            self._parse(suffix, True)
+            self.parse_time += time.perf_counter() - start
+            yield from self._events
+            self._events.clear()
+
+
+""" Engines available for TagParser """
+ENGINES = {
+    'expat': ExpatEngine,
+    'pulldom': PulldomEngine,
+}
@@ -0,0 +1,182 @@
+"""
+Character entities of dblp (defined in dblp.dtd), resolved in advance instead of loading the DTD with every parser.
+The table (dblp_entities.py) is generated from the DTD once with `python loading/entities.py data/dblp.dtd`.
+ExpatEngine passes the table to expat as an internal subset of the document type declaration, so entities are
+still expanded by expat itself and byte offsets in the document stay exact (see engines.py).
+Parsers which read the document as a stream (pulldom, ElementTree) read it through DecodedDocument instead,
+which expands entities and converts the document to UTF-8 in a single pass, without any DTD.
+"""
+import codecs
+import logging
+import os
+import re
+import typing as T
+
+import click
+
+from dblp_entities import ENTITIES
+
+log = logging.getLogger(__name__)
+
+""" Entities predefined by XML, they are never expanded by DecodedDocument (they would be taken for markup) """
+PREDEFINED_ENTITIES = {'amp', 'lt', 'gt', 'quot', 'apos'}
+
+""" Maximal length of an entity reference (&name;), longer tails of chunks are not held back by DecodedDocument """
+MAX_REFERENCE_LENGTH = 64
+
+_ENTITY_DECLARATION = re.compile(r'<!ENTITY\s+([A-Za-z_][\w.-]*)\s+(["\'])(.*?)\2\s*>', re.DOTALL)
+_CHARACTER_REFERENCE = re.compile(r'&#(x[0-9a-fA-F]+|[0-9]+);')
+_ENTITY_REFERENCE = re.compile(r'&([A-Za-z_][\w.-]*);')
+_XML_DECLARATION = re.compile(rb'^\s*<\?xml[^>]*\?>')
+_ENCODING = re.compile(rb'encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+_DOCTYPE = re.compile(rb'<!DOCTYPE\s+([^\s\[>]+)[^\[>]*(?:\[.*?\]\s*)?>', re.DOTALL)
+_ROOT_TAG = re.compile(rb'<([^\s<>/?!]+)')
+
+
+def read_dtd_entities(filename: str) -> T.Dict[str, str]:
+    """
+    Reads general entities declared in a DTD, parameter entities and entities in comments are skipped.
+    :param filename: path to DTD file
+    :return: mapping entity name => replacement text (with character references resolved)
+    """
+    with open(filename, encoding='utf-8', errors='replace') as f:
+        dtd = re.sub(r'<!--.*?-->', '', f.read(), flags=re.DOTALL)
+
+    def resolve(match: T.Match) -> str:
+        code = match.group(1)
+        return chr(int(code[1:], 16) if code.startswith('x') else int(code))
+
+    return {
+        match.group(1): _CHARACTER_REFERENCE.sub(resolve, match.group(3)) for match in _ENTITY_DECLARATION.finditer(dtd)
+    }
+
+
+def write_entity_table(entities: T.Dict[str, str], filename: str, source: str):
+    """ Saves entities as a python module with ENTITIES dict """
+    lines = [
+        f'"""\nCharacter entities declared in {source}, generated by entities.py (do not edit).\n"""',
+        'ENTITIES = {',
+        *[f"    {name!r}: {value!r}," for name, value in sorted(entities.items())],
+        '}',
+    ]
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def internal_subset(root_tag: str, entities: T.Dict[str, str] = ENTITIES) -> bytes:
+    """ Returns document type declaration with entities declared inline (as character references) """
+    # in a single line, so that lines reported by the parser are still lines of the document
+    declarations = "".join(
+        f'<!ENTITY {name} "{"".join(f"&#{ord(c)};" for c in value)}">' for name, value in sorted(entities.items())
+    )
+    return f"<!DOCTYPE {root_tag} [{declarations}]>".encode('ascii')
+
+
+def with_internal_subset(prolog: bytes, entities: T.Dict[str, str] = ENTITIES) -> bytes:
+    """ Replaces document type declaration of a prolog (referencing dblp.dtd) with declarations of given entities """
+    match = _DOCTYPE.search(prolog)
+    if match is not None:
+        return prolog[:match.start()] + internal_subset(match.group(1).decode(), entities) + prolog[match.end():]
+    declaration = _XML_DECLARATION.match(prolog)
+    position = declaration.end() if declaration is not None else 0
+    root_tag = _ROOT_TAG.search(prolog, position).group(1)
+    return prolog[:position] + internal_subset(root_tag.decode(), entities) + prolog[position:]
+
+
+class DecodedDocument(object):
+    """
+    Binary file-like view of an XML document converted to UTF-8, with entities from the table expanded and
+    document type declaration removed, so that it can be parsed without DTD by any XML parser.
+    """
+
+    def __init__(self, filename: str, entities: T.Dict[str, str] = ENTITIES, bufsize: int = 2 ** 16):
+        """
+        :param filename: path to XML document
+        :param entities: mapping entity name => replacement text
+        :param bufsize: size of chunks read from the file
+        """
+        self.bufsize = bufsize
+        # replacement texts containing markup characters are kept as character references
+        self.replacements = {
+            name: "".join(f"&#{ord(c)};" if c in '<&' else c for c in value)
+            for name, value in entities.items() if name not in PREDEFINED_ENTITIES
+        }
+        self._file = open(filename, 'rb')
+        self._tail = ""  # end of the last chunk which can be a beginning of an entity reference
+        self._eof = False
+        self._buffer = self._read_prolog()
+
+    def _read_prolog(self) -> bytes:
+        head = self._file.read(self.bufsize)
+        while _ROOT_TAG.search(head) is None:  # prolog ends with the start tag of the root
+            chunk = self._file.read(self.bufsize)
+            if len(chunk) == 0:
+                break
+            head += chunk
+        declaration = _XML_DECLARATION.match(head)
+        encoding = 'utf-8'
+        if declaration is not None:
+            match = _ENCODING.search(declaration.group(0))
+            encoding = match.group(1).decode() if match is not None else encoding
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        start = declaration.end() if declaration is not None else 0
+        doctype = _DOCTYPE.match(head, re.match(rb'\s*', head[start:]).end() + start)
+        start = doctype.end() if doctype is not None else start
+        return b'<?xml version="1.0" encoding="UTF-8"?>' + self._decode(head[start:])
+
+    def _replace(self, match: T.Match) -> str:
+        return self.replacements.get(match.group(1), match.group(0))
+
+    def _decode(self, chunk: bytes, final: bool = False) -> bytes:
+        text = self._tail + self._decoder.decode(chunk, final)
+        self._tail = ""
+        reference_start = text.rfind('&', max(len(text) - MAX_REFERENCE_LENGTH, 0))
+        if not final and reference_start >= 0 and text.find(';', reference_start) < 0:
+            text, self._tail = text[:reference_start], text[reference_start:]
+        return _ENTITY_REFERENCE.sub(self._replace, text).encode('utf-8')
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._file.read(self.bufsize)
+            self._eof = len(chunk) == 0
+            self._buffer += self._decode(chunk, final=self._eof)
+        if size < 0 or size >= len(self._buffer):
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def tell(self) -> int:
+        """ Byte offset up to which the original document was read """
+        return self._file.tell()
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@click.command()
+@click.argument("dtd", type=click.Path(exists=True, dir_okay=False), default='data/dblp.dtd')
+@click.option(
+    "-o", "--output", type=click.Path(dir_okay=False), help="path to generated module",
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dblp_entities.py'),
+)
+def main(dtd: str, output: str):
+    """ Generates table of character entities (dblp_entities.py) from DTD """
+    logging.basicConfig(level=logging.INFO)
+    entities = read_dtd_entities(dtd)
+    write_entity_table(entities, output, os.path.basename(dtd))
+    log.info(f"{len(entities)} entities saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Instrumentation of the parsers (see xml_to_csv.py): progress in bytes of the document, publications and rows
+per second, time spent in every phase of parsing and sampled memory usage, saved in a JSON report of every run.
+"""
+import json
+import logging
+import os
+import resource
+import sys
+import time
+import typing as T
+
+log = logging.getLogger(__name__)
+
+""" Phases of parsing: reading the document by the engine, extracting inner text of tags, mapping values to rows
+(with dispatching events, validation and interning, computed as the rest of the time), writing rows to outputs
+and waiting for other processes """
+PHASES = ('parsing', 'extraction', 'mapping', 'writing', 'waiting')
+
+""" Seconds between samples of memory usage """
+RSS_SAMPLE_INTERVAL = 1.0
+
+""" Publications between checks whether the next sample should be taken (the clock is not read after every one) """
+SAMPLE_CHECK_PUBLICATIONS = 2 ** 8
+
+""" Every n-th extraction of inner text of a minidom node is timed, its time is counted n times """
+EXTRACTION_SAMPLE_INTERVAL = 2 ** 6
+
+
+def current_rss() -> int:
+    """ Returns resident set size of the process in bytes (peak size where /proc is not available) """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 2 ** 10  # bytes on macOS, kilobytes elsewhere
+
+
+class ParserStats(object):
+    """
+    Statistics of a single parser run (or a shard, or merging of shards), collected on the hot path,
+    so times of phases are only added to a dict and memory is sampled once in a while.
+    Parsing and writing are timed by engines and table writers themselves (per chunk and per batch of rows).
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: name of the parser in the report
+        """
+        self.name = name
+        self.phases = {phase: 0.0 for phase in PHASES}  # seconds, mapping is computed at the end
+        self.start_offset = 0
+        self.end_offset = 0
+        self.position = 0
+        self.n_publications = 0
+        self.n_rows = dict()
+        self.rss_samples = list()  # (seconds since start, byte offset, publications, RSS in bytes)
+        self._start_time = None
+        self._end_time = None
+        self._next_sample = 0.0
+
+    def start(self, start_offset: int = 0, end_offset: int = 0):
+        """
+        :param start_offset: byte offset of the first parsed byte of the document
+        :param end_offset: byte offset after the last parsed byte
+        """
+        self.start_offset, self.end_offset, self.position = start_offset, end_offset, start_offset
+        self._start_time = time.perf_counter()
+        self.sample(start_offset, 0)
+
+    def sample(self, position: int, n_publications: int):
+        """ Records progress and takes a sample of memory usage, if enough time has passed since the last one """
+        now = time.perf_counter()
+        self.position, self.n_publications = position, n_publications
+        if now >= self._next_sample:
+            self.rss_samples.append((round(now - self._start_time, 3), position, n_publications, current_rss()))
+            self._next_sample = now + RSS_SAMPLE_INTERVAL
+
+    def finish(self, position: int, n_publications: int, n_rows: T.Dict[str, int]):
+        """ Called after all outputs are closed, takes the last sample """
+        self._next_sample = 0.0
+        self.sample(position, n_publications)
+        self._end_time = time.perf_counter()
+        self.n_rows = dict(n_rows)
+
+    def timed(self, iterable: T.Iterable, phase: str = 'parsing') -> T.Iterator:
+        """ Yields items of an iterable, time of producing them is added to a given phase """
+        clock, phases = time.perf_counter, self.phases
+        iterator = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                phases[phase] += clock() - start
+                return
+            phases[phase] += clock() - start
+            yield item
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        wall_time = (self._end_time or time.perf_counter()) - self._start_time
+        phases = dict(self.phases)
+        phases['mapping'] = max(wall_time - sum(t for phase, t in phases.items() if phase != 'mapping'), 0.0)
+        n_bytes = self.position - self.start_offset
+        n_rows = sum(self.n_rows.values())
+        return {
+            'name': self.name,
+            'byte_range': [self.start_offset, self.end_offset],
+            'bytes': n_bytes,
+            'publications': self.n_publications,
+            'rows': n_rows,
+            'wall_time_s': wall_time,
+            'bytes_per_s': n_bytes / wall_time if wall_time > 0 else None,
+            'publications_per_s': self.n_publications / wall_time if wall_time > 0 else None,
+            'rows_per_s': n_rows / wall_time if wall_time > 0 else None,
+            'phases_s': {phase: phases[phase] for phase in PHASES},
+            'max_rss': max(sample[3] for sample in self.rss_samples) if self.rss_samples else None,
+            'rss_samples': self.rss_samples,
+            'tables': self.n_rows,
+        }
+
+
+def save_report(file_name: str, run: T.Dict[str, T.Any], parsers: T.Sequence[T.Dict[str, T.Any]]):
+    """
+    Saves JSON report of a run and logs a summary of it.
+    :param file_name: path to the report
+    :param run: description of the run (target, document, engine, wall time, etc.)
+    :param parsers: results of ParserStats.to_dict of every parser (or shard) of the run
+    """
+    totals = {phase: sum(p['phases_s'][phase] for p in parsers) for phase in PHASES}
+    total_time = sum(totals.values())
+    report = {
+        **run,
+        'phases_s': totals,
+        'max_rss': max((p['max_rss'] or 0 for p in parsers), default=None),
+        'parsers': list(parsers),
+    }
+    with open(file_name, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if total_time > 0:
+        log.info("Time split: " + ", ".join(f"{phase} {100 * t / total_time:.1f}%" for phase, t in totals.items()))
+    log.info(f"Report saved to {file_name}")
@@ -0,0 +1,314 @@
+"""
+Compact replacement of the dict mapping (full_name, orcid) => person id, used to deduplicate persons while parsing.
+Names are encoded once into a contiguous byte arena and every person takes only a few machine words in typed columns
+(offset of the name, orcid packed into an integer, hash, id) and an open addressing hash table of entry numbers,
+instead of Python objects (see PersonTable). With a memory budget the table is flushed, when it exceeds the budget,
+into a run on disk: the same columns sorted by hashes, saved as .npy files and memory-mapped, so a lookup is
+a binary search in mapped hashes and a comparison of a single name. Runs of similar size are merged (like in
+a log-structured merge tree), so there are only a few of them and every entry is rewritten only a few times.
+"""
+import os
+import re
+import shutil
+import tempfile
+import typing as T
+import weakref
+import zlib
+from array import array
+
+import numpy as np
+
+""" Initial number of slots of the hash table, doubled when it is half full """
+INITIAL_SLOTS = 2 ** 10
+
+""" Number of insertions between checks of the memory budget """
+BUDGET_CHECK_INTERVAL = 2 ** 10
+
+""" Arrays of a run, saved as {run}-{name}.npy files """
+RUN_ARRAYS = ('hashes', 'ids', 'orcids', 'starts', 'lengths', 'arena')
+
+""" Code of a missing orcid, orcids which are not in the standard format get codes below it """
+NO_ORCID = -1
+
+""" Odd multiplier (Knuth's multiplicative hashing) mixing orcid codes into hashes of names """
+ORCID_MULTIPLIER = 2654435761
+
+EMPTY = -1
+
+_ORCID = re.compile(r'(\d{4})-(\d{4})-(\d{4})-(\d{3}[\dX])')
+
+PersonKey = T.Tuple[str, T.Optional[str]]
+
+
+def encode_orcid(orcid: str) -> T.Optional[int]:
+    """ Packs an orcid (16 digits, the last one can be X) into a non-negative integer, None for other formats """
+    match = _ORCID.fullmatch(orcid)
+    if match is None:
+        return None
+    digits = "".join(match.groups())
+    return int(digits[:15]) * 11 + (10 if digits[15] == 'X' else int(digits[15]))
+
+
+def key_hash(name: bytes, orcid: int) -> int:
+    """
+    32 bit hash of an encoded key, the same in every process (unlike hash of bytes), as tables are pickled.
+    Keys with equal hashes are told apart by comparing them, so a short hash only costs a few comparisons.
+    """
+    return (zlib.crc32(name) ^ (orcid * ORCID_MULTIPLIER)) & 0xFFFFFFFF
+
+
+class PersonTable(object):
+    """ Open addressing (linear probing) hash table of persons, names are stored in a single arena """
+
+    def __init__(self):
+        self.arena = bytearray()
+        self.offsets = array('q', [0])  # name of entry i is arena[offsets[i]:offsets[i + 1]]
+        self.orcids = array('q')
+        self.hashes = array('I')
+        self.ids = array('q')
+        self.slots = array('i', [EMPTY]) * INITIAL_SLOTS  # entry numbers
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.offsets, self.orcids, self.hashes, self.ids, self.slots)
+        return len(self.arena) + sum(a.itemsize * len(a) for a in arrays)
+
+    def _find_slot(self, name: bytes, orcid: int, h: int) -> int:
+        """ Returns slot of the key, or the empty slot where it should be inserted """
+        slots, hashes = self.slots, self.hashes
+        mask = len(slots) - 1
+        slot = h & mask
+        while True:
+            entry = slots[slot]
+            if entry == EMPTY:
+                return slot
+            if (
+                    hashes[entry] == h and self.orcids[entry] == orcid
+                    and self.arena[self.offsets[entry]:self.offsets[entry + 1]] == name
+            ):
+                return slot
+            slot = (slot + 1) & mask
+
+    def get(self, name: bytes, orcid: int, h: int) -> T.Optional[int]:
+        entry = self.slots[self._find_slot(name, orcid, h)]
+        return None if entry == EMPTY else self.ids[entry]
+
+    def set(self, name: bytes, orcid: int, h: int, value: int) -> bool:
+        """ Returns True if a new entry was added """
+        slot = self._find_slot(name, orcid, h)
+        ids, slots = self.ids, self.slots
+        if slots[slot] != EMPTY:
+            ids[slots[slot]] = value
+            return False
+
+        slots[slot] = len(ids)
+        arena = self.arena
+        arena += name
+        self.offsets.append(len(arena))
+        self.orcids.append(orcid)
+        self.hashes.append(h)
+        ids.append(value)
+        if 2 * len(ids) > len(slots):
+            self._grow()
+        return True
+
+    def _grow(self):
+        n_slots = 2 * len(self.slots)
+        homes = np.array(self.hashes, dtype=np.int64) & (n_slots - 1)
+        entries = np.argsort(homes, kind='stable')
+        # entries sorted by home slots are placed one after another, every one at its home slot or right after
+        # the previous one, so all slots between the home slot and the slot of an entry are occupied (as probed)
+        steps = np.arange(len(entries))
+        positions = np.maximum.accumulate(homes[entries] - steps) + steps
+        fits = positions < n_slots
+        slots = np.full(n_slots, EMPTY, dtype=np.int32)
+        slots[positions[fits]] = entries[fits]
+        self.slots = array('i', slots.tobytes())
+        mask = n_slots - 1
+        for entry in entries[~fits].tolist():  # the end of the table is followed by its beginning
+            slot = self.hashes[entry] & mask
+            while self.slots[slot] != EMPTY:
+                slot = (slot + 1) & mask
+            self.slots[slot] = entry
+
+    def to_arrays(self) -> T.Dict[str, np.ndarray]:
+        """ Returns entries sorted by hashes, as arrays of a run (see RUN_ARRAYS) """
+        hashes = np.array(self.hashes, dtype=np.uint32)
+        offsets = np.array(self.offsets, dtype=np.int64)
+        order = np.argsort(hashes, kind='stable')
+        return {
+            'hashes': hashes[order],
+            'ids': np.array(self.ids, dtype=np.int64)[order],
+            'orcids': np.array(self.orcids, dtype=np.int64)[order],
+            'starts': offsets[:-1][order],
+            'lengths': np.diff(offsets).astype(np.int32)[order],
+            'arena': np.frombuffer(bytes(self.arena), dtype=np.uint8),
+        }
+
+
+class SpilledRun(object):
+    """ Entries sorted by hashes of keys, in memory-mapped arrays (see RUN_ARRAYS) """
+
+    def __init__(self, path: str):
+        """
+        :param path: prefix of paths to .npy files of the arrays
+        """
+        self.path = path
+        # plain views of mapped arrays, indexing np.memmap creates a memmap object for every element
+        arrays = {name: np.load(f"{path}-{name}.npy", mmap_mode='r').view(np.ndarray) for name in RUN_ARRAYS}
+        self.hashes, self.ids, self.orcids = arrays['hashes'], arrays['ids'], arrays['orcids']
+        self.starts, self.lengths, self.arena = arrays['starts'], arrays['lengths'], arrays['arena']
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def get(self, name: bytes, orcid: int, h: np.uint32) -> T.Optional[int]:
+        i = int(self.hashes.searchsorted(h))
+        # entries with the same hash are compared by keys, the first one is the most recent
+        while i < len(self.hashes) and self.hashes[i] == h:
+            start = int(self.starts[i])
+            if self.orcids[i] == orcid and self.arena[start:start + int(self.lengths[i])].tobytes() == name:
+                return int(self.ids[i])
+            i += 1
+        return None
+
+    def to_arrays(self) -> T.Dict[str, np.ndarray]:
+        return {name: np.array(getattr(self, name)) for name in RUN_ARRAYS}
+
+    def remove(self):
+        # mapped arrays stay valid until they are released, files are removed from the directory right away
+        for name in RUN_ARRAYS:
+            os.remove(f"{self.path}-{name}.npy")
+
+    @classmethod
+    def write(cls, path: str, arrays: T.Dict[str, np.ndarray]) -> 'SpilledRun':
+        for name in RUN_ARRAYS:
+            np.save(f"{path}-{name}.npy", arrays[name])
+        return cls(path)
+
+    @classmethod
+    def merge(cls, path: str, newer: 'SpilledRun', older: 'SpilledRun') -> 'SpilledRun':
+        """ Merges sorted runs in one pass, entries of the newer run precede older entries with equal hashes """
+        new_positions = np.arange(len(newer)) + older.hashes.searchsorted(newer.hashes, side='left')
+        old_positions = np.arange(len(older)) + newer.hashes.searchsorted(older.hashes, side='right')
+        arrays = dict()
+        for name in ('hashes', 'ids', 'orcids', 'starts', 'lengths'):
+            arrays[name] = np.empty(len(newer) + len(older), dtype=getattr(newer, name).dtype)
+            arrays[name][new_positions] = getattr(newer, name)
+            arrays[name][old_positions] = getattr(older, name)
+        arrays['starts'][old_positions] += len(newer.arena)  # names of the older run follow names of the newer one
+        arrays['arena'] = np.concatenate([newer.arena, older.arena])
+        return cls.write(path, arrays)
+
+
+class PersonInterner(object):
+    """
+    Mapping (full_name, orcid) => person id with the interface of a dict (get, [], in, len),
+    keeping new entries in a PersonTable and flushing it to runs on disk when it exceeds the memory budget.
+    """
+
+    def __init__(self, memory_budget: T.Optional[int] = None, spill_dir: T.Optional[str] = None):
+        """
+        :param memory_budget: maximal number of bytes of the table kept in memory, unlimited by default
+        :param spill_dir: directory in which a temporary directory for runs is created
+        """
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.n_spills = 0
+        self.table = PersonTable()  # entries added since the last flush
+        self.runs: T.List[SpilledRun] = list()  # from the oldest to the newest
+        self.other_orcids: T.Dict[str, int] = dict()  # orcids which are not in the standard format => codes
+        self._n_entries = 0
+        self._n_runs_created = 0
+        self._spill_path = None  # created with the first run, removed with the interner
+
+    def __len__(self):
+        return self._n_entries
+
+    def __contains__(self, key: PersonKey) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: PersonKey) -> int:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: PersonKey, value: int):
+        name, orcid, h = self._encode(key, add=True)
+        if self.table.set(name, orcid, h, value):
+            if not self.runs or self._get_spilled(name, orcid, h) is None:
+                self._n_entries += 1
+            if self.memory_budget is not None and len(self.table) % BUDGET_CHECK_INTERVAL == 0:
+                self._enforce_budget()
+
+    def get(self, key: PersonKey, default: T.Optional[int] = None) -> T.Optional[int]:
+        encoded = self._encode(key)
+        if encoded is None:
+            return default
+        value = self.table.get(*encoded)
+        if value is None and self.runs:
+            value = self._get_spilled(*encoded)
+        return default if value is None else value
+
+    @property
+    def nbytes(self) -> int:
+        """ Size of the table kept in memory """
+        return self.table.nbytes
+
+    def _encode(self, key: PersonKey, add: bool = False) -> T.Optional[T.Tuple[bytes, int, int]]:
+        """ Returns (name, orcid code, hash) of a key, None if its orcid was never added """
+        full_name, orcid = key
+        code = NO_ORCID if orcid is None else encode_orcid(orcid)
+        if code is None:
+            code = self.other_orcids.get(orcid)
+            if code is None:
+                if not add:
+                    return None
+                code = self.other_orcids[orcid] = NO_ORCID - 1 - len(self.other_orcids)
+        name = full_name.encode('utf-8')
+        return name, code, key_hash(name, code)
+
+    def _get_spilled(self, name: bytes, orcid: int, h: int) -> T.Optional[int]:
+        h = np.uint32(h)
+        for run in reversed(self.runs):
+            value = run.get(name, orcid, h)
+            if value is not None:
+                return value
+        return None
+
+    def _new_run_path(self) -> str:
+        if self._spill_path is None:
+            self._spill_path = tempfile.mkdtemp(prefix="persons-", dir=self.spill_dir)
+            weakref.finalize(self, shutil.rmtree, self._spill_path, True)
+        self._n_runs_created += 1
+        return os.path.join(self._spill_path, f"run-{self._n_runs_created:06d}")
+
+    def _enforce_budget(self):
+        """ Flushes the table into a new run and merges runs of similar size """
+        if self.memory_budget is None or self.table.nbytes <= self.memory_budget or len(self.table) == 0:
+            return
+        self.runs.append(SpilledRun.write(self._new_run_path(), self.table.to_arrays()))
+        self.table = PersonTable()
+        self.n_spills += 1
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            newer, older = self.runs.pop(), self.runs.pop()
+            self.runs.append(SpilledRun.merge(self._new_run_path(), newer, older))
+            newer.remove()
+            older.remove()
+
+    def __getstate__(self):
+        # arrays of runs are included, so that the state does not depend on temporary files (see checkpoint.py)
+        state = self.__dict__.copy()
+        state['runs'] = [run.to_arrays() for run in self.runs]
+        state['_spill_path'] = None
+        return state
+
+    def __setstate__(self, state):
+        runs = state.pop('runs')
+        self.__dict__.update(state)
+        self.runs = [SpilledRun.write(self._new_run_path(), arrays) for arrays in runs]
+        self._enforce_budget()
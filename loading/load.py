@@ -0,0 +1,203 @@
+"""
+Loads CSV files produced by xml_to_csv.py into the database, copying tables in parallel (replaces load.sh).
+Tables are unlogged while they are loaded and switched back to logged (written to WAL once) afterwards.
+Optionally runs post-load.sql in two parallel phases: all indexes first, then all foreign keys.
+"""
+import csv
+import logging
+import os
+import re
+import time
+import typing as T
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import click
+from psycopg2.pool import ThreadedConnectionPool
+
+log = logging.getLogger(__name__)
+
+""" Tables loaded from {table_name}.csv files """
+TABLES = [
+    'author', 'cite', 'crossref', 'editor', 'electronic_edition', 'isbn', 'note',
+    'person', 'publication', 'publisher', 'school', 'series', 'url',
+]
+
+POST_LOAD_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "post-load.sql")
+DEFAULT_REPORT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "load.log")
+
+
+class CountingReader(object):
+    """ Wraps a file read by copy_expert, counting bytes sent to the database """
+
+    def __init__(self, f: T.TextIO):
+        self.f = f
+        self.n_bytes = 0
+
+    def read(self, size: int = -1) -> str:
+        data = self.f.read(size)
+        self.n_bytes += len(data.encode('utf-8'))
+        return data
+
+    def readline(self, size: int = -1) -> str:
+        data = self.f.readline(size)
+        self.n_bytes += len(data.encode('utf-8'))
+        return data
+
+
+@contextmanager
+def pooled_connection(pool: ThreadedConnectionPool, autocommit: bool = False):
+    connection = pool.getconn()
+    connection.autocommit = autocommit
+    try:
+        yield connection
+    finally:
+        if not autocommit:
+            connection.rollback()  # no-op after commit, releases connection left in a failed transaction
+        pool.putconn(connection)
+
+
+def get_csv_columns(file_name: str) -> T.List[str]:
+    with open(file_name, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f))
+
+
+def copy_table(pool: ThreadedConnectionPool, table_name: str, file_name: str, unlogged: bool) -> T.Dict[str, T.Any]:
+    """
+    Copies a single CSV file (with header) into its table.
+    Quoted empty values are loaded as NULL, so the file does not have to be processed by format.sh.
+    :return: statistics of the load
+    """
+    columns = ", ".join(get_csv_columns(file_name))
+    copy_sql = f"copy {table_name} ({columns}) from stdin with (format csv, header true, force_null ({columns}))"
+
+    start = time.time()
+    with pooled_connection(pool) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("set synchronous_commit to off")
+            if unlogged:
+                cursor.execute(f"alter table {table_name} set unlogged")
+            with open(file_name, newline='', encoding='utf-8') as f:
+                reader = CountingReader(f)
+                cursor.copy_expert(copy_sql, reader)
+            n_rows = cursor.rowcount
+        connection.commit()
+    end = time.time()
+
+    stats = {
+        'table': table_name,
+        'rows': n_rows,
+        'mb': reader.n_bytes / 2 ** 20,
+        'time_s': end - start,
+    }
+    stats['rows_per_s'] = stats['rows'] / stats['time_s']
+    stats['mb_per_s'] = stats['mb'] / stats['time_s']
+    log.info(format_stats(stats))
+    return stats
+
+
+def format_stats(stats: T.Dict[str, T.Any]) -> str:
+    return (
+        f"{stats['table']}: {stats['rows']} rows, {stats['mb']:.1f}MB in {stats['time_s']:.2f}s "
+        f"({stats['rows_per_s']:.0f} rows/s, {stats['mb_per_s']:.2f}MB/s)"
+    )
+
+
+def execute(pool: ThreadedConnectionPool, statement: str) -> float:
+    """ Executes a single statement in autocommit mode, returns time in seconds """
+    start = time.time()
+    with pooled_connection(pool, autocommit=True) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(statement)
+    end = time.time()
+    log.info(f"{' '.join(statement.split())[:80]}... finished in {end - start:.2f}s")
+    return end - start
+
+
+def read_post_load_phases(file_name: str = POST_LOAD_SQL) -> T.Tuple[T.List[str], T.List[str]]:
+    """
+    Splits post-load.sql into statements creating indexes and statements adding constraints.
+    Indexes are created before constraints, so that constraints are validated using them.
+    :return: index statements, constraint statements
+    """
+    with open(file_name) as f:
+        sql = re.sub(r"--[^\n]*", "", f.read())
+    statements = [s.strip() for s in sql.split(";") if len(s.strip()) > 0]
+    indexes = [s for s in statements if re.match(r"create\s+(unique\s+)?index", s, re.IGNORECASE)]
+    constraints = [s for s in statements if s not in indexes]
+    return indexes, constraints
+
+
+def load_tables(
+        data_dir: str,
+        conninfo: str,
+        n_jobs: int,
+        unlogged: bool = True,
+        post_load: bool = False,
+) -> T.List[T.Dict[str, T.Any]]:
+    """
+    Loads all tables from CSV files in data_dir, using n_jobs connections.
+    :param data_dir: directory with {table_name}.csv files, missing files are skipped
+    :param conninfo: postgres connection string
+    :param n_jobs: number of tables loaded at once
+    :param unlogged: load into unlogged tables (not written to WAL) and set them logged afterwards
+    :param post_load: run post-load.sql (indexes and constraints) after loading
+    :return: statistics of every table
+    """
+    files = {table_name: os.path.join(data_dir, f"{table_name}.csv") for table_name in TABLES}
+    files = {table_name: file_name for table_name, file_name in files.items() if os.path.exists(file_name)}
+    # largest tables first, so that small ones fill the gaps at the end
+    table_names = sorted(files, key=lambda t: os.path.getsize(files[t]), reverse=True)
+
+    pool = ThreadedConnectionPool(1, n_jobs, conninfo)
+    try:
+        with ThreadPoolExecutor(n_jobs) as executor:
+            results = [executor.submit(copy_table, pool, t, files[t], unlogged) for t in table_names]
+            stats = [r.result() for r in results]
+
+            if unlogged:
+                # tables referenced by foreign keys (added later) have to be logged
+                results = [executor.submit(execute, pool, f"alter table {t} set logged") for t in table_names]
+                [r.result() for r in results]
+            results = [executor.submit(execute, pool, f"analyze {t}") for t in table_names]
+            [r.result() for r in results]
+
+            if post_load:
+                for phase in read_post_load_phases():
+                    results = [executor.submit(execute, pool, statement) for statement in phase]
+                    [r.result() for r in results]
+    finally:
+        pool.closeall()
+    return stats
+
+
+@click.command()
+@click.argument("data_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument("conninfo", type=str)
+@click.option("-j", "--jobs", type=int, default=os.cpu_count(), help="number of tables loaded at once")
+@click.option("--unlogged/--logged", default=True, help="load into unlogged tables, set logged afterwards")
+@click.option("--post-load", is_flag=True, help="create indexes and constraints from post-load.sql")
+@click.option("-r", "--report", type=str, default=DEFAULT_REPORT, help="file with statistics of every table")
+def main(data_dir: str, conninfo: str, jobs: int, unlogged: bool, post_load: bool, report: str):
+    """ Loads CSV files from DATA_DIR into database (CONNINFO), tables have to be created by init.sql """
+    start = time.time()
+    stats = load_tables(data_dir, conninfo, jobs, unlogged=unlogged, post_load=post_load)
+    end = time.time()
+
+    total = {
+        'table': 'total',
+        'rows': sum(s['rows'] for s in stats),
+        'mb': sum(s['mb'] for s in stats),
+        'time_s': end - start,
+    }
+    total['rows_per_s'] = total['rows'] / total['time_s']
+    total['mb_per_s'] = total['mb'] / total['time_s']
+    with open(report, 'w') as f:
+        for s in sorted(stats, key=lambda s: s['table']) + [total]:
+            f.write(format_stats(s) + "\n")
+    log.info(format_stats(total))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
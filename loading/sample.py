@@ -0,0 +1,63 @@
+"""
+Cuts a sample of dblp.xml: the prolog and publications from the beginning of the document up to a given size,
+ending at a boundary of publications and followed by the closing tag of the root, so that the sample is
+a complete document (used by `make parse-sample` and `make benchmark-engines`).
+"""
+import logging
+import os
+import shutil
+
+import click
+
+from engines import find_record_start, read_prolog
+from xml_to_csv import PUBLICATION_TAGNAMES
+
+log = logging.getLogger(__name__)
+
+""" Size of chunks copied from the document """
+COPY_CHUNK_SIZE = 2 ** 20
+
+
+def cut_sample(filename: str, out_filename: str, size: int) -> int:
+    """
+    :param filename: path to XML document
+    :param out_filename: path to the sample
+    :param size: number of bytes of the document, the sample ends at the next start tag of a publication
+    :return: number of bytes of the document in the sample
+    """
+    prolog = read_prolog(filename, PUBLICATION_TAGNAMES)
+    root_tag = prolog[prolog.rindex(b"<") + 1:].split(b">")[0].split()[0]
+    with open(filename, 'rb') as f:
+        end = find_record_start(f, max(size, len(prolog) + 1), PUBLICATION_TAGNAMES)
+        if end is None:  # the whole document is smaller than the sample
+            shutil.copyfile(filename, out_filename)
+            return os.path.getsize(filename)
+        f.seek(0)
+        with open(out_filename, 'wb') as out:
+            position = 0
+            while position < end:
+                chunk = f.read(min(COPY_CHUNK_SIZE, end - position))
+                out.write(chunk)
+                position += len(chunk)
+            out.write(b"</" + root_tag + b">\n")
+    return end
+
+
+@click.command()
+@click.argument("filename", type=click.Path(exists=True, dir_okay=False), default='data/dblp.xml')
+@click.argument("out_filename", type=click.Path(dir_okay=False), default='data-sample/dblp-sample.xml')
+@click.option("-s", "--size", type=click.IntRange(min=1), default=64, help="size of the sample in MB")
+def main(filename: str, out_filename: str, size: int):
+    """ Saves the beginning of FILENAME (about --size MB of publications) as a complete document OUT_FILENAME """
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(os.path.dirname(os.path.abspath(out_filename)), exist_ok=True)
+    n_bytes = cut_sample(filename, out_filename, size * 2 ** 20)
+    # the document references its DTD, which is kept next to it
+    dtd_filename = os.path.join(os.path.dirname(os.path.abspath(filename)), 'dblp.dtd')
+    if os.path.exists(dtd_filename):
+        shutil.copy(dtd_filename, os.path.dirname(os.path.abspath(out_filename)))
+    log.info(f"{n_bytes / 2 ** 20:.1f}MB of {filename} saved to {out_filename}")
+
+
+if __name__ == '__main__':
+    main()
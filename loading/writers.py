@@ -0,0 +1,193 @@
+import csv
+import logging
+import os
+import pickle
+import time
+import typing as T
+
+log = logging.getLogger(__name__)
+
+""" Number of rows kept in memory by a table writer before they are flushed to the output """
+DEFAULT_BUFFER_SIZE = 2 ** 12
+
+
+class TableWriter(object):
+    """ Abstract base class for streaming rows of a single table to its output with a small buffer. """
+
+    def __init__(
+            self,
+            table_name: str,
+            columns: T.Sequence[str],
+            index_label: T.Optional[str] = None,
+            buffer_size: int = DEFAULT_BUFFER_SIZE
+    ):
+        """
+        :param table_name: name of the table in DB schema
+        :param columns: names of all columns of the table, in the order in which they are written
+        :param index_label: name of the column which is not taken into account when dropping duplicate rows
+        :param buffer_size: number of rows kept in memory before they are flushed to the output
+        """
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.index_label = index_label
+        self.buffer_size = buffer_size
+        self.n_rows = 0
+        self.write_time = 0.0  # seconds spent writing batches to the output and closing it
+        self._buffer = list()
+        self._publication_rows = set()
+        self._dedup_start = 1 if index_label is not None and self.columns[0] == index_label else 0
+        if index_label is not None and self._dedup_start == 0:
+            raise ValueError(f"Index column {index_label} has to be the first column of {table_name}")
+
+    def _write_rows(self, rows: T.List[T.Tuple]):
+        """
+        Use to write a batch of rows (tuples ordered as self.columns) to the output.
+        :param rows:
+        :return:
+        """
+        raise NotImplementedError()
+
+    def _close(self):
+        """ Use to release the output after all rows were written. """
+        raise NotImplementedError()
+
+    def write(self, row: T.Dict[str, T.Any]):
+        """
+        Buffers a single row, attributes which are not columns of the table are ignored.
+        Duplicate rows within a single publication are dropped (some relations, eg. author and editor contain them).
+        :param row: mapping column name => value
+        :return:
+        """
+        values = tuple(row.get(c) for c in self.columns)
+        dedup_key = values[self._dedup_start:]
+        if dedup_key in self._publication_rows:
+            return
+        self._publication_rows.add(dedup_key)
+
+        self._buffer.append(values)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, rows: T.Iterable[T.Tuple]):
+        """
+        Buffers rows which are already ordered as columns of the table and deduplicated (eg. read from a spool).
+        :param rows: tuples of values
+        :return:
+        """
+        for values in rows:
+            self._buffer.append(values)
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+
+    def conclude_publication(self):
+        """ Called after all rows of a single publication were written, duplicates are only tracked within it. """
+        self._publication_rows.clear()
+
+    def flush(self):
+        if len(self._buffer) > 0:
+            start = time.perf_counter()
+            self._write_rows(self._buffer)
+            self.n_rows += len(self._buffer)
+            self._buffer = list()
+            self.write_time += time.perf_counter() - start
+
+    def close(self):
+        self.flush()
+        self._publication_rows.clear()
+        start = time.perf_counter()
+        self._close()
+        self.write_time += time.perf_counter() - start
+
+    def checkpoint(self) -> T.Dict[str, T.Any]:
+        """
+        Flushes all rows to a durable output, override to support resuming (see loading/checkpoint.py).
+        :return: state of the output passed to the writer to continue after the last flushed row
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} cannot be resumed")
+
+
+class CsvTableWriter(TableWriter):
+    """ Writes rows to a CSV file in the format expected by loading/format.sh and loading/load.sh """
+
+    def __init__(self, file_name: str, *args, resume_from: T.Optional[T.Dict[str, T.Any]] = None, **kwargs):
+        """
+        :param file_name: path to CSV file
+        :param resume_from: result of checkpoint(), rows written after it are removed and new rows appended
+        """
+        super(CsvTableWriter, self).__init__(*args, **kwargs)
+        self.file_name = file_name
+        self._start_time = time.time()
+        if resume_from is None:
+            self._file = open(file_name, 'w', newline='', encoding='utf-8')
+        else:
+            os.truncate(file_name, resume_from['position'])
+            self._file = open(file_name, 'a', newline='', encoding='utf-8')
+            self.n_rows = resume_from['n_rows']
+        # escape char same as quote char, as specified in postgres documentation
+        self._writer = csv.writer(self._file, quoting=csv.QUOTE_NONNUMERIC, escapechar='"')
+        if resume_from is None:
+            self._writer.writerow(self.columns)
+
+    def _write_rows(self, rows: T.List[T.Tuple]):
+        self._writer.writerows(rows)
+
+    def checkpoint(self) -> T.Dict[str, T.Any]:
+        self.flush()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {'n_rows': self.n_rows, 'position': self._file.tell()}
+
+    def _close(self):
+        self._file.close()
+        end_time = time.time()
+        log.info(f"{self.file_name} saved ({self.n_rows} rows) in {end_time - self._start_time:.2f}s")
+
+
+class SpoolTableWriter(TableWriter):
+    """ Writes batches of rows to a binary file, for intermediate results which are read back using read_spool """
+
+    def __init__(self, file_name: str, *args, **kwargs):
+        super(SpoolTableWriter, self).__init__(*args, **kwargs)
+        self.file_name = file_name
+        self._file = open(file_name, 'wb')
+
+    def _write_rows(self, rows: T.List[T.Tuple]):
+        pickle.dump(rows, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _close(self):
+        self._file.close()
+
+
+def read_spool(file_name: str) -> T.Iterator[T.List[T.Tuple]]:
+    """
+    Reads rows written by SpoolTableWriter.
+    :param file_name:
+    :return: generator of batches of rows, in the order in which they were written
+    """
+    with open(file_name, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+class TeeTableWriter(TableWriter):
+    """ Writes the same rows to multiple outputs (eg. CSV files and a database) """
+
+    def __init__(self, writers: T.Sequence[TableWriter], buffer_size: int = DEFAULT_BUFFER_SIZE):
+        """
+        :param writers: outputs of the same table, rows are deduplicated once by the tee
+        :param buffer_size: number of rows kept in memory before they are passed to the outputs
+        """
+        first = writers[0]
+        super(TeeTableWriter, self).__init__(first.table_name, first.columns, first.index_label, buffer_size)
+        self.writers = list(writers)
+
+    def _write_rows(self, rows: T.List[T.Tuple]):
+        for writer in self.writers:
+            writer.extend(rows)
+
+    def _close(self):
+        for writer in self.writers:
+            writer.close()
@@ -1,20 +1,26 @@
-import csv
 import gc
 import logging
 import os
-import sys
-import re
+import shutil
+import tempfile
 import time
 import typing as T
+from datetime import datetime
+from functools import partial
 from multiprocessing import cpu_count, Pool
-from xml.dom import pulldom
 from xml.dom.minidom import Element
-from xml.sax import make_parser
-from xml.sax.handler import feature_external_ges
 
-import pandas as pd
+import click
 from tqdm import tqdm
 
+from checkpoint import Checkpointer, load_checkpoint
+from engines import (
+    ENGINES, END_PUBLICATION, ExpatEngine, FIELD, Node, START_PUBLICATION, find_tag_end, split_document,
+)
+from instrumentation import EXTRACTION_SAMPLE_INTERVAL, SAMPLE_CHECK_PUBLICATIONS, ParserStats, save_report
+from interning import PersonInterner
+from writers import CsvTableWriter, SpoolTableWriter, TableWriter, TeeTableWriter, read_spool
+
 log = logging.getLogger(__name__)
 
 """ XML Tagnames related to the various Publication categories """
@@ -119,39 +125,164 @@ GENERIC_DATA = [
 
 GENERIC_DATA_TABLES = set(gd[-1] for gd in GENERIC_DATA)
 
+""" Columns of all tables produced by the parsers, in the order in which they are written """
+TABLE_COLUMNS = {
+    'person': ['id', 'full_name', 'orcid'],
+    'author': ['person_id', 'publication_key', 'bibtex', 'aux'],
+    'editor': ['person_id', 'publication_key'],
+    'publication': [
+        'key', 'category', 'title', 'year', 'booktitle', 'pages', 'journal', 'volume', 'number', 'month', 'cdrom',
+        'cdate', 'mdate', 'type', 'school_id', 'publisher_id', 'series_id',
+    ],
+    'school': ['id', 'name'],
+    'publisher': ['id', 'name', 'href'],
+    'series': ['id', 'name', 'href'],
+    'electronic_edition': ['id', 'url', 'publication_key', 'is_archive', 'is_oa'],
+    'crossref': ['id', 'str', 'publication_key'],
+    'cite': ['id', 'str', 'publication_key', 'label'],
+    'note': ['id', 'note', 'label', 'type', 'publication_key'],
+    'url': ['id', 'url', 'type', 'publication_key'],
+    'isbn': ['id', 'isbn', 'publication_key', 'type'],
+}
+
+
+def open_csv_table(table_name: str, checkpoints: T.Optional[T.Dict[str, T.Dict]] = None) -> TableWriter:
+    """
+    Default output of the parsers: one CSV file per table, in the current working directory.
+    :param table_name: name of the table in DB schema
+    :param checkpoints: states of writers saved in a checkpoint (see loading/checkpoint.py), to resume writing
+    :return: writer streaming rows to {table_name}.csv
+    """
+    columns = TABLE_COLUMNS[table_name]
+    index_label = 'id' if columns[0] == 'id' else None
+    resume_from = None if checkpoints is None else checkpoints[table_name]
+    return CsvTableWriter(f"{table_name}.csv", table_name, columns, index_label=index_label, resume_from=resume_from)
+
+
+def open_spool_table(directory: str, table_name: str) -> TableWriter:
+    """
+    Intermediate output of a single shard of the document (see parse_shard).
+    :param directory: directory of the shard
+    :param table_name: name of the table in DB schema
+    :return: writer streaming rows to {directory}/{table_name}.spool
+    """
+    columns = TABLE_COLUMNS[table_name]
+    index_label = 'id' if columns[0] == 'id' else None
+    file_name = os.path.join(directory, f"{table_name}.spool")
+    return SpoolTableWriter(file_name, table_name, columns, index_label=index_label)
+
+
+def open_tee_table(open_tables: T.Sequence[T.Callable[[str], TableWriter]], table_name: str) -> TableWriter:
+    """
+    Output of the parsers writing the same table to multiple outputs, use with functools.partial as open_table.
+    :param open_tables: functions creating writers of every output
+    :param table_name: name of the table in DB schema
+    :return: writer passing rows to all outputs
+    """
+    return TeeTableWriter([open_table(table_name) for open_table in open_tables])
+
+
+""" Name of the engine reading XML documents (see loading/engines.py) """
+DEFAULT_ENGINE = 'expat'
+
 
-def get_node_text(node: Element) -> str:
+def get_node_text(node: T.Union[Node, Element]) -> str:
     """
     Returns entire XML contained within a node (without beginning and opening tag) as a string.
     :param node:
     :return: node text
     """
-    xml_tag_regex = "</{0,1}" + node.tagName + '[\w\d =\-_"]*>'
-    return re.sub(xml_tag_regex, "", node.toxml())
+    if isinstance(node, Node):
+        return node.text  # collected by the engine while parsing
+    return "".join(child.toxml() for child in node.childNodes)
 
 
 class TagParser(object):
     """  Abstract base class for parsing XML documents with progressbar, data validation, etc. """
     _filtered_tags: T.Set[str] = set()  # other tags will be ignored
+    _tables: T.Tuple[str, ...] = tuple()  # names of tables written by the parser
     _tqdm_prefix: str = "tag_parser"
+    _checkpoint_excluded: T.Set[str] = {
+        'writers', 'filename', 'engine', 'doc', 't', 'pbar', '_pbar_start', 'checkpointer', 'stats',
+    }
 
-    def __init__(self, filename, use_pbar: bool = True):
+    def __init__(
+            self,
+            filename,
+            use_pbar: bool = True,
+            open_table: T.Callable[[str], TableWriter] = open_csv_table,
+            engine: T.Type = ENGINES[DEFAULT_ENGINE],
+            checkpointer: T.Optional[Checkpointer] = None,
+            stats: T.Optional[ParserStats] = None,
+    ):
+        """
+        :param filename: path to XML document, None if the parser is driven by another parser
+        :param use_pbar: display progressbar
+        :param open_table: creates writer for a table with a given name
+        :param engine: class of streaming engine reading the document (see loading/engines.py)
+        :param checkpointer: saves checkpoints after some publications (requires engine reporting their offsets)
+        :param stats: collects timings of parsing phases, progress and memory usage (see loading/instrumentation.py)
+        """
+        self.stats = stats
+        self.writers = {table_name: open_table(table_name) for table_name in self.__class__._tables}
         self.n_parsed_publications = 0
         self.n_total_publciations = 0
         self.elements_failed_to_parse = list()
         self.failed_flag = False
+        self.skip_flag = False  # all events until the end of current publication are ignored
+        self.n_skipped_publications = 0
         self.current_publication_key = None
+        self._filtered_tags = self.__class__._filtered_tags
+
+        self.filename = filename
+        self.engine = engine
+        self.doc = None  # created when called, after all filtered tags are known
+        self.t = None
+        self.checkpointer = checkpointer
+        self._pbar_start = None
+        self._n_extracted = 0  # inner texts of minidom nodes, every EXTRACTION_SAMPLE_INTERVAL-th one is timed
+        # parser with no filename is driven by another parser (see MultiTableParser), which reads the document
+        self.pbar = use_pbar and filename is not None
+
+    def _handle_new_publication(self, node: Element):
+        """ Called at the opening tag of every publication, override to add custom logic. """
+        for k, v in node.attributes.items():
+            if k == 'key':
+                self.current_publication_key = v
+        if self.current_publication_key is None:
+            raise ValueError(f"Publication without a key: {node}")
 
-        parser = make_parser()
-        parser.setFeature(feature_external_ges, True)
-        self.doc = pulldom.parse(
-            os.path.basename(filename), parser=parser, bufsize=2 ** 14
-        )
-        if use_pbar:
-            self.t = tqdm(self.doc, total=expected_event_count)
-        else:
-            self.t = self.doc
-        self.pbar = use_pbar
+    def get_writers(self) -> T.Dict[str, TableWriter]:
+        """ Returns writers of all tables produced by the parser """
+        return self.writers
+
+    def get_state(self) -> T.Dict[str, T.Any]:
+        """ Returns counters and id allocation state of the parser, saved in checkpoints """
+        return {k: v for k, v in self.__dict__.items() if k not in self.__class__._checkpoint_excluded}
+
+    def set_state(self, state: T.Dict[str, T.Any]):
+        """ Restores state returned by get_state, before the document is parsed """
+        self.__dict__.update(state)
+
+    def _get_node_text(self, node: T.Union[Node, Element]) -> str:
+        """
+        Returns text of a node (see get_node_text), timed as extraction phase of instrumented parsers.
+        Text of nodes of expat engine is collected while parsing, so only serializing minidom nodes is timed,
+        every EXTRACTION_SAMPLE_INTERVAL-th of them (the clock is not read for every field).
+        """
+        if self.stats is None or isinstance(node, Node):
+            return get_node_text(node)
+        self._n_extracted += 1
+        if self._n_extracted % EXTRACTION_SAMPLE_INTERVAL != 0:
+            return get_node_text(node)
+        start = time.perf_counter()
+        text = get_node_text(node)
+        self.stats.phases['extraction'] += (time.perf_counter() - start) * EXTRACTION_SAMPLE_INTERVAL
+        return text
+
+    def _skip_publication(self, node: Element) -> bool:
+        """ Called at the opening tag of every publication, override to ignore some publications entirely. """
+        return False
 
     def _handle_filtered_tag(self, event, node: Element):
         """
@@ -162,15 +293,20 @@ class TagParser(object):
         """
         raise NotImplementedError()
 
-    def _post_call(self):
+    def _post_call(self) -> T.Dict[str, int]:
         """
-        Use to some final transforms and return values in a desired format when calling the class.
-        :return:
+        Flushes and closes all outputs of the parser, override to add some final transforms.
+        :return: mapping table name => number of written rows
         """
-        raise NotImplementedError()
+        for writer in self.writers.values():
+            writer.close()
+        return {table_name: writer.n_rows for table_name, writer in self.writers.items()}
 
     def _conclude_publication(self):
         """ Called after an entire single publication is processed, override to add custom logic. """
+        for writer in self.writers.values():
+            writer.conclude_publication()
+
         if self.failed_flag is True:
             self.elements_failed_to_parse.append(self.current_publication_key)
             self.failed_flag = False
@@ -180,53 +316,82 @@ class TagParser(object):
         self.n_total_publciations += 1
         self.current_publication_key = None
         if self.pbar:
+            elapsed = time.perf_counter() - self._pbar_start
             self.t.set_postfix_str(
-                "{}: total={}, parsed={}, failed={}".format(
+                "{}: total={}, parsed={}, failed={}, {:.0f} publications/s".format(
                     self.__class__._tqdm_prefix,
                     self.n_total_publciations,
                     self.n_parsed_publications,
-                    self.n_total_publciations - self.n_parsed_publications
+                    self.n_total_publciations - self.n_parsed_publications,
+                    self.n_total_publciations / elapsed if elapsed > 0 else 0,
                 ),
                 refresh=False
             )
 
     def __call__(self):
         """ Loads and parses entire XML document, override to add custom logic. """
-        for event, node in self.t:
-            if event == pulldom.START_ELEMENT:
-                if self.failed_flag is True:
-                    continue
+        self.doc = self.engine(self.filename, PUBLICATION_TAGNAMES, self._filtered_tags)
+        if self.stats is not None:
+            self.stats.start(self.doc.start, self.doc.end)
+        if self.pbar:
+            # progress in bytes of the document, which is known in advance for any dump (unlike number of events)
+            self.t = tqdm(total=self.doc.end - self.doc.start, unit='B', unit_scale=True, unit_divisor=1024)
+            self._pbar_start = time.perf_counter()
+
+        for event, node in self.doc:
+            if self.skip_flag is True:
+                if event == END_PUBLICATION:
+                    self.skip_flag = False
+                continue
 
-                if node.tagName in PUBLICATION_TAGNAMES:
-                    if self.current_publication_key is not None:
-                        raise ValueError(f"Overlapping top-level tags at key: {self.current_publication_key}")
-                    for k, v in node.attributes.items():
-                        if k == 'key':
-                            self.current_publication_key = v
-                    if self.current_publication_key is None:
-                        raise ValueError(f"Publication without a key: {node}")
-                else:
-                    if self.current_publication_key is None:
-                        log.warning(f"Omitting top-level tag: {node.tagName}")
-                    elif node.tagName in self.__class__._filtered_tags:
-                        self.doc.expandNode(node)
-                        self._handle_filtered_tag(event, node)
-                    else:
-                        continue
-
-            elif event == pulldom.END_ELEMENT and node.tagName in PUBLICATION_TAGNAMES:
+            if event == END_PUBLICATION:
                 self._conclude_publication()
+                if self.pbar:
+                    self.t.update(self.doc.position - self.doc.start - self.t.n)
+                if self.stats is not None and self.n_total_publciations % SAMPLE_CHECK_PUBLICATIONS == 0:
+                    self.stats.sample(self.doc.position, self.n_total_publciations)
+                if self.checkpointer is not None:
+                    self.checkpointer.maybe_save(self, node.offset)
                 # TODO: Remove this after finished debugging
                 # if self.n_parsed_publications > 10**4:
                 #     break
-        if self.pbar:
-            self.t.close()
-        return self._post_call()
 
+            elif self.failed_flag is True:
+                continue
+
+            elif event == START_PUBLICATION:
+                if self.current_publication_key is not None:
+                    raise ValueError(f"Overlapping top-level tags at key: {self.current_publication_key}")
+                if self._skip_publication(node):
+                    self.skip_flag = True
+                    self.n_skipped_publications += 1
+                    continue
+                self._handle_new_publication(node)
 
-def parse_person_dependency(node: Element) -> T.Tuple[T.Dict[str, T.Any], T.Dict[str, T.Any]]:
+            elif event == FIELD:
+                self._handle_filtered_tag(event, node)
+
+            else:
+                log.warning(f"Omitting top-level tag: {node.tagName}")
+
+        if self.pbar:
+            self.t.update(self.doc.position - self.doc.start - self.t.n)
+            self.t.close()
+        n_rows = self._post_call()
+        if self.stats is not None:
+            # engines and writers measure their time themselves, only once in a while (per chunk or batch of rows)
+            self.stats.phases['parsing'] += self.doc.parse_time
+            self.stats.phases['writing'] += sum(writer.write_time for writer in self.get_writers().values())
+            self.stats.finish(self.doc.position, self.n_total_publciations, n_rows)
+        return n_rows
+
+
+def parse_person_dependency(
+        node: Element, tag_content: T.Optional[str] = None
+) -> T.Tuple[T.Dict[str, T.Any], T.Dict[str, T.Any]]:
     tag_attrs = {k: v for k, v in node.attributes.items()}
-    tag_content = get_node_text(node)
+    if tag_content is None:
+        tag_content = get_node_text(node)
 
     person_attrs = {
         'full_name': tag_content,
@@ -243,72 +408,66 @@ class PersonTagParser(TagParser):
 
     _tqdm_prefix: str = "person_parser"
     _filtered_tags = {'author', 'editor'}
-    _person_id = dict()  # (full_name, orcid) => id
-    _author_dfs = list()
-    _editor_dfs = list()
-    _person_dfs = list()
+    _tables = ('person', 'author', 'editor')
+
+    def __init__(self, *args, **kwargs):
+        super(PersonTagParser, self).__init__(*args, **kwargs)
+        self._person_id = PersonInterner(memory_budget=person_memory_budget)  # (full_name, orcid) => id
+        self._next_person_id = 0
 
     def _handle_filtered_tag(self, event, node: Element):
-        person_attrs, realtion_attrs = parse_person_dependency(node)
+        person_attrs, realtion_attrs = parse_person_dependency(node, self._get_node_text(node))
 
         try:
-            person_id = self.__class__._person_id[(person_attrs['full_name'], person_attrs['orcid'])]
+            person_id = self._person_id[(person_attrs['full_name'], person_attrs['orcid'])]
         except KeyError:
-            person_id = len(self.__class__._person_dfs)
-            self.__class__._person_id[(person_attrs['full_name'], person_attrs['orcid'])] = person_id
-            self.__class__._person_dfs.append(
-                pd.DataFrame(person_attrs, index=[person_id])
-            )
+            person_id = self._next_person_id
+            self._next_person_id += 1
+            self._person_id[(person_attrs['full_name'], person_attrs['orcid'])] = person_id
+            self.writers['person'].write({'id': person_id, **person_attrs})
 
         realtion_attrs['publication_key'] = self.current_publication_key
         realtion_attrs['person_id'] = person_id
 
-        if node.tagName == 'author':
-            self.__class__._author_dfs.append(pd.DataFrame(realtion_attrs, index=[1]))
-        elif node.tagName == 'editor':
-            self.__class__._editor_dfs.append(pd.DataFrame(realtion_attrs, index=[1]))
+        if node.tagName in {'author', 'editor'}:
+            self.writers[node.tagName].write(realtion_attrs)
         else:
             raise ValueError(f"Expected person or editor at key: {self.current_publication_key}")
 
-    def _post_call(self):
-        self.__class__.person_df = pd.concat(self.__class__._person_dfs, axis='index')
-
-        if len(self.__class__._author_dfs) > 0:
-            self.__class__.author_df = pd.concat(self.__class__._author_dfs, axis='index', ignore_index=True)
-        else:
-            self.__class__.author_df = pd.DataFrame(columns=['person_id', 'publication_key', 'bibtex', 'aux'])
-
-        if len(self.__class__._editor_dfs) > 0:
-            self.__class__.editor_df = pd.concat(self.__class__._editor_dfs, axis='index', ignore_index=True)
-        else:
-            self.__class__.editor_df = pd.DataFrame(columns=['person_id', 'publication_key'])
-
-        return self.__class__.person_df, self.__class__.author_df, self.__class__.editor_df
 
-
-def get_data_parsing_class(tag_name: str, attr_for_inner_text: T.Optional[str] = None):
+def get_data_parsing_class(tag_name: str, attr_for_inner_text: T.Optional[str] = None, table_name: str = None):
     """
     Generates parsing class for any tag name, which handles all attributes in a generic way
     (integer or string, same attribute names in XML and in DB schema), adds publication_key.
     :param tag_name:
     :param attr_for_inner_text:
+    :param table_name: name of the table in DB schema, by default same as tag name
     :return:
     """
+    table_name = table_name or tag_name
 
     class GeneratedDataParser(TagParser):
         _tqdm_prefix: str = f"{tag_name}_parser"
         _filtered_tags = {tag_name}
-        _dfs = list()
+        _tables = (table_name,)
+
+        def __init__(self, *args, **kwargs):
+            super(GeneratedDataParser, self).__init__(*args, **kwargs)
+            self.n_rows = 0  # used as id, duplicates dropped by the writer still increment it
 
         def _handle_filtered_tag(self, event, node: Element):
             tag_attrs = {k: v for k, v in node.attributes.items()}
             tag_attrs['publication_key'] = self.current_publication_key
+            if tag_name == "ee":
+                # both flags are not nullable in DB schema
+                tag_attrs["is_archive"] = False
+                tag_attrs["is_oa"] = False
 
-            tag_content = get_node_text(node)
+            tag_content = self._get_node_text(node)
             if attr_for_inner_text is not None:
                 tag_attrs[attr_for_inner_text] = tag_content
 
-            for k, v in tag_attrs.items():
+            for k, v in list(tag_attrs.items()):
                 if k in INT_MAPPING_TAGS:
                     tag_attrs[k] = int(v)
                 elif tag_name == "ee" and k == "type":
@@ -316,63 +475,78 @@ def get_data_parsing_class(tag_name: str, attr_for_inner_text: T.Optional[str] =
                     tag_attrs["is_oa"] = 'oa' in v
                     del tag_attrs[k]
 
-            self.__class__._dfs.append(pd.DataFrame(tag_attrs, index=[1]))
-
-        def _post_call(self):
-            if len(self.__class__._dfs) > 0:
-                self.__class__.df = pd.concat(self.__class__._dfs, axis='index', ignore_index=True)
-            else:
-                return None
-            return self.__class__.df
+            tag_attrs['id'] = self.n_rows
+            self.n_rows += 1
+            self.writers[table_name].write(tag_attrs)
 
     return GeneratedDataParser
 
 
+class DimensionTable(object):
+    """
+    Rows of a small table referenced by publications (school, publisher, series), interned by name.
+    Ids are assigned in order of first occurrence, values are kept in append-only lists (one per column).
+    """
+
+    def __init__(
+            self,
+            columns: T.Sequence[str],
+            key_column: str = 'name',
+            existing_ids: T.Optional[T.Dict[T.Any, int]] = None,
+            first_id: int = 0,
+    ):
+        """
+        :param columns: names of stored columns (without id)
+        :param key_column: column which identifies a row, later rows with the same value reuse the first one
+        :param existing_ids: rows which are already stored elsewhere (eg. loaded into DB), mapping key => id
+        :param first_id: id of the first new row
+        """
+        self.key_column = key_column
+        self.columns = {c: list() for c in columns}
+        self.first_id = first_id
+        self._ids = dict(existing_ids or {})  # key column value => id
+        self._n_new_rows = 0
+
+    def __len__(self):
+        return self._n_new_rows
+
+    def get_id(self, attrs: T.Dict[str, T.Any]) -> int:
+        """
+        Returns id of a row with the same key, adds a new row if there is none.
+        :param attrs: mapping column name => value, attributes which are not columns are ignored
+        :return: id of the row
+        """
+        key = attrs[self.key_column]
+        try:
+            return self._ids[key]
+        except KeyError:
+            row_id = self._ids[key] = self.first_id + self._n_new_rows
+            self._n_new_rows += 1
+            for column, values in self.columns.items():
+                values.append(attrs.get(column))
+            return row_id
+
+    def rows(self) -> T.Iterator[T.Dict[str, T.Any]]:
+        """ Yields all new rows (including id) in order of ids """
+        names = list(self.columns.keys())
+        for row_id, values in enumerate(zip(*self.columns.values()), self.first_id):
+            yield {'id': row_id, **dict(zip(names, values))}
+
+
 class PublicationParser(TagParser):
     """ Parses Publication, School, Publisher and Series tables (from all related XML tags). """
 
     _tqdm_prefix: str = "publication_parser"
-    _filtered_tags = {'school', 'publisher', 'series'}
+    _relation_tags = {'school', 'publisher', 'series'}
     _publication_attr_tags = set(TAG_TO_ATTR_MAPPING.keys())
+    _filtered_tags = _relation_tags | _publication_attr_tags
+    _tables = ('publication', 'school', 'publisher', 'series')
 
-    _publication_dfs = list()
-    dfs = {
-        'school': pd.DataFrame(columns=['name']),
-        'publisher': pd.DataFrame(columns=['name', 'href']),
-        'series': pd.DataFrame(columns=['name', 'href']),
-    }
-
-    def __call__(self):
-        for event, node in self.t:
-            if event == pulldom.START_ELEMENT:
-                if self.failed_flag is True:
-                    continue
-
-                if node.tagName in PUBLICATION_TAGNAMES:
-                    if self.current_publication_key is not None:
-                        raise ValueError(f"Overlapping top-level tags at key: {self.current_publication_key}")
-                    self._handle_new_publication(node)
-                else:
-                    if self.current_publication_key is None:
-                        log.warning(f"Omitting top-level tag: {node.tagName}")
-                    elif node.tagName in self.__class__._filtered_tags:
-                        self.doc.expandNode(node)
-                        self._handle_filtered_tag(event, node)
-                    elif node.tagName in self.__class__._publication_attr_tags:
-                        self.doc.expandNode(node)
-                        self._handle_publication_attr_tag(event, node)
-                    else:
-                        continue
-
-            elif event == pulldom.END_ELEMENT and node.tagName in PUBLICATION_TAGNAMES:
-                self._conclude_publication()
-                # TODO: Remove this after finished debugging
-                # if self.n_parsed_publications > 10 ** 4:
-                #     break
-
-        if self.pbar:
-            self.t.close()
-        return self._post_call()
+    def __init__(self, *args, **kwargs):
+        super(PublicationParser, self).__init__(*args, **kwargs)
+        self.dimensions = {
+            table_name: DimensionTable(TABLE_COLUMNS[table_name][1:]) for table_name in self.__class__._relation_tags
+        }
 
     def _handle_new_publication(self, node):
         self.current_publication_attrs = dict()
@@ -391,24 +565,22 @@ class PublicationParser(TagParser):
             raise ValueError(f"Publication without a key: {node}")
 
     def _handle_filtered_tag(self, event, node: Element):
+        if node.tagName in self.__class__._publication_attr_tags:
+            self._handle_publication_attr_tag(event, node)
+        else:
+            self._handle_relation_tag(event, node)
+
+    def _handle_relation_tag(self, event, node: Element):
         tag_attrs = {k: v for k, v in node.attributes.items()}
-        tag_content = get_node_text(node)
+        tag_content = self._get_node_text(node)
         tag_attrs['name'] = tag_content
 
-        # noinspection PyTypeChecker
-        same_name: pd.Series = self.__class__.dfs[node.tagName]['name'] == tag_attrs['name']
-        if same_name.any():
-            # publisher, school and series are all compare by name
-            relation_id = same_name.idxmax()
-        else:
-            relation_id = len(self.__class__.dfs[node.tagName])
-            self.__class__.dfs[node.tagName] = self.__class__.dfs[node.tagName].append(
-                tag_attrs, ignore_index=True
-            )
+        # publisher, school and series are all compared by name
+        relation_id = self.dimensions[node.tagName].get_id(tag_attrs)
         self.current_publication_attrs[f'{node.tagName}_id'] = relation_id
 
     def _handle_publication_attr_tag(self, event, node):
-        tag_content = get_node_text(node)
+        tag_content = self._get_node_text(node)
         mapper = TAG_TO_ATTR_MAPPING[node.tagName]
         mapped = mapper(tag_content)
         self.current_publication_attrs.update(**mapped)
@@ -416,114 +588,415 @@ class PublicationParser(TagParser):
     def _conclude_publication(self):
         if not self.failed_flag:
             self.current_publication_attrs['key'] = self.current_publication_key
-            self._publication_dfs.append(
-                pd.DataFrame(self.current_publication_attrs, index=[1])
-            )
+            self.writers['publication'].write(self.current_publication_attrs)
         super(PublicationParser, self)._conclude_publication()
 
     def _post_call(self):
-        self.__class__.publications_df = pd.concat(
-            self.__class__._publication_dfs, axis='index', ignore_index=True
-        )
-        return (
-            self.__class__.publications_df,
-            self.__class__.dfs['school'],
-            self.__class__.dfs['series'],
-            self.__class__.dfs['publisher'],
-        )
-
-
-def save_df(df: pd.DataFrame, file_name: str, **kwargs):
-    start_time = time.time()
-    # some relations (author, editor) contain duplicate rows - we drop them as soon as possible to reduce file size
-    df.drop_duplicates(inplace=True)
-    # escape char same as quote char, as specified in postgres documentation
-    df.to_csv(file_name, quoting=csv.QUOTE_NONNUMERIC, escapechar='"', **kwargs)
-    end_time = time.time()
-    log.info(f"{file_name} saved in {end_time - start_time:.2f}s")
+        for table_name, dimension in self.dimensions.items():
+            for row in dimension.rows():
+                self.writers[table_name].write(row)
+        return super(PublicationParser, self)._post_call()
+
+
+class MultiTableParser(TagParser):
+    """ Parses tables of multiple parsers in a single pass, dispatching every tag to all parsers interested in it. """
+
+    _tqdm_prefix: str = "multi_table_parser"
+    _checkpoint_excluded = TagParser._checkpoint_excluded | {'parsers', '_parsers_per_tag'}
+
+    def __init__(self, filename, parser_classes: T.Sequence[T.Type[TagParser]], use_pbar: bool = True, **kwargs):
+        super(MultiTableParser, self).__init__(filename, use_pbar=use_pbar, **kwargs)
+        self.parsers = [parser_class(None, **kwargs) for parser_class in parser_classes]
+        self._filtered_tags = set().union(*[p._filtered_tags for p in self.parsers])
+        self._parsers_per_tag = {
+            tag: [p for p in self.parsers if tag in p._filtered_tags] for tag in self._filtered_tags
+        }
+
+    def get_writers(self) -> T.Dict[str, TableWriter]:
+        writers = dict()
+        for parser in self.parsers:
+            writers.update(parser.get_writers())
+        return writers
+
+    def get_state(self) -> T.Dict[str, T.Any]:
+        state = super(MultiTableParser, self).get_state()
+        state['_parser_states'] = [parser.get_state() for parser in self.parsers]
+        return state
+
+    def set_state(self, state: T.Dict[str, T.Any]):
+        state = dict(state)
+        for parser, parser_state in zip(self.parsers, state.pop('_parser_states')):
+            parser.set_state(parser_state)
+        super(MultiTableParser, self).set_state(state)
+
+    def _handle_new_publication(self, node: Element):
+        super(MultiTableParser, self)._handle_new_publication(node)
+        for parser in self.parsers:
+            parser._handle_new_publication(node)
+
+    def _handle_filtered_tag(self, event, node: Element):
+        for parser in self._parsers_per_tag[node.tagName]:
+            parser._handle_filtered_tag(event, node)
+
+    def _conclude_publication(self):
+        for parser in self.parsers:
+            parser.failed_flag = self.failed_flag
+            parser._conclude_publication()
+        super(MultiTableParser, self)._conclude_publication()
+
+    def _post_call(self) -> T.Dict[str, int]:
+        n_rows = dict()
+        for parser in self.parsers:
+            n_rows.update(parser._post_call())
+        return n_rows
+
+
+def get_all_tables_parser_classes() -> T.List[T.Type[TagParser]]:
+    """ Parsers which together produce every table of the DB schema. """
+    return [PersonTagParser, PublicationParser] + [
+        get_data_parsing_class(tagname, attrname, tablename) for tagname, attrname, tablename in GENERIC_DATA
+    ]
 
 
 n_processes = min(len(GENERIC_DATA), cpu_count())
-expected_event_count = 248393285  # for progressbar
+person_memory_budget = None  # bytes of persons map kept in memory, the rest is spilled to disk
 
 
-def parse_generic_item(generic_data_tuple_with_filename) -> str:
+def parse_generic_item(generic_data_tuple_with_filename) -> T.Tuple[str, T.Optional[T.Dict[str, T.Any]]]:
     start = time.time()
 
-    tagname, attrname, tablename, filename = generic_data_tuple_with_filename
-    parser_builder = get_data_parsing_class(tagname, attrname)
-    parser = parser_builder(filename, use_pbar=True)  # todo: remove debug
-    df = parser()
-    if df is not None:
-        save_df(df, f"{tablename}.csv", index=True, index_label='id')
-
-    log.info("Clearing memory...")
-    del df
-    del parser
-    del parser_builder
-    gc.collect()
-    log.info("Memory clear")
+    tagname, attrname, tablename, filename, engine, open_table, report = generic_data_tuple_with_filename
+    parser_builder = get_data_parsing_class(tagname, attrname, tablename)
+    stats = ParserStats(parser_builder._tqdm_prefix) if report else None
+    parser = parser_builder(
+        filename, use_pbar=True, open_table=open_table, engine=ENGINES[engine], stats=stats
+    )  # todo: remove debug
+    parser()
 
     end = time.time()
-    return f"{tablename} finished in {end - start:.2}s"
+    return f"{tablename} finished in {end - start:.2}s", None if stats is None else stats.to_dict()
 
 
-def load_dblp(target: str, filename: str) -> None:
-    assert target in {'publications', 'people', 'generic'}
+""" Tables with ids assigned by the parsers in order of first occurrence, mapping: table => columns compared """
+SHARD_DEDUPLICATED_TABLES = {
+    'person': ('full_name', 'orcid'),
+    'school': ('name',),
+    'publisher': ('name',),
+    'series': ('name',),
+}
 
-    if not gc.isenabled():
-        gc.enable()
-    os.chdir(os.path.dirname(filename))  # so that relative reference to dtd file can be read by XML parser
+""" Columns referencing ids of deduplicated tables, mapping: table => {column: referenced table} """
+SHARD_REFERENCES = {
+    'author': {'person_id': 'person'},
+    'editor': {'person_id': 'person'},
+    'publication': {'school_id': 'school', 'publisher_id': 'publisher', 'series_id': 'series'},
+}
+
+""" Number of shards per process, smaller shards balance the work better when some parts are denser than others """
+SHARDS_PER_PROCESS = 4
+
+
+def parse_shard(shard_tuple) -> T.Tuple[str, T.Dict[str, int], T.Dict[str, T.Any]]:
+    """
+    Parses all tables from a byte range of the document into spool files, ids are local to the shard.
+    :param shard_tuple: (path to XML document, (start, end) byte offsets, output directory)
+    :return: output directory, number of ids used by every generic table and statistics of the shard
+    """
     start = time.time()
 
-    if target == 'publications':
-        publiation_parser = PublicationParser(filename)
-        publication_df, school_df, series_df, publisher_df = publiation_parser()
-        save_df(publication_df, 'publication.csv', index=False)
-        save_df(school_df, 'school.csv', index=True, index_label='id')
-        save_df(series_df, 'series.csv', index=True, index_label='id')
-        save_df(publisher_df, 'publisher.csv', index=True, index_label='id')
-
-    elif target == 'people':
-        person_parser = PersonTagParser(filename)
-        person_df, author_df, editor_df = person_parser()
-        save_df(person_df, 'person.csv', index=True, index_label='id')
-        save_df(author_df, 'author.csv', index=False)
-        save_df(editor_df, 'editor.csv', index=False)
+    filename, byte_range, shard_dir = shard_tuple
+    stats = ParserStats(f"shard {os.path.basename(shard_dir)}")
+    parser = MultiTableParser(
+        filename,
+        get_all_tables_parser_classes(),
+        use_pbar=False,
+        open_table=partial(open_spool_table, shard_dir),
+        engine=partial(ExpatEngine, byte_range=byte_range),
+        stats=stats,
+    )
+    parser()
+    n_generic_ids = {
+        table_name: p.n_rows for p in parser.parsers for table_name in p._tables if table_name in GENERIC_DATA_TABLES
+    }
 
-    else:
+    end = time.time()
+    log.info(f"Shard {byte_range} ({parser.n_total_publciations} publications) finished in {end - start:.2f}s")
+    return shard_dir, n_generic_ids, stats.to_dict()
+
+
+def merge_shards(
+        shard_results: T.Iterable[T.Tuple[str, T.Dict[str, int], T.Dict[str, T.Any]]],
+        open_table: T.Callable[[str], TableWriter] = open_csv_table,
+        stats: T.Optional[ParserStats] = None,
+) -> T.Dict[str, int]:
+    """
+    Merges outputs of parse_shard (in document order) into final tables, assigning the same ids
+    as a sequential pass: persons, schools, publishers and series by first occurrence, generic rows consecutively.
+    Spool files of every shard are removed once it is merged.
+    :param shard_results: results of parse_shard, in order of the shards in the document
+    :param open_table: creates writer for a table with a given name
+    :param stats: collects time of reading spools (as parsing), writing and waiting for shards
+    :return: mapping table name => number of written rows
+    """
+    writers = {table_name: open_table(table_name) for table_name in TABLE_COLUMNS}
+    if stats is not None:
+        stats.start()
+        shard_results = stats.timed(shard_results, 'waiting')
+    # compared values => id, persons are kept within --person-memory as in sequential parsing
+    global_ids = {
+        table_name: PersonInterner(memory_budget=person_memory_budget) if table_name == 'person' else dict()
+        for table_name in SHARD_DEDUPLICATED_TABLES
+    }
+    generic_offsets = {table_name: 0 for table_name in GENERIC_DATA_TABLES}
+
+    for shard_dir, n_generic_ids, shard_stats in shard_results:
+        def spool(table_name: str) -> T.Iterator[T.List[T.Tuple]]:
+            batches = read_spool(os.path.join(shard_dir, f"{table_name}.spool"))
+            return batches if stats is None else stats.timed(batches)
+
+        # local ids are consecutive within every shard, so they can be translated with a list
+        translations = dict()
+        for table_name, compared_columns in SHARD_DEDUPLICATED_TABLES.items():
+            columns = TABLE_COLUMNS[table_name]
+            positions = [columns.index(c) for c in compared_columns]
+            ids, translation = global_ids[table_name], list()
+            for rows in spool(table_name):
+                for row in rows:
+                    key = tuple(row[i] for i in positions)
+                    global_id = ids.get(key)
+                    if global_id is None:
+                        global_id = ids[key] = len(ids)
+                        writers[table_name].extend([(global_id,) + row[1:]])
+                    translation.append(global_id)
+            translations[table_name] = translation
+
+        for table_name, references in SHARD_REFERENCES.items():
+            columns = TABLE_COLUMNS[table_name]
+            remapped = [(columns.index(c), translations[t]) for c, t in references.items()]
+            for rows in spool(table_name):
+                for i, row in enumerate(rows):
+                    row = list(row)
+                    for position, translation in remapped:
+                        if row[position] is not None:
+                            row[position] = translation[row[position]]
+                    rows[i] = tuple(row)
+                writers[table_name].extend(rows)
+
+        for table_name in GENERIC_DATA_TABLES:
+            offset = generic_offsets[table_name]
+            for rows in spool(table_name):
+                writers[table_name].extend((row[0] + offset,) + row[1:] for row in rows)
+            generic_offsets[table_name] += n_generic_ids[table_name]
+
+        shutil.rmtree(shard_dir)
+        if stats is not None:
+            stats.sample(shard_stats['byte_range'][1], stats.n_publications + shard_stats['publications'])
+
+    for writer in writers.values():
+        writer.close()
+    n_rows = {table_name: writer.n_rows for table_name, writer in writers.items()}
+    if stats is not None:
+        stats.phases['writing'] += sum(writer.write_time for writer in writers.values())
+        stats.finish(stats.position, stats.n_publications, n_rows)
+    return n_rows
+
+
+def load_dblp_sharded(
+        filename: str,
+        n_jobs: int,
+        open_table: T.Callable[[str], TableWriter] = open_csv_table,
+        parser_stats: T.Optional[T.List[T.Dict[str, T.Any]]] = None,
+) -> T.Dict[str, int]:
+    """
+    Parses all tables using a pool of processes, every process parses separate byte ranges of the document.
+    Output is exactly the same as the output of a sequential pass (see MultiTableParser).
+    :param filename: path to XML document
+    :param n_jobs: number of processes
+    :param open_table: creates writer for a table with a given name
+    :param parser_stats: statistics of every shard and of merging are appended to it (see loading/instrumentation.py)
+    :return: mapping table name => number of written rows
+    """
+    byte_ranges = split_document(filename, n_jobs * SHARDS_PER_PROCESS, PUBLICATION_TAGNAMES)
+    log.info(f"Parsing {len(byte_ranges)} shards with {n_jobs} processes")
+    # spools are kept next to the outputs, they are as large as the outputs of a shard
+    with tempfile.TemporaryDirectory(prefix="shards-", dir=os.getcwd()) as tmp_dir:
+        shard_tuples = list()
+        for i, byte_range in enumerate(byte_ranges):
+            shard_dir = os.path.join(tmp_dir, f"{i:04d}")
+            os.mkdir(shard_dir)
+            shard_tuples.append((filename, byte_range, shard_dir))
+
+        def collect_stats(shard_results):
+            for shard_result in shard_results:
+                parser_stats.append(shard_result[2])
+                yield shard_result
+
+        with Pool(n_jobs) as p:
+            # shards are merged in document order while the following ones are still being parsed
+            shard_results = p.imap(parse_shard, shard_tuples)
+            if parser_stats is None:
+                return merge_shards(shard_results, open_table=open_table)
+            merge_stats = ParserStats("merge")
+            n_rows = merge_shards(collect_stats(shard_results), open_table=open_table, stats=merge_stats)
+            parser_stats.append(merge_stats.to_dict())
+            return n_rows
+
+
+def load_dblp(
+        target: str,
+        filename: str,
+        engine: str = DEFAULT_ENGINE,
+        n_jobs: int = 1,
+        open_table: T.Callable[[str], TableWriter] = open_csv_table,
+        checkpoint_interval: T.Optional[float] = None,
+        resume: bool = False,
+        report: bool = True,
+) -> None:
+    assert target in {'all', 'publications', 'people', 'generic'}
+    assert engine in ENGINES
+    assert n_jobs == 1 or (target == 'all' and ENGINES[engine] is ExpatEngine), "Only 'all' target can be sharded"
+    resumable = target != 'generic' and n_jobs == 1 and ENGINES[engine] is ExpatEngine and open_table is open_csv_table
+    assert resumable or (checkpoint_interval is None and not resume), "Job cannot be checkpointed"
+
+    if not gc.isenabled():
+        gc.enable()
+    filename = os.path.abspath(filename)
+    os.chdir(os.path.dirname(filename))  # CSV files are saved next to the XML document
+    start = time.time()
+    started = datetime.now().replace(microsecond=0).isoformat()
+    parser_stats = list() if report else None  # statistics of every parser, saved in the report of the run
+
+    engine_class = ENGINES[engine]
+    checkpoint_file = os.path.join(os.getcwd(), f"{target}.checkpoint")
+    checkpoint = None
+    if resume:
+        checkpoint = load_checkpoint(checkpoint_file)
+        if checkpoint['filename'] != filename or checkpoint['target'] != target:
+            raise ValueError(f"Checkpoint of {checkpoint['target']} from {checkpoint['filename']} cannot be resumed")
+        # document is parsed from the end of the last publication concluded before the checkpoint
+        resume_offset = find_tag_end(filename, checkpoint['offset'])
+        log.info(f"Resuming {target} from byte {resume_offset}")
+        engine_class = partial(ExpatEngine, byte_range=(resume_offset, os.path.getsize(filename)))
+        open_table = partial(open_csv_table, checkpoints=checkpoint['writers'])
+    checkpointer = None
+    if checkpoint_interval is not None:
+        checkpointer = Checkpointer(checkpoint_file, checkpoint_interval, info={'filename': filename, 'target': target})
+    parser_kwargs = dict(open_table=open_table, engine=engine_class, checkpointer=checkpointer)
+
+    # every parser streams its rows to outputs (by default {table_name}.csv files) as soon as they are parsed
+    if target == 'all' and n_jobs > 1:
+        load_dblp_sharded(filename, n_jobs, open_table=open_table, parser_stats=parser_stats)
+
+    elif target == 'generic':
         generic_data_tuples_with_filenames_and_offset = [
-            (tagname, attrname, tablename, filename)
+            (tagname, attrname, tablename, filename, engine, open_table, report)
             for tagname, attrname, tablename in GENERIC_DATA
         ]
         with Pool(n_processes) as p:
             res = p.map_async(parse_generic_item, generic_data_tuples_with_filenames_and_offset)
             times = res.get()
-            for t in times:
+            for t, stats in times:
                 log.info(t)
+                if report:
+                    parser_stats.append(stats)
+
+    else:
+        stats = None
+        if report:
+            parser_kwargs['stats'] = stats = ParserStats(target)
+        if target == 'all':
+            # single pass over the document, producing all tables at once
+            parser = MultiTableParser(filename, get_all_tables_parser_classes(), **parser_kwargs)
+        elif target == 'publications':
+            parser = PublicationParser(filename, **parser_kwargs)
+        else:
+            parser = PersonTagParser(filename, **parser_kwargs)
+
+        if checkpoint is not None:
+            parser.set_state(checkpoint['parser'])
+        parser()
+        if checkpointer is not None:
+            checkpointer.remove()
+        if stats is not None:
+            parser_stats.append(stats.to_dict())
 
     end = time.time()
     log.info(f"Completed job {target} in {end - start:.2f}")
+    if report:
+        run = {
+            'target': target,
+            'filename': filename,
+            'file_size': os.path.getsize(filename),
+            'engine': engine,
+            'jobs': n_jobs,
+            'resumed': resume,
+            'started': started,
+            'wall_time_s': end - start,
+        }
+        save_report(os.path.join(os.getcwd(), f"{target}.report.json"), run, parser_stats)
     gc.collect()
 
 
+@click.command()
+@click.argument("target", type=click.Choice(['all', 'publications', 'people', 'generic']))
+@click.argument("filename", type=str, default="data/dblp.xml")
+@click.option("-e", "--engine", type=click.Choice(sorted(ENGINES.keys())), default=DEFAULT_ENGINE)
+@click.option("-j", "--jobs", type=int, default=1, help="number of processes parsing shards of the document (all)")
+@click.option("--db", "conninfo", type=str, default=None, help="postgres conninfo, tables are copied directly to it")
+@click.option("--csv/--no-csv", "save_csv", default=None, help="save CSV files (by default if no other output is set)")
+@click.option("--arrow", "save_arrow", is_flag=True, help="save typed columnar files ({table}.arrow) as well")
+@click.option("--arrow-compression", type=click.Choice(['lz4', 'zstd']), default=None, help="compress columnar files")
+@click.option("--person-memory", type=int, default=None, help="MB of persons map kept in memory (spilled to disk)")
+@click.option("--checkpoint", "checkpoint_interval", type=float, default=None, help="seconds between checkpoints")
+@click.option("--resume", is_flag=True, help="continue from the last checkpoint ({target}.checkpoint next to FILENAME)")
+@click.option("--report/--no-report", default=True, help="save timings and memory usage to {target}.report.json")
+def main(
+        target: str,
+        filename: str,
+        engine: str,
+        jobs: int,
+        conninfo: T.Optional[str],
+        save_csv: T.Optional[bool],
+        save_arrow: bool,
+        arrow_compression: T.Optional[str],
+        person_memory: T.Optional[int],
+        checkpoint_interval: T.Optional[float],
+        resume: bool,
+        report: bool,
+):
+    """ Parses XML document (FILENAME) into CSV files (or a database) with tables of a given TARGET. """
+    global person_memory_budget
+    log.info(f"Using filename: {filename}, engine: {engine}")
+    if person_memory is not None:
+        person_memory_budget = person_memory * 2 ** 20
+    if jobs < 1:
+        raise click.BadParameter("has to be positive", param_hint="--jobs")
+    if jobs > 1 and (target != 'all' or ENGINES[engine] is not ExpatEngine):
+        raise click.BadParameter("sharded parsing is supported only for 'all' target with expat engine")
+
+    open_tables = list()
+    if save_csv or (save_csv is None and conninfo is None and not save_arrow):
+        open_tables.append(open_csv_table)
+    if save_arrow:
+        # pyarrow is only needed for this output
+        from columnar import open_arrow_table
+        open_tables.append(partial(open_arrow_table, TABLE_COLUMNS, compression=arrow_compression))
+    if conninfo is not None:
+        # tables have to be created before (see loading/init.sql), psycopg2 is only needed for this output
+        from pg_copy import open_postgres_table
+        open_tables.append(partial(open_postgres_table, conninfo, TABLE_COLUMNS))
+    if len(open_tables) == 0:
+        raise click.BadParameter("--no-csv requires --db or --arrow")
+    open_table = open_tables[0] if len(open_tables) == 1 else partial(open_tee_table, open_tables)
+
+    if (checkpoint_interval is not None or resume) and (
+            target == 'generic' or jobs > 1 or ENGINES[engine] is not ExpatEngine or open_table is not open_csv_table
+    ):
+        raise click.BadParameter("checkpoints are supported only for sequential parsing to CSV files with expat engine")
+
+    load_dblp(target, filename, engine, jobs, open_table, checkpoint_interval, resume, report)
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
-    if len(sys.argv) < 1:
-        log.error(f"Usage: {sys.argv[0]} [target] [filename]")
-        exit(2)
-    else:
-        target = sys.argv[1]
-
-    if len(sys.argv) > 2:
-        filename = sys.argv[2]
-        log.info(f"Using filename: {filename}")
-        if len(sys.argv) > 3:
-            log.info(f"Using non-standard expected event count: {expected_event_count}")
-            expected_event_count = int(sys.argv[3])
-    else:
-        filename = "data/dblp.xml"
-        log.warning(f"Using default filename: {filename}")
-
-    # noinspection PyUnboundLocalVariable
-    load_dblp(target, filename)
+    main()
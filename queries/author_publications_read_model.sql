@@ -0,0 +1,139 @@
+-- denormalized read model of get_author_publications (see author_publications.sql):
+-- one row per publication of every author, with names of all authors of the publication in a single array,
+-- so that the query reads rows of a single author instead of joining person, author, publication, author and person
+-- run once after the data is loaded (and post-load.sql), later changes are applied by refresh_author_publications()
+
+-- cleanup
+drop trigger if exists author_publications_log_author on author;
+drop trigger if exists author_publications_log_publication on publication;
+drop trigger if exists author_publications_log_person on person;
+drop view if exists author_publications_source;
+drop table if exists author_publications, author_publications_log;
+
+
+create table author_publications (
+    person_id int not null,
+    full_name text not null,
+    publication_key varchar(80) not null,
+    title text null,
+    booktitle text null,
+    journal text null,
+    pages text null,
+    year smallint null,
+    authors text[] not null,  -- all authors of the publication (author table does not store their positions)
+    constraint author_publications_pk primary key (person_id, publication_key)
+);
+
+-- publications which rows have to be built again
+create table author_publications_log (
+    id bigserial not null,
+    publication_key varchar(80) not null,
+    constraint author_publications_log_pk primary key (id)
+);
+
+
+-- rows of the read model computed from normalized tables
+-- (a subquery instead of a CTE and publication_key taken from it, so that filters by publication_key
+-- are pushed down into the aggregation)
+create view author_publications_source as
+    select  person.id as person_id,
+            person.full_name,
+            publication_authors.publication_key,
+            publication.title,
+            publication.booktitle,
+            publication.journal,
+            publication.pages,
+            publication.year,
+            publication_authors.authors
+    from author
+    join person on person.id = author.person_id
+    join publication on publication.key = author.publication_key
+    join (
+        select  author.publication_key,
+                array_agg(person.full_name order by person.full_name) as authors
+        from author
+        join person on person.id = author.person_id
+        group by author.publication_key
+    ) as publication_authors on publication_authors.publication_key = author.publication_key;
+
+
+-- initial state, built in bulk
+insert into author_publications select * from author_publications_source;
+
+create index author_publications_full_name on author_publications (full_name);
+-- rows of an author are stored next to each other
+cluster author_publications using author_publications_full_name;
+analyze author_publications;
+
+
+-- every change which can modify rows of the read model logs keys of affected publications
+create or replace function log_author_publications_change() returns trigger as $$
+begin
+    if tg_table_name = 'author' then
+        if tg_op in ('DELETE', 'UPDATE') then
+            insert into author_publications_log (publication_key) values (old.publication_key);
+        end if;
+        if tg_op in ('INSERT', 'UPDATE') then
+            insert into author_publications_log (publication_key) values (new.publication_key);
+        end if;
+    elsif tg_table_name = 'publication' then
+        if tg_op in ('DELETE', 'UPDATE') then
+            insert into author_publications_log (publication_key) values (old.key);
+        end if;
+        if tg_op in ('INSERT', 'UPDATE') then
+            insert into author_publications_log (publication_key) values (new.key);
+        end if;
+    elsif tg_table_name = 'person' and old.full_name is distinct from new.full_name then
+        -- names are stored in rows of all publications of the person
+        insert into author_publications_log (publication_key)
+            select publication_key from author where person_id = new.id;
+    end if;
+    return null;
+end;
+$$ language plpgsql;
+
+create trigger author_publications_log_author
+    after insert or update or delete on author
+    for each row execute procedure log_author_publications_change();
+
+create trigger author_publications_log_publication
+    after insert or update or delete on publication
+    for each row execute procedure log_author_publications_change();
+
+create trigger author_publications_log_person
+    after update on person
+    for each row execute procedure log_author_publications_change();
+
+
+-- rebuilds rows of logged publications
+create or replace function refresh_author_publications() returns bigint as $$
+declare
+    last_change bigint;
+    publication_keys varchar(80)[];
+begin
+    -- waits for transactions which are changing logged tables, so that none of their changes is missed
+    lock table author_publications_log in share row exclusive mode;
+    select max(id), array_agg(distinct publication_key) into last_change, publication_keys from author_publications_log;
+    if last_change is null then
+        return 0;
+    end if;
+
+    delete from author_publications where publication_key = any(publication_keys);
+    insert into author_publications
+        select * from author_publications_source where publication_key = any(publication_keys);
+
+    delete from author_publications_log where id <= last_change;
+    return array_length(publication_keys, 1);
+end;
+$$ language plpgsql;
+
+
+-- get list of publications for author, one row per publication
+prepare get_author_publications_read_model (text)
+    as select full_name, publication_key as key, title, booktitle, journal, pages, year, authors
+        from author_publications
+        where full_name = $1;
+
+execute get_author_publications_read_model ('Krzysztof Diks');
+
+explain (analyze, costs, timing, format yaml) execute get_author_publications_read_model ('Krzysztof Diks');
@@ -0,0 +1,219 @@
+-- incremental maintenance of the coauthor graph and author totals (replaces materialized views from authors_graph.sql)
+-- run once after the data is loaded, later changes of author table are applied by refresh_coauthor_graph()
+
+-- cleanup (materialized views from authors_graph.sql, table loaded by coauthor_graph.py or a previous run of this script)
+do $$
+declare
+    relation record;
+begin
+    for relation in
+        select relname, relkind from pg_class
+        where relname in ('top_authors', 'coauthor_graph') and relnamespace = 'public'::regnamespace
+    loop
+        execute format(
+            'drop %s if exists %I cascade',
+            case relation.relkind when 'm' then 'materialized view' when 'v' then 'view' else 'table' end,
+            relation.relname
+        );
+    end loop;
+end;
+$$;
+drop trigger if exists author_coauthor_graph_log on author;
+drop table if exists author_graph_totals, coauthor_graph_log;
+
+
+-- the coauthor graph: same columns as the materialized view, but a table which can be updated
+create table coauthor_graph (
+    author1_id int not null,
+    author2_id int not null,
+    pair_count bigint not null,
+    pair_weight float8 not null,
+    constraint coauthor_graph_pk primary key (author1_id, author2_id)
+);
+
+-- sums of pair_count and pair_weight of all edges of an author (top_authors without names)
+create table author_graph_totals (
+    author_id int not null,
+    author_count bigint not null,
+    author_weight float8 not null,
+    constraint author_graph_totals_pk primary key (author_id)
+);
+
+-- changes of author table which were not applied to the graph yet: +1 for inserted rows, -1 for deleted
+create table coauthor_graph_log (
+    id bigserial not null,
+    publication_key varchar(80) not null,
+    person_id int not null,
+    change smallint not null,
+    constraint coauthor_graph_log_pk primary key (id)
+);
+
+
+-- initial state, computed in full (the same query as the materialized view)
+-- alternatively the graph can be loaded by queries/coauthor_graph.py, which also rebuilds totals
+insert into coauthor_graph (author1_id, author2_id, pair_count, pair_weight)
+    with publication_weight as (
+        select  publication_key,
+                (cast(1 as float8) / count(person_id)) as publ_weight
+        from author
+        group by publication_key
+    )   select  a1.person_id,
+                a2.person_id,
+                count(a1.publication_key),
+                sum(publ_weight)
+        from author a1
+        join author a2
+        on a1.person_id < a2.person_id and a1.publication_key = a2.publication_key
+        join publication_weight
+        on a1.publication_key = publication_weight.publication_key
+        group by a1.person_id, a2.person_id;
+
+create index coauthor_left_id on coauthor_graph (author1_id);
+create index coauthor_right_id on coauthor_graph (author2_id);
+
+
+-- totals are computed from the graph, when it was replaced in full
+create or replace function rebuild_author_graph_totals() returns void as $$
+begin
+    truncate author_graph_totals;
+    insert into author_graph_totals (author_id, author_count, author_weight)
+        select author_id, sum(pair_count), sum(pair_weight) from (
+            select author1_id as author_id, pair_count, pair_weight from coauthor_graph
+            union all
+            select author2_id, pair_count, pair_weight from coauthor_graph
+        ) as author_edges
+        group by author_id;
+end;
+$$ language plpgsql;
+
+select rebuild_author_graph_totals();
+
+create index author_graph_totals_weight on author_graph_totals (author_weight desc, author_count desc);
+
+create view top_authors as
+    select  full_name,
+            author_count,
+            author_weight
+    from author_graph_totals
+    join person on author_graph_totals.author_id = person.id
+    order by author_weight desc, author_count desc;
+
+
+-- every change of author table is logged, until it is applied
+create or replace function log_author_change() returns trigger as $$
+begin
+    if tg_op in ('DELETE', 'UPDATE') then
+        insert into coauthor_graph_log (publication_key, person_id, change)
+            values (old.publication_key, old.person_id, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        insert into coauthor_graph_log (publication_key, person_id, change)
+            values (new.publication_key, new.person_id, 1);
+    end if;
+    return null;
+end;
+$$ language plpgsql;
+
+create trigger author_coauthor_graph_log
+    after insert or update or delete on author
+    for each row execute procedure log_author_change();
+
+
+-- applies logged changes: only pairs of authors of changed publications and totals of these authors are updated
+-- (weights of all pairs of a publication change with its number of authors, so the old contribution
+-- of every changed publication is subtracted and the new one added)
+create or replace function refresh_coauthor_graph() returns bigint as $$
+declare
+    last_change bigint;
+    n_changes bigint;
+begin
+    -- waits for transactions which are changing author table, so that none of their changes is missed
+    lock table coauthor_graph_log in share row exclusive mode;
+    select max(id), count(id) into last_change, n_changes from coauthor_graph_log;
+    if last_change is null then
+        return 0;
+    end if;
+
+    drop table if exists refresh_changes, refresh_authors, refresh_pairs;  -- previous call in the same transaction
+
+    -- net change of every (publication, person): 1 = inserted, -1 = deleted, 0 = unchanged
+    create temp table refresh_changes on commit drop as
+        select publication_key, person_id, sum(change) as change
+        from coauthor_graph_log
+        where id <= last_change
+        group by publication_key, person_id;
+
+    -- authors of changed publications after (version 1) and before the changes (version -1)
+    create temp table refresh_authors on commit drop as
+        with changed_publications as (
+            select distinct publication_key from refresh_changes
+        )   select a.publication_key, a.person_id, 1 as version
+            from author a
+            join changed_publications using (publication_key)
+        union all
+            select a.publication_key, a.person_id, -1
+            from author a
+            join changed_publications using (publication_key)
+            left join refresh_changes c using (publication_key, person_id)
+            where coalesce(c.change, 0) <= 0
+        union all
+            select publication_key, person_id, -1
+            from refresh_changes
+            where change < 0;
+
+    -- differences of pairs: new contributions of publications minus old ones
+    create temp table refresh_pairs on commit drop as
+        with publication_weight as (
+            select  publication_key,
+                    version,
+                    (cast(1 as float8) / count(person_id)) as publ_weight
+            from refresh_authors
+            group by publication_key, version
+        )   select  a1.person_id as author1_id,
+                    a2.person_id as author2_id,
+                    sum(a1.version) as pair_count,
+                    sum(a1.version * publ_weight) as pair_weight
+            from refresh_authors a1
+            join refresh_authors a2
+            on a1.person_id < a2.person_id and a1.publication_key = a2.publication_key and a1.version = a2.version
+            join publication_weight
+            on a1.publication_key = publication_weight.publication_key and a1.version = publication_weight.version
+            group by a1.person_id, a2.person_id
+            having sum(a1.version) <> 0 or sum(a1.version * publ_weight) <> 0;
+
+    insert into coauthor_graph (author1_id, author2_id, pair_count, pair_weight)
+        select author1_id, author2_id, pair_count, pair_weight from refresh_pairs
+        on conflict (author1_id, author2_id) do update
+        set pair_count = coauthor_graph.pair_count + excluded.pair_count,
+            pair_weight = coauthor_graph.pair_weight + excluded.pair_weight;
+    delete from coauthor_graph
+        using refresh_pairs
+        where coauthor_graph.author1_id = refresh_pairs.author1_id
+        and coauthor_graph.author2_id = refresh_pairs.author2_id
+        and coauthor_graph.pair_count <= 0;
+
+    insert into author_graph_totals (author_id, author_count, author_weight)
+        select author_id, sum(pair_count), sum(pair_weight) from (
+            select author1_id as author_id, pair_count, pair_weight from refresh_pairs
+            union all
+            select author2_id, pair_count, pair_weight from refresh_pairs
+        ) as author_changes
+        group by author_id
+        on conflict (author_id) do update
+        set author_count = author_graph_totals.author_count + excluded.author_count,
+            author_weight = author_graph_totals.author_weight + excluded.author_weight;
+    delete from author_graph_totals
+        where author_count <= 0
+        and author_id in (select author1_id from refresh_pairs union select author2_id from refresh_pairs);
+
+    delete from coauthor_graph_log where id <= last_change;
+    return n_changes;
+end;
+$$ language plpgsql;
+
+
+-- sanity check:
+select * from top_authors limit 10;
+
+-- after loading new publications (loading/delta.py calls it automatically, when this script was run):
+select refresh_coauthor_graph();
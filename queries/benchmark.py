@@ -1,13 +1,16 @@
+import os
 import sys
+import typing as T
 from datetime import datetime
 import gc
 
 # import psycopg2 as pg
 import pandas as pd
-import numpy as np
 from sqlalchemy import create_engine
 from tqdm import tqdm
 
+from query_plans import plan_changes, plan_fingerprint, plan_groups, plan_nodes, plan_shape
+
 
 authors_query = """
 with top_autors as (
@@ -41,17 +44,67 @@ prepare get_author_publications (text)
             left join person on person.id = author_publications_with_coauthors.person_id;
 """
 
+# see author_publications_read_model.sql, the read model has to be built before
+read_model_prepare_query = """
+prepare get_author_publications_read_model (text)
+    as select full_name, publication_key as key, title, booktitle, journal, pages, year, authors
+        from author_publications
+        where full_name = $1;
+"""
+
+# variant name => (prepare query, name of prepared statement)
+QUERY_VARIANTS = {
+    'normalized': (author_publications_prepare_query, 'get_author_publications'),
+    'read_model': (read_model_prepare_query, 'get_author_publications_read_model'),
+}
+
 N_EXPERIMENTS = 10
 
+indexes_query = "select indexname from pg_indexes where schemaname = 'public';"
+
+
+def capture_plans(conn, statement_name: str, parameters: pd.Series, desc: str) -> T.Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Executes a prepared statement for every parameter with explain (analyze, buffers).
+    :return: (one row per parameter with fingerprint and shape of its plan, execution time and buffers;
+        one row per node of every plan with its statistics, see query_plans.plan_nodes)
+    """
+    plan_rows, node_dfs = list(), list()
+    for parameter in tqdm(parameters, desc=f"{desc} plans"):
+        res = conn.execute(
+            f"explain (analyze true, buffers true, format json) execute {statement_name} (%s);", parameter
+        )
+        res_json = res.fetchone()[0][0]
+        plan = res_json['Plan']
+        plan_rows.append({
+            'parameter': parameter,
+            'fingerprint': plan_fingerprint(plan),
+            'execution_time': float(res_json['Execution Time']),
+            'shared_hit_blocks': plan.get('Shared Hit Blocks'),
+            'shared_read_blocks': plan.get('Shared Read Blocks'),
+            'shape': plan_shape(plan),
+        })
+        nodes_df = pd.DataFrame(plan_nodes(plan))
+        nodes_df.insert(0, 'parameter', parameter)
+        node_dfs.append(nodes_df)
+    return pd.DataFrame(plan_rows), pd.concat(node_dfs, ignore_index=True)
+
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} [postgres db conninfo] [path to csv with authors to search for (optional)]")
+        print(
+            f"Usage: {sys.argv[0]} [postgres db conninfo] [path to csv with authors to search for (optional)] "
+            f"[query variants, comma separated: {', '.join(QUERY_VARIANTS)} (optional, default: normalized)]"
+        )
         exit(2)
     else:
         engine = create_engine(sys.argv[1])
+        variants = sys.argv[3].split(',') if len(sys.argv) > 3 else ['normalized']
+        if any(variant not in QUERY_VARIANTS for variant in variants):
+            print(f"Unknown query variants: {sys.argv[3]}")
+            exit(2)
 
-        if len(sys.argv) == 3:
+        if len(sys.argv) >= 3:
             print(f"Reading authors from to {sys.argv[2]}")
             authors = pd.read_csv(sys.argv[2], dtype={'full_name': str, 'count_publications': int})
         else:
@@ -68,46 +121,89 @@ if __name__ == '__main__':
 
     # noinspection PyUnboundLocalVariable
     with engine.connect() as conn:
-        conn.execute(author_publications_prepare_query)
+        for variant in variants:
+            conn.execute(QUERY_VARIANTS[variant][0])
 
         # noinspection PyUnboundLocalVariable
-        result_dfs = list()
+        result_dfs = {variant: list() for variant in variants}
         for experiment in range(N_EXPERIMENTS):
             print(f"Experiment {experiment+1} out of {N_EXPERIMENTS}")
 
-            results = authors.copy()
-            results['execution_time'] = None
-            t = tqdm(authors['full_name'])
-            for idx, author_name in enumerate(t):
-                t.set_postfix_str(author_name)
-                res = conn.execute(
-                    "explain (analyze true, timing false, format json) execute get_author_publications (%s);", author_name
-                )
-                res_json = res.fetchone()[0][0]
-                execution_time = res_json['Execution Time']
-                results.loc[idx, 'execution_time'] = float(execution_time)
-            t.close()
-
-            results_summary = results[['execution_time']].agg(
-                ['min', 'max', 'median', 'mean', 'std', 'sum', 'count']
-            ).T.add_prefix('time_')
-            results_summary['arg_max'] = [
-                authors['full_name'].iloc[int(results['execution_time'].astype(np.float).idxmax(skipna=True))]
-            ]
-            results_summary['arg_min'] = [
-                authors['full_name'].iloc[int(results['execution_time'].astype(np.float).idxmin(skipna=True))]
-            ]
-
-            experiment_name = datetime.now().replace(microsecond=0).isoformat()
-            results_summary.index = [experiment_name]
-            result_dfs.append(results_summary)
+            # variants are run one after another on the same authors in every experiment
+            for variant in variants:
+                statement_name = QUERY_VARIANTS[variant][1]
+                results = authors.copy()
+                results['execution_time'] = None
+                t = tqdm(authors['full_name'], desc=variant)
+                for idx, author_name in enumerate(t):
+                    t.set_postfix_str(author_name)
+                    res = conn.execute(
+                        f"explain (analyze true, timing false, format json) execute {statement_name} (%s);",
+                        author_name
+                    )
+                    res_json = res.fetchone()[0][0]
+                    execution_time = res_json['Execution Time']
+                    results.loc[idx, 'execution_time'] = float(execution_time)
+                t.close()
+
+                results_summary = results[['execution_time']].agg(
+                    ['min', 'max', 'median', 'mean', 'std', 'sum', 'count']
+                ).T.add_prefix('time_')
+                results_summary['arg_max'] = [
+                    authors['full_name'].iloc[int(results['execution_time'].astype(float).idxmax(skipna=True))]
+                ]
+                results_summary['arg_min'] = [
+                    authors['full_name'].iloc[int(results['execution_time'].astype(float).idxmin(skipna=True))]
+                ]
+
+                experiment_name = datetime.now().replace(microsecond=0).isoformat()
+                results_summary.index = [experiment_name]
+                result_dfs[variant].append(results_summary)
             print("")  # separator
             gc.collect()
 
+        # plans are captured in a separate run, because timing of every node makes executions slower
+        indexes = sorted(name for name, in conn.execute(indexes_query))
+        plan_dfs = dict()
+        for variant in variants:
+            plan_dfs[variant] = capture_plans(
+                conn, QUERY_VARIANTS[variant][1], authors['full_name'].drop_duplicates(), variant
+            )
+            plan_dfs[variant][0]['indexes'] = ' '.join(indexes)
+
     print("Saving results...")
-    all_experiments_result_df = pd.concat(
-        result_dfs, axis='index'
-    )
-    out_filename = f'queries/results/benchmark_{N_EXPERIMENTS}.csv'
-    all_experiments_result_df.to_csv(out_filename, index=True, index_label='experiment_name')
-    print(f"Results saved to: {out_filename}")
+    for variant in variants:
+        plans_df, nodes_df = plan_dfs[variant]
+        all_experiments_result_df = pd.concat(
+            result_dfs[variant], axis='index'
+        )
+        # plans of the slowest authors
+        all_experiments_result_df['arg_max_plan'] = all_experiments_result_df['arg_max'].map(
+            plans_df.set_index('parameter')['fingerprint']
+        )
+        prefix = 'benchmark' if variant == 'normalized' else f'benchmark_{variant}'
+        out_filename = f'queries/results/{prefix}_{N_EXPERIMENTS}.csv'
+        all_experiments_result_df.to_csv(out_filename, index=True, index_label='experiment_name')
+        print(f"{variant}: mean time {all_experiments_result_df['time_mean'].mean():.3f}ms, results saved to: {out_filename}")
+
+        plans_filename = f'queries/results/plans_{variant}.csv'
+        if os.path.exists(plans_filename):
+            # plans of the previous run, eg. before indexes from loading/post-load.sql were created
+            previous_plans_df = pd.read_csv(plans_filename, dtype={'parameter': str, 'indexes': str}).fillna('')
+            changes_df = plan_changes(previous_plans_df, plans_df)
+            if len(changes_df) > 0:
+                previous_indexes = set(previous_plans_df['indexes'].iloc[0].split())
+                print(
+                    f"{variant}: plans of {len(changes_df)} authors changed since the previous run "
+                    f"(indexes created: {', '.join(sorted(set(indexes) - previous_indexes)) or 'none'}, "
+                    f"dropped: {', '.join(sorted(previous_indexes - set(indexes))) or 'none'})"
+                )
+                out_filename = f'queries/results/plan_changes_{variant}.csv'
+                changes_df.to_csv(out_filename, index=False)
+                print(f"Changed plans saved to: {out_filename}")
+        plans_df.to_csv(plans_filename, index=False)
+        nodes_df.to_csv(f'queries/results/plan_nodes_{variant}.csv', index=False)
+        groups_df = plan_groups(plans_df)
+        out_filename = f'queries/results/plan_groups_{variant}.csv'
+        groups_df.to_csv(out_filename, index=False)
+        print(f"{variant}: {len(groups_df)} distinct plans, plans saved to: {plans_filename}, {out_filename}")
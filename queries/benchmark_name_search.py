@@ -0,0 +1,115 @@
+"""
+Benchmark of searching persons by a part of their name: the in-memory index (see name_search.py) against
+SQL alternatives on person table (ilike of a prefix of the name or of any word, pg_trgm similarity if the extension
+is installed). Queries are derived from names of benchmarked authors: a prefix of the last word, the first word with
+the first letter of the last one, the whole name without accents and the name with a typo.
+All methods return 10 persons with the most publications, times are measured by the client (in ms).
+"""
+import sys
+import time
+import typing as T
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from tqdm import tqdm
+
+from name_search import NameIndex, normalize_name
+
+N_REPETITIONS = 10
+
+""" Number of returned persons """
+TOP_K = 10
+
+ranked_persons = """
+select person.id, count(author.person_id) as count_publications from person
+    left join author on person.id = author.person_id
+    where {condition}
+    group by person.id
+    order by {order} count(author.person_id) desc
+    limit {k};
+"""
+
+SQL_METHODS = {
+    'sql_ilike_prefix': ranked_persons.format(condition="person.full_name ilike $1 || '%'", order='', k=TOP_K),
+    'sql_ilike_word': ranked_persons.format(
+        condition="person.full_name ilike $1 || '%' or person.full_name ilike '% ' || $1 || '%'", order='', k=TOP_K
+    ),
+    'sql_trigram': ranked_persons.format(
+        condition="person.full_name % $1", order='similarity(min(person.full_name), $1) desc,', k=TOP_K
+    ),
+}
+
+
+def name_queries(full_name: str) -> T.Dict[str, str]:
+    """ Returns queries of every kind derived from a name of an author """
+    words = full_name.split()
+    last = next((word for word in reversed(words) if not word.isdigit()), words[-1])  # homonyms end with 0001
+    queries = {
+        'last_word_prefix': last[:3],
+        'first_word_last_initial': f'{words[0]} {last[0]}' if len(words) > 1 else words[0],
+        'unaccented': normalize_name(full_name),
+    }
+    if len(last) > 3:
+        # swapped letters in the middle of the last word
+        i = len(last) // 2
+        queries['typo'] = full_name.replace(last, last[:i - 1] + last[i] + last[i - 1] + last[i + 1:])
+    return queries
+
+
+def run_method(search: T.Callable[[str], T.List], queries: pd.DataFrame, method: str) -> T.List[T.Tuple]:
+    rows = list()
+    for kind, query in tqdm(queries[['kind', 'query']].itertuples(index=False), desc=method, total=len(queries)):
+        n_results = len(search(query))  # warm up (first execution of a prepared statement is planned)
+        for repetition in range(N_REPETITIONS):
+            start = time.perf_counter()
+            search(query)
+            rows.append((method, kind, query, repetition, (time.perf_counter() - start) * 1000, n_results))
+    return rows
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(
+            f"Usage: {sys.argv[0]} [postgres db conninfo] [directory of the index built by name_search.py] "
+            f"[path to csv with authors (optional)]"
+        )
+        exit(2)
+    conninfo, index_dir = sys.argv[1], sys.argv[2]
+    authors_filename = sys.argv[3] if len(sys.argv) > 3 else 'queries/results/authors_100_top_100_rand.csv'
+    authors = pd.read_csv(authors_filename, dtype={'full_name': str})['full_name'].dropna().unique()
+    queries_df = pd.DataFrame(
+        [(kind, query) for full_name in authors for kind, query in name_queries(full_name).items()],
+        columns=['kind', 'query'],
+    )
+    print(f"{len(queries_df)} queries derived from {len(authors)} authors")
+
+    index = NameIndex.load(index_dir)
+    results = run_method(lambda query: index.search(query, TOP_K), queries_df, 'index')
+    results += run_method(lambda query: index.search(query, TOP_K, fuzzy=False), queries_df, 'index_prefix')
+
+    engine = create_engine(conninfo)
+    with engine.connect() as conn:
+        has_trigrams = conn.execute("select count(*) from pg_extension where extname = 'pg_trgm'").scalar() > 0
+        for method, query in SQL_METHODS.items():
+            if method == 'sql_trigram' and not has_trigrams:
+                print("pg_trgm extension is not installed, skipping trigram search")
+                continue
+            # % of patterns would be taken for a parameter by the driver
+            conn.execute(f"prepare {method} (text) as {query}".replace('%', '%%'))
+            results += run_method(
+                lambda name: conn.execute(f"execute {method} (%s)", name).fetchall(), queries_df, method
+            )
+
+    print("Saving results...")
+    results_df = pd.DataFrame(
+        results, columns=['method', 'kind', 'query', 'repetition', 'time_ms', 'n_results']
+    )
+    out_filename = 'queries/results/name_search_benchmark.csv'
+    results_df.to_csv(out_filename, index=False)
+    summary_df = results_df.groupby(['kind', 'method'])['time_ms'].agg(
+        median='median', p95=lambda times: np.percentile(times, 95), max='max'
+    )
+    summary_df['n_results_mean'] = results_df.groupby(['kind', 'method'])['n_results'].mean()
+    print(summary_df.to_string(float_format='{:.3f}'.format))
+    print(f"Results saved to: {out_filename}")
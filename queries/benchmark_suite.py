@@ -0,0 +1,240 @@
+"""
+Benchmark suite: workloads (prepared queries with their inputs) are declared in a spec file (see benchmarks.json).
+Execution times of every workload and input are saved in queries/results/suite/<schema variant>/<run name>.csv
+(see run_name) and compared with a stored baseline of the same schema variant. A workload is a regression when
+it is slower than the baseline by more than the tolerance and the difference is statistically significant
+(one sided Mann-Whitney U test of times relative to the baseline median of the same input).
+Any regression fails the run (exit code 1).
+"""
+import json
+import math
+import os
+import subprocess
+import typing as T
+from datetime import datetime
+
+import click
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from tqdm import tqdm
+
+RESULTS_DIR = 'queries/results/suite'
+
+""" File in results directory of a schema variant with the git commit of its baseline results """
+BASELINE_FILENAME = 'baseline'
+
+
+def git_commit() -> str:
+    """ Returns short hash of the checked out commit, with -dirty suffix when tracked files are modified """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, check=True, text=True
+        ).stdout.strip()
+        modified = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if modified else commit
+
+
+def run_name(commit: str, run_time: datetime, baseline: T.Optional[str], save_baseline: bool) -> str:
+    """
+    Returns name of results of a run: the commit, with time of the run when the working tree is modified
+    (results of different changes are kept) or when results of the commit are the baseline, which is replaced
+    only with --save-baseline.
+    """
+    if commit.endswith('-dirty') or (commit == baseline and not save_baseline):
+        return f"{commit}-{run_time:%Y%m%dT%H%M%S}"
+    return commit
+
+
+def workload_statement(workload: T.Dict[str, T.Any], variant: str) -> T.Optional[str]:
+    """ Returns the statement of a workload in a schema variant, None if the workload is not defined for it """
+    statement = workload['statement']
+    if isinstance(statement, dict):
+        return statement.get(variant)
+    return statement
+
+
+def workload_inputs(workload: T.Dict[str, T.Any]) -> T.List[T.Any]:
+    inputs = workload['inputs']
+    if 'values' in inputs:
+        values = list(inputs['values'])
+    else:
+        values = pd.read_csv(inputs['file'], dtype={inputs['column']: str})[inputs['column']].tolist()
+    return values[:inputs.get('limit')]
+
+
+def run_workload(
+        conn, name: str, statement: str, parameter_type: str, inputs: T.List[T.Any], repetitions: int
+) -> pd.DataFrame:
+    """
+    :return: execution time (ms, as reported by explain analyze) of every input in every repetition
+    """
+    statement_name = f'suite_{name}'
+    conn.execute(f"deallocate all; prepare {statement_name} ({parameter_type}) as {statement};")
+    # the first execution of every input is not measured (plans and caches are warmed up)
+    for value in inputs:
+        conn.execute(f"execute {statement_name} (%s);", value)
+
+    rows = list()
+    for repetition in tqdm(range(repetitions), desc=name, unit="repetition"):
+        for value in inputs:
+            res = conn.execute(
+                f"explain (analyze true, timing false, format json) execute {statement_name} (%s);", value
+            )
+            rows.append((name, str(value), repetition, float(res.fetchone()[0][0]['Execution Time'])))
+    return pd.DataFrame(rows, columns=['workload', 'input', 'repetition', 'execution_time'])
+
+
+def mann_whitney_greater(x: np.ndarray, y: np.ndarray) -> float:
+    """
+    One sided Mann-Whitney U test (normal approximation with tie correction).
+    :return: p-value of the hypothesis that values of x are not greater than values of y
+    """
+    n1, n2 = len(x), len(y)
+    if n1 == 0 or n2 == 0:
+        return float('nan')
+    n = n1 + n2
+    ranks = pd.Series(np.concatenate([x, y])).rank(method='average').values
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    ties = pd.Series(ranks).value_counts().values
+    variance = n1 * n2 / 12 * ((n + 1) - (ties ** 3 - ties).sum() / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def relative_times(times: pd.DataFrame, input_medians: pd.Series) -> np.ndarray:
+    """ Returns logarithms of execution times divided by medians of their inputs """
+    # explain analyze reports times in microseconds, so they are never smaller than 0.001ms
+    return np.log(
+        np.maximum(times['execution_time'].values, 1e-3) / np.maximum(input_medians[times['input']].values, 1e-3)
+    )
+
+
+def compare(
+        baseline: pd.DataFrame, current: pd.DataFrame, tolerances: T.Dict[str, float], alpha: float
+) -> pd.DataFrame:
+    """
+    Compares execution times of workloads run on the same inputs.
+    The ratio of a workload is the ratio of sums of median times of its inputs (cheap inputs, which times are
+    dominated by measurement resolution, do not affect it much). Significance is tested on times divided
+    by the baseline median of their input, so that inputs of different cost can be compared together.
+    :param tolerances: relative slowdown allowed for every workload
+    :param alpha: significance level
+    :return: one row per workload present in both results
+    """
+    rows = list()
+    for workload, current_times in current.groupby('workload', sort=False):
+        baseline_times = baseline[baseline['workload'] == workload]
+        input_medians = baseline_times.groupby('input')['execution_time'].median()
+        current_times = current_times[current_times['input'].isin(input_medians.index)]
+        if len(current_times) == 0:
+            continue
+        baseline_times = baseline_times[baseline_times['input'].isin(current_times['input'])]
+
+        base_relative = relative_times(baseline_times, input_medians)
+        current_relative = relative_times(current_times, input_medians)
+        ratio = current_times.groupby('input')['execution_time'].median().sum() / input_medians[
+            current_times['input'].unique()].sum()
+        p_value = mann_whitney_greater(current_relative, base_relative)
+        rows.append({
+            'workload': workload,
+            'n_inputs': current_times['input'].nunique(),
+            'baseline_mean_time': baseline_times['execution_time'].mean(),
+            'current_mean_time': current_times['execution_time'].mean(),
+            'ratio': ratio,
+            'p_value': p_value,
+            'tolerance': tolerances[workload],
+            'regression': bool(ratio > 1 + tolerances[workload] and p_value < alpha),
+        })
+    return pd.DataFrame(rows)
+
+
+@click.command()
+@click.argument("conninfo", type=str)
+@click.option("--spec", "spec_file", type=click.Path(exists=True, dir_okay=False), default='queries/benchmarks.json',
+              help="workloads to run")
+@click.option("--variant", type=str, default='normalized', help="schema variant of the database")
+@click.option("-w", "--workload", "workloads", type=str, multiple=True, help="run only given workloads")
+@click.option("-n", "--repetitions", type=int, default=None, help="overrides repetitions from the spec")
+@click.option("--baseline", type=str, default=None, help="commit of baseline results (default: the saved baseline)")
+@click.option("--save-baseline", is_flag=True, help="make results of this run the baseline of the variant")
+def main(
+        conninfo: str,
+        spec_file: str,
+        variant: str,
+        workloads: T.Tuple[str, ...],
+        repetitions: T.Optional[int],
+        baseline: T.Optional[str],
+        save_baseline: bool,
+):
+    """ Runs workloads from the spec on CONNINFO and compares them with the baseline """
+    with open(spec_file) as f:
+        spec = json.load(f)
+    unknown = set(workloads) - set(spec['workloads'])
+    if unknown:
+        raise click.BadParameter(f"unknown workloads: {', '.join(sorted(unknown))}", param_hint='--workload')
+    repetitions = repetitions or spec['repetitions']
+    tolerances = {
+        name: workload.get('tolerance', spec['tolerance']) for name, workload in spec['workloads'].items()
+    }
+
+    commit, run_time = git_commit(), datetime.now().replace(microsecond=0)
+    print(f"Commit {commit}, schema variant {variant}")
+    engine = create_engine(conninfo)
+    results = list()
+    with engine.connect() as conn:
+        for name, workload in spec['workloads'].items():
+            statement = workload_statement(workload, variant)
+            if (workloads and name not in workloads) or statement is None:
+                continue
+            results.append(run_workload(
+                conn, name, statement, workload['parameter_type'], workload_inputs(workload), repetitions
+            ))
+    if len(results) == 0:
+        print(f"No workloads defined for schema variant {variant}")
+        exit(2)
+    results_df = pd.concat(results, ignore_index=True)
+    results_df.insert(0, 'run', run_time.isoformat())
+
+    variant_dir = os.path.join(RESULTS_DIR, variant)
+    os.makedirs(variant_dir, exist_ok=True)
+    baseline_filename = os.path.join(variant_dir, BASELINE_FILENAME)
+    if baseline is None and os.path.exists(baseline_filename):
+        with open(baseline_filename) as f:
+            baseline = f.read().strip()
+
+    print("Saving results...")
+    name = run_name(commit, run_time, baseline, save_baseline)
+    out_filename = os.path.join(variant_dir, f'{name}.csv')
+    results_df.to_csv(out_filename, index=False)
+    print(f"Results saved to: {out_filename}")
+    if save_baseline:
+        with open(baseline_filename, 'w') as f:
+            f.write(f'{name}\n')
+        print(f"Baseline of {variant} set to {name}")
+
+    if baseline is None or baseline == name:
+        print("No baseline to compare with")
+        return
+    baseline_df = pd.read_csv(os.path.join(variant_dir, f'{baseline}.csv'), dtype={'input': str})
+    comparison_df = compare(baseline_df, results_df, tolerances, spec['alpha'])
+    print(f"Compared with baseline {baseline}:")
+    print(comparison_df.to_string(index=False, float_format='{:.4g}'.format))
+    out_filename = os.path.join(variant_dir, f'{name}_vs_{baseline}.csv')
+    comparison_df.to_csv(out_filename, index=False)
+    print(f"Comparison saved to: {out_filename}")
+
+    regressions = comparison_df[comparison_df['regression']]['workload'].tolist()
+    if regressions:
+        print(f"Regressions beyond tolerance: {', '.join(regressions)}")
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+Weighted coauthor graph (same edges as coauthor_graph view in authors_graph.sql) built in memory
+as a compressed sparse row (CSR) structure, instead of the self-join of author table.
+Every edge is stored in both directions: neighbours of a person are a sorted slice of int32 ids,
+with number of common publications (pair_count) and sum of 1 / number of authors of them (pair_weight).
+Arrays are saved as .npy files and memory-mapped when loaded, so tools can share the graph without reading it.
+"""
+import io
+import os
+import sys
+import typing as T
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from graph_components import (
+    CHUNK_SIZE, EdgeChunk, PublicationGroups, author_edges_query, read_author_arrow, read_author_csv, read_query,
+)
+
+""" Arrays of the graph, saved as {name}.npy files """
+GRAPH_ARRAYS = ('indptr', 'indices', 'counts', 'weights')
+
+coauthor_graph_table = """
+-- coauthor_graph and top_authors can be materialized views (authors_graph.sql) or already loaded tables
+do $$
+declare
+    relation record;
+begin
+    for relation in
+        select relname, relkind from pg_class
+        where relname in ('top_authors', 'coauthor_graph') and relnamespace = 'public'::regnamespace
+    loop
+        execute format(
+            'drop %s if exists %I cascade',
+            case relation.relkind when 'm' then 'materialized view' when 'v' then 'view' else 'table' end,
+            relation.relname
+        );
+    end loop;
+end;
+$$;
+
+create table coauthor_graph (
+    author1_id int not null,
+    author2_id int not null,
+    pair_count bigint not null,
+    pair_weight float8 not null
+);
+"""
+
+coauthor_graph_indexes = """
+create index coauthor_left_id on coauthor_graph (author1_id);
+create index coauthor_right_id on coauthor_graph (author2_id);
+analyze coauthor_graph;
+"""
+
+
+def complete_publications(author_chunks: T.Iterable[EdgeChunk]) -> T.Iterator[T.Tuple[np.ndarray, np.ndarray]]:
+    """
+    Re-chunks rows of author table, so that rows of a publication are never split between chunks.
+    :param author_chunks: (person ids, publication keys), rows of a publication have to be consecutive
+    :return: (person ids, indices of first rows of publications)
+    :raises ValueError: when rows of a publication are not consecutive (see PublicationGroups)
+    """
+    groups = PublicationGroups()
+    carry_ids, carry_keys = np.empty(0, dtype=np.int32), np.empty(0, dtype=object)
+    for person_ids, keys in author_chunks:
+        person_ids = np.concatenate([carry_ids, np.asarray(person_ids, dtype=np.int32)])
+        keys = np.concatenate([carry_keys, np.asarray(keys, dtype=object)])
+        if len(keys) == 0:
+            continue
+        is_start = np.ones(len(keys), dtype=bool)
+        is_start[1:] = keys[1:] != keys[:-1]
+        starts = np.flatnonzero(is_start)
+        # the last publication may continue in the next chunk
+        carry_ids, carry_keys = person_ids[starts[-1]:], keys[starts[-1]:]
+        if len(starts) > 1:
+            groups.close(keys[starts[:-1]])
+            yield person_ids[:starts[-1]], starts[:-1]
+    if len(carry_ids) > 0:
+        groups.close(carry_keys[:1])
+        yield carry_ids, np.zeros(1, dtype=np.int64)
+
+
+def coauthor_pairs(person_ids: np.ndarray, starts: np.ndarray) -> T.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Generates all pairs of coauthors of publications.
+    :param person_ids: authors of consecutive publications
+    :param starts: indices of first authors of publications
+    :return: (smaller ids, larger ids, 1 / number of authors of the publication)
+    """
+    sizes = np.diff(np.append(starts, len(person_ids)))
+    publication_size = np.repeat(sizes, sizes)
+    position = np.arange(len(person_ids)) - np.repeat(starts, sizes)
+    n_pairs = publication_size - position - 1  # every author is paired with the following authors
+    left = np.repeat(np.arange(len(person_ids)), n_pairs)
+    right = left + 1 + np.arange(len(left)) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+
+    u, v = person_ids[left], person_ids[right]
+    different = u != v
+    weights = 1.0 / publication_size[left[different]]
+    return np.minimum(u, v)[different], np.maximum(u, v)[different], weights
+
+
+def aggregate_pairs(
+        keys: np.ndarray, counts: np.ndarray, weights: np.ndarray
+) -> T.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Sums counts and weights of pairs with the same key (u << 32 | v), returns sorted unique keys """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return (
+        unique_keys,
+        np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(np.int64),
+        np.bincount(inverse, weights=weights, minlength=len(unique_keys)),
+    )
+
+
+class CoauthorGraph(object):
+    """ Undirected weighted graph in CSR format, neighbours of person i are indices[indptr[i]:indptr[i + 1]] """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, counts: np.ndarray, weights: np.ndarray):
+        """
+        :param indptr: int64 offsets of neighbour lists (n_nodes + 1)
+        :param indices: int32 ids of neighbours, sorted within every list
+        :param counts: int32 numbers of common publications
+        :param weights: float32 sums of 1 / number of authors of common publications
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.weights = weights
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def degree(self, person_id: int) -> int:
+        return int(self.indptr[person_id + 1] - self.indptr[person_id])
+
+    def neighbors(self, person_id: int) -> np.ndarray:
+        """ Sorted ids of coauthors (a view of the memory-mapped array) """
+        return self.indices[self.indptr[person_id]:self.indptr[person_id + 1]]
+
+    def neighbor_counts(self, person_id: int) -> np.ndarray:
+        return self.counts[self.indptr[person_id]:self.indptr[person_id + 1]]
+
+    def neighbor_weights(self, person_id: int) -> np.ndarray:
+        return self.weights[self.indptr[person_id]:self.indptr[person_id + 1]]
+
+    def edge(self, u: int, v: int) -> T.Optional[T.Tuple[int, float]]:
+        """ Returns (pair_count, pair_weight) of two persons, or None if they are not coauthors """
+        start, end = self.indptr[u], self.indptr[u + 1]
+        i = start + np.searchsorted(self.indices[start:end], v)
+        if i == end or self.indices[i] != v:
+            return None
+        return int(self.counts[i]), float(self.weights[i])
+
+    def edges(self, chunk_size: int = CHUNK_SIZE) -> T.Iterator[T.Tuple[np.ndarray, ...]]:
+        """ Yields chunks of edges (author1_id, author2_id, pair_count, pair_weight), every edge once (u < v) """
+        node = 0
+        while node < self.n_nodes:
+            # chunk of consecutive nodes with about chunk_size neighbours in total
+            end = int(np.searchsorted(self.indptr, self.indptr[node] + chunk_size, side='right')) - 1
+            end = min(max(end, node + 1), self.n_nodes)
+            start_offset, end_offset = self.indptr[node], self.indptr[end]
+            sources = np.repeat(np.arange(node, end, dtype=np.int32), np.diff(self.indptr[node:end + 1]))
+            targets = np.asarray(self.indices[start_offset:end_offset])
+            upper = sources < targets
+            yield (
+                sources[upper], targets[upper],
+                np.asarray(self.counts[start_offset:end_offset])[upper],
+                np.asarray(self.weights[start_offset:end_offset])[upper],
+            )
+            node = end
+
+    @classmethod
+    def from_pairs(cls, u: np.ndarray, v: np.ndarray, counts: np.ndarray, weights: np.ndarray) -> 'CoauthorGraph':
+        """ Builds the graph from unique pairs u < v """
+        sources = np.concatenate([u, v])
+        targets = np.concatenate([v, u])
+        order = np.lexsort((targets, sources))
+        n_nodes = int(sources.max()) + 1 if len(sources) > 0 else 0
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n_nodes), out=indptr[1:])
+        return cls(
+            indptr,
+            targets[order].astype(np.int32),
+            np.concatenate([counts, counts])[order].astype(np.int32),
+            np.concatenate([weights, weights])[order].astype(np.float32),
+        )
+
+    @classmethod
+    def from_authors(cls, author_chunks: T.Iterable[EdgeChunk]) -> 'CoauthorGraph':
+        """
+        :param author_chunks: (person ids, publication keys), rows of a publication have to be consecutive
+        """
+        keys, counts, weights = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)]
+        for person_ids, starts in tqdm(complete_publications(author_chunks), desc="pairing coauthors", unit="chunk"):
+            u, v, pair_weights = coauthor_pairs(person_ids, starts)
+            chunk_keys = (u.astype(np.int64) << 32) | v.astype(np.int64)
+            chunk_keys, chunk_counts, chunk_weights = aggregate_pairs(
+                chunk_keys, np.ones(len(chunk_keys), dtype=np.int64), pair_weights
+            )
+            keys.append(chunk_keys)
+            counts.append(chunk_counts)
+            weights.append(chunk_weights)
+
+        keys, counts, weights = aggregate_pairs(np.concatenate(keys), np.concatenate(counts), np.concatenate(weights))
+        return cls.from_pairs((keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32), counts, weights)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name in GRAPH_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: T.Optional[str] = 'r') -> 'CoauthorGraph':
+        """ Loads saved graph, arrays are memory-mapped (read only) by default """
+        return cls(*[np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in GRAPH_ARRAYS])
+
+
+def is_graph_directory(directory: str) -> bool:
+    return all(os.path.exists(os.path.join(directory, f"{name}.npy")) for name in GRAPH_ARRAYS)
+
+
+def load_to_postgres(graph: CoauthorGraph, conn):
+    """
+    Replaces coauthor_graph materialized view with a table of the same columns, copied from the graph.
+    If the graph is maintained incrementally (see authors_graph_incremental.sql), its table is replaced
+    and totals of authors are rebuilt, otherwise top_authors view has to be created again (see authors_graph.sql).
+    :param conn: sqlalchemy connection
+    """
+    connection = conn.connection  # COPY requires the psycopg2 connection
+    with connection.cursor() as cursor:
+        cursor.execute("select to_regproc('refresh_coauthor_graph') is not null")
+        incremental = cursor.fetchone()[0]
+        if incremental:
+            # logged changes of author table are already included in the graph
+            cursor.execute("lock table coauthor_graph_log in share row exclusive mode")
+            cursor.execute("truncate coauthor_graph, coauthor_graph_log")
+        else:
+            cursor.execute(coauthor_graph_table)
+        for u, v, counts, weights in tqdm(graph.edges(), desc="copying edges", unit="chunk"):
+            buffer = io.StringIO()
+            pd.DataFrame({'u': u, 'v': v, 'c': counts, 'w': weights.astype(np.float64)}).to_csv(
+                buffer, header=False, index=False
+            )
+            buffer.seek(0)
+            cursor.copy_expert(
+                "copy coauthor_graph (author1_id, author2_id, pair_count, pair_weight) from stdin with (format csv)",
+                buffer,
+            )
+        if incremental:
+            cursor.execute("select rebuild_author_graph_totals()")
+            cursor.execute("analyze coauthor_graph")
+        else:
+            cursor.execute(coauthor_graph_indexes)
+    connection.commit()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(
+            f"Usage: {sys.argv[0]} [postgres db conninfo | directory with author.csv or author.arrow] "
+            f"[output directory] [postgres db conninfo to load the graph into (optional)]"
+        )
+        exit(2)
+    source, out_dir = sys.argv[1], sys.argv[2]
+
+    if os.path.isdir(source):
+        if os.path.exists(os.path.join(source, 'author.arrow')):
+            graph = CoauthorGraph.from_authors(read_author_arrow(source))
+        else:
+            graph = CoauthorGraph.from_authors(read_author_csv(os.path.join(source, 'author.csv')))
+    else:
+        from sqlalchemy import create_engine
+
+        with create_engine(source).connect() as conn:
+            graph = CoauthorGraph.from_authors(read_query(conn, author_edges_query))
+
+    graph.save(out_dir)
+    print(f"Graph with {graph.n_nodes} persons and {graph.n_edges} edges saved to: {out_dir}")
+
+    if len(sys.argv) > 3:
+        from sqlalchemy import create_engine
+
+        with create_engine(sys.argv[3]).connect() as conn:
+            load_to_postgres(graph, conn)
+        print("Graph loaded into coauthor_graph table")
@@ -1,74 +1,240 @@
+"""
+Connected components of the coauthor graph, computed in memory instead of the recursive query (see 08.md).
+The edge list is streamed once, in chunks, from parsed tables (author.csv or author.arrow) or from the database
+(author table or coauthor_graph view, through a server side cursor) or from the graph saved by coauthor_graph.py
+into a union-find structure kept in NumPy arrays.
+"""
+import os
 import sys
+import typing as T
 
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
 from tqdm import tqdm
 
-prepare_query = """
-prepare get_author_component (int) as
-with recursive search_graph(author_id, next_author_id, depth, path, cycle) as (
-        select  g.author1_id,
-                g.author2_id,
-                1,
-                array[row(g.author1_id)],
-                false
-        from coauthor_graph g
-        where g.author1_id = $1 or g.author2_id = $1
-    union all
-        (
-            -- next_author can be either on left or right side of the relation,
-            -- but we cannot use a nice union in recursive statements and have to use case instead
-            select  case g.author1_id = sg.next_author_id when true then g.author1_id else g.author2_id end,
-                    case g.author1_id = sg.next_author_id when true then g.author2_id else g.author1_id end,
-                    sg.depth + 1,
-                    path || case g.author1_id = sg.next_author_id when true
-                        then row(g.author2_id)  -- the new node in our path is author2
-                        else row(g.author1_id)  -- the new node in our path is author1
-                    end,
-                    case g.author1_id = sg.next_author_id when true
-                        then row(g.author2_id)  -- the new node in our path is author2
-                        else row(g.author1_id)  -- the new node in our path is author1
-                    end = any(path) -- cycle = true if the following node was visited
-            from coauthor_graph g, search_graph sg
-            where (g.author1_id = sg.next_author_id or g.author2_id = sg.next_author_id) and not cycle
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'loading'))
+
+""" Number of edges (or author rows) read and merged at once """
+CHUNK_SIZE = 2 ** 20
+
+author_edges_query = "select person_id, publication_key from author order by publication_key;"
+
+coauthor_graph_edges_query = "select author1_id, author2_id from coauthor_graph;"
+
+EdgeChunk = T.Tuple[np.ndarray, np.ndarray]
+
+
+class PublicationGroups(object):
+    """
+    Checks that rows of every publication are consecutive, as the readers of author table expect (rows written
+    by the parser and deduplicated by utils/remove_duplicates.py, or sorted by the query). Keys of publications
+    whose rows ended are kept as sorted 64 bit hashes, so a publication appearing again is an error instead of
+    a silently split group (a collision of hashes would be reported as well, which is very unlikely).
+    """
+
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=np.uint64)
+
+    def close(self, keys: np.ndarray):
+        """ :param keys: keys of publications whose rows ended, one per group of rows """
+        hashes = pd.util.hash_array(np.asarray(keys, dtype=object), categorize=False)
+        order = np.argsort(hashes)
+        hashes = hashes[order]
+        positions = np.searchsorted(self.hashes, hashes)
+        repeated = np.zeros(len(hashes), dtype=bool)
+        repeated[1:] = hashes[1:] == hashes[:-1]
+        if len(self.hashes) > 0:
+            repeated |= self.hashes[np.minimum(positions, len(self.hashes) - 1)] == hashes
+        if np.any(repeated):
+            key = np.asarray(keys, dtype=object)[order[np.argmax(repeated)]]
+            raise ValueError(
+                f"Rows of publication {key} are not consecutive, sort author rows by publication_key "
+                f"or deduplicate them with utils/remove_duplicates.py"
+            )
+        self.hashes = np.insert(self.hashes, positions, hashes)
+
+
+class UnionFind(object):
+    """
+    Disjoint sets of non-negative integer ids, every operation is vectorised over arrays of ids.
+    Parent of a node is always smaller than the node, so the root of every set is its smallest id.
+    """
+
+    def __init__(self, size: int = 0):
+        self.parent = np.arange(size, dtype=np.int32)
+        self.seen = np.zeros(size, dtype=bool)  # ids which were part of any edge
+
+    def __len__(self):
+        return len(self.parent)
+
+    def _ensure_size(self, max_id: int):
+        size = len(self.parent)
+        if max_id >= size:
+            new_size = max(max_id + 1, 2 * size)
+            self.parent = np.concatenate([self.parent, np.arange(size, new_size, dtype=np.int32)])
+            self.seen = np.concatenate([self.seen, np.zeros(new_size - size, dtype=bool)])
+
+    def find(self, ids: np.ndarray) -> np.ndarray:
+        """ Returns roots of given ids, which are then linked directly to them (path compression) """
+        roots = self.parent[ids]
+        while True:
+            grandparents = self.parent[roots]
+            if np.array_equal(grandparents, roots):
+                break
+            roots = grandparents
+        self.parent[ids] = roots
+        return roots
+
+    def union(self, u: np.ndarray, v: np.ndarray):
+        """ Merges sets of u[i] and v[i] for every i """
+        if len(u) == 0:
+            return
+        self._ensure_size(int(max(u.max(), v.max())))
+        self.seen[u] = True
+        self.seen[v] = True
+        while len(u) > 0:
+            u_roots, v_roots = self.find(u), self.find(v)
+            different = u_roots != v_roots
+            u, v = u[different], v[different]
+            low = np.minimum(u_roots[different], v_roots[different])
+            high = np.maximum(u_roots[different], v_roots[different])
+            # when a root is linked by many edges, only one of the assignments wins, others are retried
+            self.parent[high] = low
+
+    def compress(self):
+        """ Links every node directly to its root (pointer jumping over the whole array) """
+        while True:
+            grandparents = self.parent[self.parent]
+            if np.array_equal(grandparents, self.parent):
+                break
+            self.parent = grandparents
+
+    def components(self) -> T.Tuple[np.ndarray, np.ndarray]:
+        """ Returns seen ids and their components, a component is identified by its smallest id """
+        self.compress()
+        ids = np.flatnonzero(self.seen)
+        return ids, self.parent[ids]
+
+
+def publication_edges(author_chunks: T.Iterable[EdgeChunk]) -> T.Iterator[EdgeChunk]:
+    """
+    Converts rows of author table into edges linking every author with the first author of the publication,
+    which is enough to find components without generating all pairs of coauthors.
+    :param author_chunks: (person ids, publication keys), rows of a publication have to be consecutive
+    :return: edges (person ids, person ids), authors without coauthors are linked with themselves
+    :raises ValueError: when rows of a publication are not consecutive (see PublicationGroups)
+    """
+    groups = PublicationGroups()
+    carry_key, carry_person = None, None  # last publication of the previous chunk may continue in the next one
+    for person_ids, keys in author_chunks:
+        if len(keys) == 0:
+            continue
+        person_ids = np.asarray(person_ids, dtype=np.int32)
+        keys = np.asarray(keys, dtype=object)
+        if carry_key is not None:
+            person_ids = np.concatenate([[carry_person], person_ids]).astype(np.int32)
+            keys = np.concatenate([np.array([carry_key], dtype=object), keys])
+
+        starts = np.ones(len(keys), dtype=bool)
+        starts[1:] = keys[1:] != keys[:-1]
+        first = np.maximum.accumulate(np.where(starts, np.arange(len(keys)), 0))
+        groups.close(keys[starts][:-1])
+        yield person_ids, person_ids[first]
+        carry_key, carry_person = keys[-1], person_ids[first[-1]]
+    if carry_key is not None:
+        groups.close(np.array([carry_key], dtype=object))
+
+
+def read_author_csv(file_name: str) -> T.Iterator[EdgeChunk]:
+    for df in pd.read_csv(
+            file_name, usecols=['person_id', 'publication_key'], dtype={'publication_key': str}, chunksize=CHUNK_SIZE
+    ):
+        yield df['person_id'].values, df['publication_key'].values
+
+
+def read_author_arrow(data_dir: str) -> T.Iterator[EdgeChunk]:
+    from columnar import open_table_file  # pyarrow is only needed for this source
+
+    reader = open_table_file(data_dir, 'author')
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        yield (
+            batch.column(batch.schema.get_field_index('person_id')).to_numpy(),
+            batch.column(batch.schema.get_field_index('publication_key')).to_numpy(zero_copy_only=False),
         )
-),  connected_authors as (
-    select author_id, next_author_id from search_graph
-)   select author_id from connected_authors union select next_author_id from connected_authors;
-"""
+
+
+def read_query(conn, query: str) -> T.Iterator[EdgeChunk]:
+    """ Streams results of a query with two columns using server side cursor """
+    for df in pd.read_sql(query, con=conn.execution_options(stream_results=True), chunksize=CHUNK_SIZE):
+        yield df.iloc[:, 0].values, df.iloc[:, 1].values
+
+
+def connected_components(edge_chunks: T.Iterable[EdgeChunk]) -> pd.DataFrame:
+    """
+    :param edge_chunks: chunks of edges (ids, ids)
+    :return: component (smallest person id in it) of every person_id which is part of any edge
+    """
+    union_find = UnionFind()
+    for u, v in tqdm(edge_chunks, desc="merging edges", unit="chunk"):
+        union_find.union(np.asarray(u, dtype=np.int32), np.asarray(v, dtype=np.int32))
+        union_find.compress()  # keeps trees flat, so that finds in the next chunk are short
+    person_ids, components = union_find.components()
+    return pd.DataFrame({'person_id': person_ids, 'component': components})
+
+
+def component_sizes(components: pd.DataFrame) -> pd.DataFrame:
+    """ Returns distribution of component sizes: number of components of every size, largest first """
+    sizes = components['component'].value_counts()
+    distribution = sizes.value_counts().sort_index(ascending=False)
+    return pd.DataFrame({'component_size': distribution.index, 'n_components': distribution.values})
 
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} [postgres db conninfo]")
+        print(
+            f"Usage: {sys.argv[0]} [postgres db conninfo | directory with author.csv or author.arrow "
+            f"| directory with graph saved by coauthor_graph.py] [edges: author (default) | coauthor_graph]"
+        )
         exit(2)
+    source = sys.argv[1]
+    edges = sys.argv[2] if len(sys.argv) > 2 else 'author'
+
+    if os.path.isdir(source) and edges == 'coauthor_graph':
+        from coauthor_graph import CoauthorGraph  # graph saved by coauthor_graph.py
+
+        graph = CoauthorGraph.load(source)
+        components_df = connected_components((u, v) for u, v, _, _ in graph.edges())
+    elif os.path.isdir(source):
+        if edges != 'author':
+            print(f"Unknown edges: {edges}")
+            exit(2)
+        if os.path.exists(os.path.join(source, 'author.arrow')):
+            author_chunks = read_author_arrow(source)
+        else:
+            author_chunks = read_author_csv(os.path.join(source, 'author.csv'))
+        components_df = connected_components(publication_edges(author_chunks))
     else:
-        engine = create_engine(sys.argv[1])
-
-    # noinspection PyUnboundLocalVariable
-    with engine.connect() as conn:
-        print("querying list of authors...")
-        # this is less than 200MB and can be stored in memory, to provide better progress feedback to the user
-        # as well as easier caching of previously visited
-        authors = pd.read_sql("select distinct person_id from author;", con=conn)
-        authors['component'] = None
-        authors.index = authors['person_id']
-
-        print("preparing graph query...")
-        conn.execute(prepare_query)
-
-        current_component = 0
-        for author_id in tqdm(authors['person_id'], desc="computing connected components"):
-            if authors.loc[author_id, 'component'] is None:
-                connected_authors = pd.read_sql("execute get_author_component (%s);", con=conn, params=(author_id,))
-                authors.loc[list(connected_authors['author_id']), 'component'] = current_component
-                current_component += 1
+        from sqlalchemy import create_engine
+
+        engine = create_engine(source)
+        with engine.connect() as conn:
+            if edges == 'author':
+                components_df = connected_components(publication_edges(read_query(conn, author_edges_query)))
             else:
-                pass  # author is part of previously calculated connected component
+                # authors without coauthors are not part of the graph
+                components_df = connected_components(read_query(conn, coauthor_graph_edges_query))
 
-        results_df = authors.groupby('component')['person_id'].count()
+    sizes_df = component_sizes(components_df)
+    print(
+        f"{len(components_df)} authors in {sizes_df['n_components'].sum()} components, "
+        f"the largest one has {sizes_df['component_size'].max()} authors"
+    )
 
-        print("Saving results...")
-        out_filename = f'queries/results/graph_components.csv'
-        results_df.to_csv(out_filename, index=False)
-        print(f"Results saved to: {out_filename}")
+    print("Saving results...")
+    out_filename = 'queries/results/graph_components.csv'
+    sizes_df.to_csv(out_filename, index=False)
+    print(f"Results saved to: {out_filename}")
+    out_filename = 'queries/results/author_components.csv'
+    components_df.to_csv(out_filename, index=False)
+    print(f"Results saved to: {out_filename}")
@@ -0,0 +1,236 @@
+"""
+Load test of author publications queries (see benchmark.py) with many concurrent clients.
+Unlike benchmark.py, which measures server side execution time of one query at a time, it measures latency observed
+by clients (including waiting for a connection, network and fetching rows), throughput and errors under load.
+Every run consists of two phases: cold (new connections, every author requested once, optionally after a command
+clearing caches) and warm (authors replayed in a loop).
+With arrival rate, requests are scheduled in advance (Poisson process) and latency is measured from the scheduled time,
+so that a slow database is not hidden by clients waiting for responses before sending new requests.
+"""
+import itertools
+import os
+import queue
+import random
+import subprocess
+import threading
+import time
+import typing as T
+from datetime import datetime
+
+import click
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from benchmark import QUERY_VARIANTS
+
+""" Latency percentiles reported for every phase """
+PERCENTILES = (50, 95, 99)
+
+RESULTS_FILENAME = 'queries/results/load_test.csv'
+
+
+class Request(object):
+    __slots__ = ('author_name', 'scheduled', 'started', 'finished', 'error')
+
+    def __init__(self, author_name: str, scheduled: float):
+        self.author_name = author_name
+        self.scheduled = scheduled
+        self.started = None
+        self.finished = None
+        self.error = None
+
+
+class LoadTest(object):
+    """ Runs phases of a load test against a database with prepared author publications query """
+
+    def __init__(
+            self,
+            conninfo: str,
+            variant: str,
+            n_clients: int,
+            rate: T.Optional[float] = None,
+            statement_timeout_ms: T.Optional[int] = None,
+    ):
+        """
+        :param conninfo: postgres connection string
+        :param variant: query variant (see benchmark.QUERY_VARIANTS)
+        :param n_clients: number of concurrent clients, every one with its own connection
+        :param rate: requests per second (all clients together), None for clients sending requests one after another
+        :param statement_timeout_ms: queries running longer are cancelled and counted as errors
+        """
+        self.conninfo = conninfo
+        self.prepare_query, self.statement_name = QUERY_VARIANTS[variant]
+        self.n_clients = n_clients
+        self.rate = rate
+        self.statement_timeout_ms = statement_timeout_ms
+
+    def _connect(self, engine):
+        connection = engine.raw_connection()
+        # queries only read, so transactions are not needed and a failed query does not abort the next ones
+        connection.connection.set_session(autocommit=True)
+        with connection.cursor() as cursor:
+            if self.statement_timeout_ms is not None:
+                cursor.execute(f"set statement_timeout = {int(self.statement_timeout_ms)}")
+            cursor.execute(self.prepare_query)
+        return connection
+
+    def _execute(self, connection, request: Request):
+        request.started = time.perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"execute {self.statement_name} (%s)", (request.author_name,))
+                cursor.fetchall()
+        except Exception as e:
+            request.error = type(e).__name__
+        request.finished = time.perf_counter()
+
+    def _closed_loop_client(self, connection, authors: T.Iterator[str], lock, deadline: float, done: T.List[Request]):
+        while time.perf_counter() < deadline:
+            with lock:
+                author_name = next(authors, None)
+            if author_name is None:
+                break
+            request = Request(author_name, time.perf_counter())
+            self._execute(connection, request)
+            done.append(request)
+
+    def _open_loop_client(self, connection, requests: queue.Queue, done: T.List[Request]):
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            delay = request.scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._execute(connection, request)
+            done.append(request)
+
+    def run_phase(self, authors: T.Iterator[str], duration_s: float) -> T.List[Request]:
+        """
+        :param authors: names of authors in order of requests, the phase ends when they run out
+        :param duration_s: maximal duration of the phase
+        :return: completed requests
+        """
+        engine = create_engine(self.conninfo, pool_size=self.n_clients, max_overflow=0)
+        connections = [self._connect(engine) for _ in range(self.n_clients)]
+        done = list()  # list.append is thread safe
+        start = time.perf_counter()
+        deadline = start + duration_s
+
+        if self.rate is None:
+            lock = threading.Lock()
+            threads = [
+                threading.Thread(target=self._closed_loop_client, args=(c, authors, lock, deadline, done))
+                for c in connections
+            ]
+            for thread in threads:
+                thread.start()
+        else:
+            requests = queue.Queue()
+            threads = [threading.Thread(target=self._open_loop_client, args=(c, requests, done)) for c in connections]
+            for thread in threads:
+                thread.start()
+            scheduled = start
+            for author_name in authors:
+                scheduled += random.expovariate(self.rate)
+                if scheduled >= deadline:
+                    break
+                requests.put(Request(author_name, scheduled))
+            for _ in threads:
+                requests.put(None)
+
+        for thread in threads:
+            thread.join()
+        for connection in connections:
+            connection.close()
+        engine.dispose()
+        return done
+
+
+def summarize(requests: T.List[Request]) -> T.Dict[str, T.Any]:
+    """ Latencies (from scheduled time) and service times (from start of execution) in ms, throughput, errors """
+    scheduled = np.array([r.scheduled for r in requests], dtype=float)
+    started = np.array([r.started for r in requests], dtype=float)
+    finished = np.array([r.finished for r in requests], dtype=float)
+    errors = pd.Series([r.error for r in requests], dtype=object).dropna()
+    latency = (finished - scheduled) * 1000
+    service_time = (finished - started) * 1000
+    duration = finished.max() - scheduled.min() if len(requests) > 0 else 0
+
+    summary = {
+        'n_requests': len(requests),
+        'n_errors': len(errors),
+        'error_rate': len(errors) / len(requests) if len(requests) > 0 else np.nan,
+        'errors': "; ".join(f"{name}: {count}" for name, count in errors.value_counts().items()),
+        'duration_s': duration,
+        'throughput': (len(requests) - len(errors)) / duration if duration > 0 else np.nan,
+    }
+    for name, times in (('latency', latency), ('service_time', service_time)):
+        for p in PERCENTILES:
+            summary[f'{name}_p{p}'] = np.percentile(times, p) if len(times) > 0 else np.nan
+        summary[f'{name}_max'] = times.max() if len(times) > 0 else np.nan
+    return summary
+
+
+@click.command()
+@click.argument("conninfo", type=str)
+@click.argument("authors_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--variant", type=click.Choice(sorted(QUERY_VARIANTS)), default='normalized', help="query variant")
+@click.option("-c", "--clients", type=int, default=8, help="number of concurrent clients")
+@click.option("-r", "--rate", type=float, default=None, help="requests per second (by default clients do not wait)")
+@click.option("-d", "--duration", type=float, default=60, help="maximal seconds of every phase")
+@click.option("--timeout-ms", type=int, default=None, help="statement timeout, longer queries are errors")
+@click.option("--cold-command", type=str, default=None, help="shell command run before cold phase (eg. restart db)")
+@click.option("--seed", type=int, default=0, help="seed of random order of authors and arrival times")
+def main(
+        conninfo: str,
+        authors_file: str,
+        variant: str,
+        clients: int,
+        rate: T.Optional[float],
+        duration: float,
+        timeout_ms: T.Optional[int],
+        cold_command: T.Optional[str],
+        seed: int,
+):
+    """ Runs cold and warm phases of a load test of CONNINFO with authors from AUTHORS_FILE """
+    random.seed(seed)
+    authors = list(pd.read_csv(authors_file, dtype={'full_name': str})['full_name'])
+    random.shuffle(authors)
+    load_test = LoadTest(conninfo, variant, clients, rate, timeout_ms)
+
+    if cold_command is not None:
+        print(f"Running: {cold_command}")
+        subprocess.run(cold_command, shell=True, check=True)
+
+    summaries = list()
+    # cold: fresh connections (no cached plans and catalogs) and every author requested only once
+    # warm: the same authors again, replayed in a loop until the end of the phase
+    for phase, phase_authors in (('cold', iter(authors)), ('warm', itertools.cycle(authors))):
+        print(f"{phase} phase: {clients} clients, {f'{rate} requests/s' if rate else 'no waiting'}, up to {duration}s")
+        summary = summarize(load_test.run_phase(phase_authors, duration))
+        print(
+            f"{summary['n_requests']} requests, {summary['n_errors']} errors, {summary['throughput']:.1f} requests/s, "
+            f"latency p50/p95/p99: " + "/".join(f"{summary[f'latency_p{p}']:.2f}" for p in PERCENTILES) + "ms"
+        )
+        summaries.append({
+            'run': datetime.now().replace(microsecond=0).isoformat(),
+            'phase': phase,
+            'variant': variant,
+            'clients': clients,
+            'rate': rate,
+            **summary,
+        })
+
+    print("Saving results...")
+    results_df = pd.DataFrame(summaries)
+    # results of consecutive runs are appended
+    results_df.to_csv(
+        RESULTS_FILENAME, mode='a', index=False, header=not os.path.exists(RESULTS_FILENAME), float_format='%.3f'
+    )
+    print(f"Results saved to: {RESULTS_FILENAME}")
+
+
+if __name__ == '__main__':
+    main()
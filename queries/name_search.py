@@ -0,0 +1,410 @@
+"""
+Search of persons by a part of their name (autocomplete), instead of `ilike` scans of person table.
+Names are normalised (accents removed, case folded, punctuation replaced with spaces) and every suffix of a name
+starting at a word is a key of a sorted array, so a prefix of any word of the name is a range of keys found
+by binary search. Matching persons are ranked by their number of publications: small ranges are scanned,
+best persons of large ranges (short prefixes) are precomputed. Names which do not match any prefix
+(typos, other order of words) are found word by word: words of the query are matched with similar words
+of all names by shared trigrams (similarly to pg_trgm), which are short lists, unlike trigrams of whole names.
+Arrays are saved as .npy files and memory-mapped when loaded, like the coauthor graph (see coauthor_graph.py).
+"""
+import bisect
+import os
+import sys
+import typing as T
+import unicodedata
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from graph_components import read_author_arrow, read_author_csv
+
+""" Arrays of the index, saved as {name}.npy files """
+INDEX_ARRAYS = (
+    'names', 'name_offsets', 'person_ids', 'publication_counts', 'key_starts', 'key_rows',
+    'heavy_keys', 'heavy_offsets', 'heavy_top',
+    'words', 'word_offsets', 'word_indptr', 'word_rows',
+    'trigram_codes', 'trigram_indptr', 'trigram_words', 'trigram_counts',
+)
+
+""" Ranges of keys up to this size are scanned, best persons of larger ones are precomputed """
+SCAN_LIMIT = 2 ** 12
+
+""" Number of best persons precomputed for every large range """
+HEAVY_TOP_K = 100
+
+""" Minimal similarity of fuzzy matches (shared / all trigrams of two words, averaged over words of the query) """
+SIMILARITY_THRESHOLD = 0.3
+
+""" Letters which are not decomposed by unicode normalisation """
+TRANSLITERATION = str.maketrans({
+    'ł': 'l', 'ø': 'o', 'đ': 'd', 'ð': 'd', 'æ': 'ae', 'œ': 'oe', 'þ': 'th', 'ı': 'i',
+})
+
+persons_query = """
+select person.id, min(person.full_name) as full_name, count(author.person_id) as count_publications from person
+    left join author on person.id = author.person_id
+    group by person.id;
+"""
+
+
+def normalize_name(name: str) -> str:
+    """ Returns name without accents, in lower case, with words separated by single spaces """
+    decomposed = unicodedata.normalize('NFKD', name.casefold().translate(TRANSLITERATION))
+    characters = (c if c.isalnum() else ' ' for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(''.join(characters).split())
+
+
+def name_trigrams(names: bytes, offsets: np.ndarray) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    :param names: concatenated UTF-8 names (or words), every one padded with a space at both ends
+    :param offsets: offsets of the names (n_names + 1)
+    :return: (codes of byte trigrams, rows of names), unique pairs sorted by codes and rows
+    """
+    data = np.frombuffer(names, dtype=np.uint8).astype(np.int32)
+    codes = (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+    rows = np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))[:-2]
+    # trigrams crossing the end of a name
+    valid = np.arange(len(codes)) + 2 < offsets[rows + 1]
+    pairs = np.unique((codes[valid].astype(np.int64) << 32) | rows[valid])
+    return (pairs >> 32).astype(np.int32), (pairs & 0xFFFFFFFF).astype(np.int32)
+
+
+class SortedKeys(object):
+    """ Sequence of keys of the index (bytes), so that they can be searched with bisect """
+
+    def __init__(self, names: bytes, name_offsets: np.ndarray, key_starts: np.ndarray, key_rows: np.ndarray):
+        self.names = names
+        self.name_offsets = name_offsets
+        self.key_starts = key_starts
+        self.key_rows = key_rows
+
+    def __len__(self):
+        return len(self.key_starts)
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.names[self.key_starts[i]:self.name_offsets[self.key_rows[i] + 1]]
+
+
+class NameIndex(object):
+    """ Prefix index of normalised names of persons (with optional index of words), see the module description """
+
+    def __init__(
+            self,
+            names: np.ndarray,
+            name_offsets: np.ndarray,
+            person_ids: np.ndarray,
+            publication_counts: np.ndarray,
+            key_starts: np.ndarray,
+            key_rows: np.ndarray,
+            heavy_keys: np.ndarray,
+            heavy_offsets: np.ndarray,
+            heavy_top: np.ndarray,
+            words: T.Optional[np.ndarray] = None,
+            word_offsets: T.Optional[np.ndarray] = None,
+            word_indptr: T.Optional[np.ndarray] = None,
+            word_rows: T.Optional[np.ndarray] = None,
+            trigram_codes: T.Optional[np.ndarray] = None,
+            trigram_indptr: T.Optional[np.ndarray] = None,
+            trigram_words: T.Optional[np.ndarray] = None,
+            trigram_counts: T.Optional[np.ndarray] = None,
+    ):
+        """
+        :param names: uint8 concatenated UTF-8 normalised names
+        :param name_offsets: int64 offsets of names (n_names + 1)
+        :param person_ids: int32 ids of persons of names
+        :param publication_counts: int32 numbers of publications of persons
+        :param key_starts: int64 offsets of keys in names (a key ends with its name), sorted by keys
+        :param key_rows: int32 names of keys
+        :param heavy_keys: uint8 concatenated prefixes matching more than SCAN_LIMIT keys, sorted
+        :param heavy_offsets: int64 offsets of the prefixes (n_heavy + 1)
+        :param heavy_top: int32 rows of HEAVY_TOP_K best names of every prefix (padded with -1)
+        :param words: uint8 concatenated unique words of all names
+        :param word_offsets: int64 offsets of words (n_words + 1)
+        :param word_indptr: int64 offsets of names of every word (n_words + 1)
+        :param word_rows: int32 names containing words, sorted for every word
+        :param trigram_codes: int32 sorted unique codes of trigrams of words
+        :param trigram_indptr: int64 offsets of words of every trigram (n_trigrams + 1)
+        :param trigram_words: int32 words containing trigrams
+        :param trigram_counts: int16 numbers of unique trigrams of every word
+        """
+        self.names = names
+        self.name_offsets = name_offsets
+        self.person_ids = person_ids
+        self.publication_counts = publication_counts
+        self.key_starts = key_starts
+        self.key_rows = key_rows
+        self.heavy_keys = heavy_keys
+        self.heavy_offsets = heavy_offsets
+        self.heavy_top = heavy_top
+        self.words = words
+        self.word_offsets = word_offsets
+        self.word_indptr = word_indptr
+        self.word_rows = word_rows
+        self.trigram_codes = trigram_codes
+        self.trigram_indptr = trigram_indptr
+        self.trigram_words = trigram_words
+        self.trigram_counts = trigram_counts
+
+        self._keys = SortedKeys(names.tobytes(), name_offsets, key_starts, key_rows)
+        heavy = heavy_keys.tobytes()
+        self._heavy = {heavy[heavy_offsets[i]:heavy_offsets[i + 1]]: i for i in range(len(heavy_offsets) - 1)}
+
+    @property
+    def n_names(self) -> int:
+        return len(self.person_ids)
+
+    @property
+    def has_words(self) -> bool:
+        return self.trigram_codes is not None
+
+    def name(self, row: int) -> str:
+        return self._keys.names[self.name_offsets[row]:self.name_offsets[row + 1]].decode()
+
+    def prefix_range(self, prefix: bytes) -> T.Tuple[int, int]:
+        """ Returns range of keys starting with a normalised prefix """
+        # 0xff never occurs in UTF-8, so it is larger than any continuation of the prefix
+        return bisect.bisect_left(self._keys, prefix), bisect.bisect_left(self._keys, prefix + b'\xff')
+
+    def _best_rows(self, rows: np.ndarray, k: int) -> np.ndarray:
+        """ Returns up to k unique rows with the most publications, best first """
+        rows = np.unique(rows)
+        counts = self.publication_counts[rows]
+        if len(rows) > k:
+            best = np.argpartition(-counts, k - 1)[:k]
+            rows, counts = rows[best], counts[best]
+        return rows[np.argsort(-counts, kind='stable')]
+
+    def prefix_rows(self, prefix: bytes, k: int) -> np.ndarray:
+        """ Returns up to k names with a word starting with a normalised prefix, with the most publications first """
+        start, end = self.prefix_range(prefix)
+        if end - start > SCAN_LIMIT and k <= self.heavy_top.shape[1]:
+            top = self.heavy_top[self._heavy[prefix]]
+            return top[top >= 0][:k]
+        return self._best_rows(np.asarray(self.key_rows[start:end]), k)
+
+    def similar_words(self, word: str, threshold: float) -> T.Tuple[np.ndarray, np.ndarray]:
+        """ Returns words of names similar to a normalised word and their similarity """
+        padded = f' {word} '.encode()
+        codes, _ = name_trigrams(padded, np.array([0, len(padded)]))
+        positions = np.minimum(np.searchsorted(self.trigram_codes, codes), len(self.trigram_codes) - 1)
+        positions = positions[self.trigram_codes[positions] == codes]
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        words, shared = np.unique(np.concatenate([
+            self.trigram_words[self.trigram_indptr[p]:self.trigram_indptr[p + 1]] for p in positions
+        ]), return_counts=True)
+        similarity = shared / (len(codes) + self.trigram_counts[words] - shared)
+        similar = similarity >= threshold
+        return words[similar], similarity[similar]
+
+    def similar_rows(self, query: str, k: int, threshold: float = SIMILARITY_THRESHOLD) -> np.ndarray:
+        """
+        Returns up to k names most similar to a normalised query, more publications first.
+        Every word of the query is matched with the most similar word of a name, similarity of the name
+        is the average of these matches (0 for words without a match).
+        """
+        query_words = query.split()
+        scores = np.zeros(self.n_names, dtype=np.float32)
+        for word in query_words:
+            words, similarity = self.similar_words(word, threshold)
+            sizes = self.word_indptr[words + 1] - self.word_indptr[words]
+            word_rows = np.concatenate(
+                [np.empty(0, dtype=np.int32)] +
+                [self.word_rows[self.word_indptr[w]:self.word_indptr[w + 1]] for w in words]
+            )
+            word_scores = np.repeat(similarity, sizes)
+            if len(words) > 1:
+                # the best match of the word in every name (names of a single word are unique)
+                order = np.lexsort((-word_scores, word_rows))
+                word_rows, word_scores = word_rows[order], word_scores[order]
+                first = np.ones(len(word_rows), dtype=bool)
+                first[1:] = word_rows[1:] != word_rows[:-1]
+                word_rows, word_scores = word_rows[first], word_scores[first]
+            scores[word_rows] += word_scores
+
+        rows = np.flatnonzero(scores >= threshold * len(query_words))
+        # similarity first, then publications (counts are smaller than differences of similarities * 2^32)
+        ranks = scores[rows].astype(np.float64) * 2 ** 32 + self.publication_counts[rows]
+        if len(rows) > k:
+            best = np.argpartition(-ranks, k - 1)[:k]
+            rows, ranks = rows[best], ranks[best]
+        return rows[np.argsort(-ranks, kind='stable')]
+
+    def search(self, query: str, k: int = 10, fuzzy: bool = True) -> T.List[T.Tuple[int, int]]:
+        """
+        :param query: beginning of any word of the name, or the whole name with typos when fuzzy
+        :param k: number of returned persons
+        :param fuzzy: complete results of the prefix search with similar names (if the index has words)
+        :return: (person id, number of publications) of up to k persons, prefix matches first
+        """
+        normalized = normalize_name(query)
+        if len(normalized) == 0:
+            return list()
+        rows = self.prefix_rows(normalized.encode(), k)
+        if len(rows) < k and fuzzy and self.has_words:
+            similar = self.similar_rows(normalized, k)
+            rows = np.concatenate([rows, similar[~np.isin(similar, rows)]])[:k]
+        return [(int(self.person_ids[row]), int(self.publication_counts[row])) for row in rows]
+
+    @classmethod
+    def from_persons(cls, person_ids: np.ndarray, full_names: T.Sequence[str], publication_counts: np.ndarray,
+                     words: bool = True) -> 'NameIndex':
+        """
+        :param person_ids: ids of persons
+        :param full_names: names of persons
+        :param publication_counts: numbers of publications of persons
+        :param words: build index of words of names and their trigrams for fuzzy search
+        """
+        normalized = [normalize_name(name).encode() for name in tqdm(full_names, desc="normalizing names")]
+        name_offsets = np.zeros(len(normalized) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in normalized], out=name_offsets[1:])
+        names = b''.join(normalized)
+
+        # a key starts at the beginning of every word
+        key_starts, key_rows = list(), list()
+        for row, name in enumerate(tqdm(normalized, desc="collecting keys")):
+            offset = name_offsets[row]
+            key_starts.append(offset)
+            key_rows.append(row)
+            position = name.find(b' ')
+            while position >= 0:
+                key_starts.append(offset + position + 1)
+                key_rows.append(row)
+                position = name.find(b' ', position + 1)
+        key_starts = np.array(key_starts, dtype=np.int64)
+        key_rows = np.array(key_rows, dtype=np.int32)
+        keys = SortedKeys(names, name_offsets, key_starts, key_rows)
+        order = np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype=np.int64)
+        key_starts, key_rows = key_starts[order], key_rows[order]
+
+        index = cls(
+            np.frombuffer(names, dtype=np.uint8), name_offsets,
+            np.asarray(person_ids, dtype=np.int32), np.asarray(publication_counts, dtype=np.int32),
+            key_starts, key_rows,
+            np.empty(0, dtype=np.uint8), np.zeros(1, dtype=np.int64), np.empty((0, HEAVY_TOP_K), dtype=np.int32),
+        )
+        index._build_heavy()
+        if words:
+            index._build_words()
+        return index
+
+    def _build_heavy(self):
+        """ Precomputes best names of all prefixes matching more than SCAN_LIMIT keys """
+        heavy = dict()
+        # every such range contains a multiple of SCAN_LIMIT, so prefixes of sampled keys are enough
+        for i in tqdm(range(0, len(self._keys), SCAN_LIMIT), desc="precomputing prefixes"):
+            key = self._keys[i]
+            for length in range(1, len(key) + 1):
+                prefix = key[:length]
+                if prefix in heavy:
+                    continue
+                start, end = self.prefix_range(prefix)
+                if end - start <= SCAN_LIMIT:
+                    break  # longer prefixes match even fewer keys
+                heavy[prefix] = self._best_rows(np.asarray(self.key_rows[start:end]), HEAVY_TOP_K)
+
+        prefixes = sorted(heavy)
+        self.heavy_offsets = np.zeros(len(prefixes) + 1, dtype=np.int64)
+        np.cumsum([len(prefix) for prefix in prefixes], out=self.heavy_offsets[1:])
+        self.heavy_keys = np.frombuffer(b''.join(prefixes), dtype=np.uint8)
+        self.heavy_top = np.full((len(prefixes), HEAVY_TOP_K), -1, dtype=np.int32)
+        for i, prefix in enumerate(prefixes):
+            self.heavy_top[i, :len(heavy[prefix])] = heavy[prefix]
+        self._heavy = {prefix: i for i, prefix in enumerate(prefixes)}
+
+    def _build_words(self):
+        names = self._keys.names
+        vocabulary, word_ids = dict(), np.empty(len(self.key_starts), dtype=np.int64)
+        for i, (start, row) in enumerate(tqdm(zip(self.key_starts, self.key_rows), desc="collecting words",
+                                              total=len(self.key_starts))):
+            name_end = self.name_offsets[row + 1]
+            end = names.find(b' ', start, name_end)
+            word = names[start:end if end >= 0 else name_end]
+            word_ids[i] = vocabulary.setdefault(word, len(vocabulary))
+        pairs = np.unique((word_ids << 32) | self.key_rows)
+        self.word_rows = (pairs & 0xFFFFFFFF).astype(np.int32)
+        self.word_indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs >> 32, minlength=len(vocabulary)), out=self.word_indptr[1:])
+
+        self.word_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum([len(word) for word in vocabulary], out=self.word_offsets[1:])
+        self.words = np.frombuffer(b''.join(vocabulary), dtype=np.uint8)
+        padded = b''.join(b' ' + word + b' ' for word in vocabulary)
+        codes, words = name_trigrams(padded, self.word_offsets + 2 * np.arange(len(vocabulary) + 1))
+        self.trigram_codes, starts = np.unique(codes, return_index=True)
+        self.trigram_indptr = np.append(starts, len(codes)).astype(np.int64)
+        self.trigram_words = words
+        self.trigram_counts = np.bincount(words, minlength=len(vocabulary)).astype(np.int16)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            if getattr(self, name) is not None:
+                np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: T.Optional[str] = 'r') -> 'NameIndex':
+        """ Loads saved index, arrays are memory-mapped (read only) by default, words only if they were built """
+        arrays = list()
+        for name in INDEX_ARRAYS:
+            file_name = os.path.join(directory, f"{name}.npy")
+            arrays.append(np.load(file_name, mmap_mode=mmap_mode) if os.path.exists(file_name) else None)
+        return cls(*arrays)
+
+
+def is_index_directory(directory: str) -> bool:
+    return all(os.path.exists(os.path.join(directory, f"{name}.npy")) for name in INDEX_ARRAYS[:9])
+
+
+def read_persons_csv(data_dir: str) -> pd.DataFrame:
+    """ Returns persons (id, full_name, count_publications) from parsed person and author tables """
+    persons = pd.read_csv(
+        os.path.join(data_dir, 'person.csv'), usecols=['id', 'full_name'], dtype={'full_name': str},
+        keep_default_na=False,
+    )
+    if os.path.exists(os.path.join(data_dir, 'author.arrow')):
+        author_chunks = read_author_arrow(data_dir)
+    else:
+        author_chunks = read_author_csv(os.path.join(data_dir, 'author.csv'))
+    counts = np.zeros(persons['id'].max() + 1 if len(persons) > 0 else 0, dtype=np.int64)
+    for person_ids, _ in tqdm(author_chunks, desc="counting publications", unit="chunk"):
+        chunk_counts = np.bincount(person_ids)
+        counts[:len(chunk_counts)] += chunk_counts[:len(counts)]
+    persons['count_publications'] = counts[persons['id'].values]
+    return persons
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(
+            f"Usage: {sys.argv[0]} [postgres db conninfo | directory with person.csv and author.csv] "
+            f"[output directory]\n"
+            f"       {sys.argv[0]} [index directory] [query] [query ...]"
+        )
+        exit(2)
+    source = sys.argv[1]
+
+    if is_index_directory(source):
+        index = NameIndex.load(source)
+        for query in sys.argv[2:]:
+            print(f"{query}:")
+            for person_id, count_publications in index.search(query):
+                print(f"    {person_id}\t{count_publications}")
+        exit(0)
+
+    out_dir = sys.argv[2]
+    if os.path.isdir(source):
+        persons_df = read_persons_csv(source)
+    else:
+        from sqlalchemy import create_engine
+
+        with create_engine(source).connect() as conn:
+            persons_df = pd.read_sql(persons_query, con=conn)
+
+    name_index = NameIndex.from_persons(
+        persons_df['id'].values, persons_df['full_name'].tolist(), persons_df['count_publications'].values
+    )
+    name_index.save(out_dir)
+    print(f"Index of {name_index.n_names} names and {len(name_index.key_rows)} keys saved to: {out_dir}")
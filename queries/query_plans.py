@@ -0,0 +1,93 @@
+"""
+Normalisation of query plans returned by `explain (analyze, buffers, format json)`.
+The shape of a plan (node types, join types and strategies, scanned relations and indexes) does not depend
+on parameters of the query, so its hash (fingerprint) groups executions which used the same plan.
+"""
+import hashlib
+import typing as T
+
+import pandas as pd
+
+""" Properties of plan nodes which define the shape of the plan (costs, rows and conditions are ignored) """
+SHAPE_PROPERTIES = ('Node Type', 'Join Type', 'Strategy', 'Scan Direction', 'Relation Name', 'Index Name')
+
+""" Statistics of every plan node (times in ms are per loop, buffers include buffers of child nodes) """
+NODE_STATISTICS = {
+    'Plan Rows': 'plan_rows',
+    'Actual Rows': 'actual_rows',
+    'Actual Loops': 'actual_loops',
+    'Actual Startup Time': 'actual_startup_time',
+    'Actual Total Time': 'actual_total_time',
+    'Shared Hit Blocks': 'shared_hit_blocks',
+    'Shared Read Blocks': 'shared_read_blocks',
+    'Temp Read Blocks': 'temp_read_blocks',
+    'Temp Written Blocks': 'temp_written_blocks',
+}
+
+
+def plan_shape(node: T.Dict[str, T.Any]) -> str:
+    """ Returns a readable, parameter independent description of a plan, eg. Hash Join(Seq Scan[author], Hash(...)) """
+    name = ' '.join(str(node[p]) for p in SHAPE_PROPERTIES[:4] if p in node)
+    scanned = '.'.join(str(node[p]) for p in SHAPE_PROPERTIES[4:] if p in node)
+    if scanned:
+        name += f'[{scanned}]'
+    children = node.get('Plans', list())
+    if children:
+        name += '(' + ', '.join(plan_shape(child) for child in children) + ')'
+    return name
+
+
+def plan_fingerprint(node: T.Dict[str, T.Any]) -> str:
+    """ Returns a short hash of the plan shape """
+    return hashlib.sha1(plan_shape(node).encode()).hexdigest()[:12]
+
+
+def plan_nodes(node: T.Dict[str, T.Any]) -> T.List[T.Dict[str, T.Any]]:
+    """ Flattens a plan into rows of its nodes (in pre-order) with their statistics """
+    rows = list()
+
+    def visit(node, parent_id, depth):
+        node_id = len(rows)
+        row = {
+            'node_id': node_id,
+            'parent_id': parent_id,
+            'depth': depth,
+            'node_type': node['Node Type'],
+            'relation': node.get('Relation Name'),
+            'index': node.get('Index Name'),
+        }
+        row.update({column: node.get(key) for key, column in NODE_STATISTICS.items()})
+        rows.append(row)
+        for child in node.get('Plans', list()):
+            visit(child, node_id, depth + 1)
+
+    visit(node, None, 0)
+    return rows
+
+
+def plan_groups(plans: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param plans: one row per parameter with columns: parameter, fingerprint, shape, execution_time
+    :return: one row per plan shape with number of parameters using it and their execution times, slowest first
+    """
+    groups = plans.groupby(['fingerprint', 'shape'])
+    slowest = plans.loc[groups['execution_time'].idxmax()].set_index(['fingerprint', 'shape'])['parameter']
+    result = groups['execution_time'].agg(['count', 'mean', 'median', 'max'])
+    result.columns = ['n_parameters', 'time_mean', 'time_median', 'time_max']
+    result['arg_max'] = slowest
+    return result.reset_index().sort_values('time_max', ascending=False)
+
+
+def plan_changes(previous: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compares plans of the same parameters captured in two runs.
+    :return: parameters which plan changed, with shapes and execution times of both runs
+    """
+    merged = previous.merge(current, on='parameter', suffixes=('_previous', '_current'))
+    changed = merged[merged['fingerprint_previous'] != merged['fingerprint_current']]
+    return changed[[
+        'parameter',
+        'fingerprint_previous', 'fingerprint_current',
+        'execution_time_previous', 'execution_time_current',
+        'shape_previous', 'shape_current',
+    ]]
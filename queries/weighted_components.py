@@ -0,0 +1,157 @@
+"""
+Connected components of the coauthor graph filtered by strength of coauthor connections, for all thresholds at once
+(see 09-fix.md and graph/algo.cypher, where every threshold required a separate run).
+Edges are sorted by pair_weight (or pair_count) once and added to a union-find in descending order, like in Kruskal's
+algorithm. After all edges of a given value are added, the state is the graph filtered by value >= threshold,
+so the number of components and size of the largest one are recorded at every distinct value.
+"""
+import os
+import sys
+import typing as T
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from graph_components import UnionFind
+
+coauthor_graph_query = "select author1_id, author2_id, pair_count, pair_weight from coauthor_graph;"
+
+""" Columns of coauthor_graph which edges can be filtered by """
+EDGE_VALUES = ('pair_weight', 'pair_count')
+
+""" Number of sorted edges checked against the union-find at once """
+BLOCK_SIZE = 2 ** 16
+
+
+def kruskal_merges(u: np.ndarray, v: np.ndarray, size: int) -> np.ndarray:
+    """
+    Adds edges to a union-find in a given order.
+    Edges are checked in blocks against the union-find (vectorised), only the ones connecting different components
+    at the beginning of a block are merged one by one, in a small union-find of their roots.
+    :param u: first ends of edges
+    :param v: second ends of edges
+    :param size: number of node ids
+    :return: for every edge: size of the component created by it, or 0 if its ends were already connected
+    """
+    union_find = UnionFind(size)
+    sizes = np.ones(size, dtype=np.int64)  # valid only for roots
+    merged_sizes = np.zeros(len(u), dtype=np.int64)
+    for start in tqdm(range(0, len(u), BLOCK_SIZE), desc="adding edges", unit="block"):
+        end = min(start + BLOCK_SIZE, len(u))
+        u_roots, v_roots = union_find.find(u[start:end]), union_find.find(v[start:end])
+        candidates = np.flatnonzero(u_roots != v_roots)
+        u_roots, v_roots = u_roots[candidates], v_roots[candidates]
+
+        parent, root_sizes = dict(), dict()  # merges of roots within the block
+        for i, a, b, a_size, b_size in zip(
+                candidates.tolist(), u_roots.tolist(), v_roots.tolist(),
+                sizes[u_roots].tolist(), sizes[v_roots].tolist()
+        ):
+            while a in parent:
+                a = parent[a]
+            while b in parent:
+                b = parent[b]
+            if a == b:
+                continue
+            # roots merged before have their sizes in root_sizes, others have the same size as at the block start
+            merged_size = root_sizes.get(a, a_size) + root_sizes.get(b, b_size)
+            low, high = min(a, b), max(a, b)  # the same rule as in UnionFind
+            parent[high] = low
+            root_sizes[low] = merged_size
+            merged_sizes[start + i] = merged_size
+
+        if len(parent) > 0:
+            union_find.union(
+                np.fromiter(parent.keys(), dtype=np.int32, count=len(parent)),
+                np.fromiter(parent.values(), dtype=np.int32, count=len(parent)),
+            )
+            union_find.compress()
+            roots = [r for r in root_sizes if r not in parent]
+            sizes[roots] = [root_sizes[r] for r in roots]
+    return merged_sizes
+
+
+def threshold_components(u: np.ndarray, v: np.ndarray, values: np.ndarray, nodes: np.ndarray) -> pd.DataFrame:
+    """
+    :param u: first ends of edges
+    :param v: second ends of edges
+    :param values: values which edges are filtered by
+    :param nodes: ids of all nodes of the graph (filtering edges does not remove nodes)
+    :return: for every distinct value (descending, after infinity for the graph without edges): threshold,
+        number of edges with value >= threshold, number of components and size of the largest component
+    """
+    order = np.argsort(-values, kind='stable')
+    u, v, values = u[order].astype(np.int32), v[order].astype(np.int32), values[order]
+    size = int(max(nodes.max(initial=-1), u.max(initial=-1), v.max(initial=-1))) + 1
+    merged_sizes = kruskal_merges(u, v, size)
+    n_merges = np.cumsum(merged_sizes > 0)
+    largest = np.maximum.accumulate(merged_sizes) if len(merged_sizes) > 0 else merged_sizes
+
+    # state after the last edge of every value, the first row describes the graph without edges
+    ends = np.flatnonzero(np.append(values[1:] != values[:-1], len(values) > 0)) + 1
+    return pd.DataFrame({
+        'threshold': np.append(np.inf, values[ends - 1]),
+        'n_edges': np.append(0, ends),
+        'n_components': len(nodes) - np.append(0, n_merges[ends - 1]),
+        'largest_component': np.maximum(np.append(0, largest[ends - 1]), min(len(nodes), 1)),
+    })
+
+
+def components_at(cuts: pd.DataFrame, threshold: float) -> T.Tuple[int, int]:
+    """
+    Answers a single threshold using the result of threshold_components.
+    :return: (number of components, size of the largest one) of the graph with edges of value >= threshold
+    """
+    i = np.searchsorted(-cuts['threshold'].values, -threshold, side='right') - 1  # first row is the empty graph
+    row = cuts.iloc[i]
+    return int(row['n_components']), int(row['largest_component'])
+
+
+def read_graph(source: str, value: str) -> T.Tuple[np.ndarray, ...]:
+    """
+    Reads edges (every one once) and nodes of coauthor graph saved by coauthor_graph.py or coauthor_graph table.
+    :return: (u, v, values, nodes)
+    """
+    if os.path.isdir(source):
+        from coauthor_graph import CoauthorGraph
+
+        graph = CoauthorGraph.load(source)
+        u, v, counts, weights = [np.concatenate(arrays) for arrays in zip(*graph.edges())]
+        values = weights if value == 'pair_weight' else counts
+        return u, v, values, np.flatnonzero(np.diff(graph.indptr) > 0)
+
+    from sqlalchemy import create_engine
+
+    with create_engine(source).connect() as conn:
+        edges = pd.concat(
+            pd.read_sql(coauthor_graph_query, con=conn.execution_options(stream_results=True), chunksize=2 ** 20)
+        )
+    u, v = edges['author1_id'].values, edges['author2_id'].values
+    return u, v, edges[value].values, np.unique(np.concatenate([u, v]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(
+            f"Usage: {sys.argv[0]} [postgres db conninfo | directory with graph saved by coauthor_graph.py] "
+            f"[pair_weight (default) | pair_count] [thresholds to print (optional)...]"
+        )
+        exit(2)
+    source = sys.argv[1]
+    value = sys.argv[2] if len(sys.argv) > 2 else 'pair_weight'
+    if value not in EDGE_VALUES:
+        print(f"Edges can be filtered by: {', '.join(EDGE_VALUES)}")
+        exit(2)
+
+    print("reading graph...")
+    u, v, values, nodes = read_graph(source, value)
+    cuts_df = threshold_components(u, v, values, nodes)
+    for threshold in sys.argv[3:]:
+        n_components, largest = components_at(cuts_df, float(threshold))
+        print(f"{value} >= {threshold}: {n_components} components, the largest one has {largest} authors")
+
+    print("Saving results...")
+    out_filename = f'queries/results/weighted_components_{value}.csv'
+    cuts_df.to_csv(out_filename, index=False)
+    print(f"Results saved to: {out_filename}")
@@ -1,21 +1,194 @@
-import gc
+"""
+Removes duplicate rows from parsed tables (CSV files in data directory) with a fixed memory budget.
+Rows are read as raw records (text between line breaks outside of quotes, so they are written back unchanged)
+and hash-partitioned into temporary spill files, then every partition is deduplicated separately,
+by a pool of processes. The table is rewritten from deduplicated partitions in the original order of first
+occurrences (merging partitions by row numbers), so rows of a publication stay consecutive, as the readers of
+author.csv and editor.csv expect (see queries/coauthor_graph.py, queries/graph_components.py and graph/export.py).
+"""
+import logging
+import math
 import os
-import csv
+import pickle
+import shutil
+import tempfile
+import typing as T
+import zlib
+from heapq import merge
+from multiprocessing import Pool, cpu_count
 
-import pandas as pd
+import click
 from tqdm import tqdm
 
+log = logging.getLogger(__name__)
+
+""" Number of records written to a spill file at once """
+SPILL_BATCH_SIZE = 2 ** 12
+
+""" Memory used by deduplicating a partition per byte of its records (Python objects and the set of seen records) """
+MEMORY_PER_BYTE = 4
+
+""" Default memory budget of all processes deduplicating partitions, in MB """
+DEFAULT_MEMORY_MB = 1024
+
+Record = T.Tuple[int, str]  # (row number, raw text of the row including its line break)
+
+
+def read_records(file: T.TextIO) -> T.Iterator[str]:
+    """
+    Yields raw records of a CSV file. A quote inside a field is escaped by another quote,
+    so a line break is inside a quoted field only if the number of quotes before it is odd.
+    """
+    record, quotes = list(), 0
+    for line in file:
+        record.append(line)
+        quotes += line.count('"')
+        if quotes % 2 == 0:
+            yield ''.join(record)
+            record, quotes = list(), 0
+    if record:
+        yield ''.join(record)
+
+
+def write_spill(file: T.BinaryIO, records: T.List[Record]):
+    pickle.dump(records, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_spill(file_name: str) -> T.Iterator[Record]:
+    with open(file_name, 'rb') as f:
+        while True:
+            try:
+                records = pickle.load(f)
+            except EOFError:
+                return
+            yield from records
+
+
+def get_n_partitions(file_size: int, memory_mb: int, jobs: int) -> int:
+    """ Returns number of partitions, so that all processes deduplicating partitions fit into the memory budget """
+    memory_per_job = memory_mb * 2 ** 20 / jobs
+    return max(math.ceil(file_size * MEMORY_PER_BYTE / memory_per_job), 1)
+
+
+def partition_table(file_name: str, spill_dir: str, n_partitions: int) -> T.Tuple[str, int]:
+    """
+    Splits records of a CSV file (except the header) into spill files by hash of the record.
+    :return: (header, number of records)
+    """
+    files = [open(os.path.join(spill_dir, f'{i:04d}.spill'), 'wb') for i in range(n_partitions)]
+    batches = [list() for _ in range(n_partitions)]
+    n_records = 0
+    try:
+        with open(file_name, newline='', encoding='utf-8') as f:
+            records = read_records(f)
+            header = next(records, '')
+            for row, record in enumerate(tqdm(records, desc=f"partitioning {os.path.basename(file_name)}")):
+                i = zlib.crc32(record.encode('utf-8')) % n_partitions
+                batches[i].append((row, record))
+                if len(batches[i]) >= SPILL_BATCH_SIZE:
+                    write_spill(files[i], batches[i])
+                    batches[i] = list()
+                n_records = row + 1
+        for file, batch in zip(files, batches):
+            if batch:
+                write_spill(file, batch)
+    finally:
+        for file in files:
+            file.close()
+    return header, n_records
+
+
+def deduplicate_partition(file_name: str) -> int:
+    """
+    Replaces a spill file with its first occurrences of every record, in the original order.
+    :return: number of removed records
+    """
+    seen = set()
+    n_removed = 0
+    out_file_name = f'{file_name}.unique'
+    with open(out_file_name, 'wb') as out:
+        batch = list()
+        for row, record in read_spill(file_name):
+            if record in seen:
+                n_removed += 1
+                continue
+            seen.add(record)
+            batch.append((row, record))
+            if len(batch) >= SPILL_BATCH_SIZE:
+                write_spill(out, batch)
+                batch = list()
+        if batch:
+            write_spill(out, batch)
+    os.replace(out_file_name, file_name)
+    return n_removed
+
+
+def remove_duplicates(
+        file_name: str,
+        jobs: int = cpu_count(),
+        memory_mb: int = DEFAULT_MEMORY_MB,
+        tmp_dir: T.Optional[str] = None,
+) -> T.Tuple[int, int]:
+    """
+    Rewrites a CSV file without duplicate records, keeping first occurrences of records in their original order.
+    :param file_name: path to CSV file with a header
+    :param jobs: number of processes deduplicating partitions
+    :param memory_mb: memory budget of all processes, defines the number of partitions
+    :param tmp_dir: directory of spill files (by default next to the file, as they take as much space as the file)
+    :return: (number of records, number of removed duplicates)
+    """
+    n_partitions = get_n_partitions(os.path.getsize(file_name), memory_mb, jobs)
+    spill_dir = tempfile.mkdtemp(prefix='dedup-', dir=tmp_dir or os.path.dirname(os.path.abspath(file_name)))
+    try:
+        header, n_records = partition_table(file_name, spill_dir, n_partitions)
+        spill_files = [os.path.join(spill_dir, f'{i:04d}.spill') for i in range(n_partitions)]
+        with Pool(min(jobs, n_partitions)) as pool:
+            n_removed = sum(pool.imap_unordered(deduplicate_partition, spill_files))
+
+        out_file_name = os.path.join(spill_dir, 'result.csv')
+        with open(out_file_name, 'w', newline='', encoding='utf-8') as out:
+            out.write(header)
+            # every partition is already sorted by row numbers
+            for _, record in merge(*[read_spill(f) for f in spill_files]):
+                out.write(record)
+        os.replace(out_file_name, file_name)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return n_records, n_removed
+
+
+@click.command()
+@click.argument("data_dir", type=click.Path(exists=True, file_okay=False), default='data')
+@click.option("-t", "--table", "tables", type=str, multiple=True, help="deduplicate only given tables")
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), default=cpu_count(),
+    help="number of processes deduplicating partitions",
+)
+@click.option(
+    "-m", "--memory", "memory_mb", type=click.IntRange(min=1), default=DEFAULT_MEMORY_MB, help="memory budget in MB",
+)
+@click.option("--tmp-dir", type=click.Path(exists=True, file_okay=False), default=None, help="directory of spill files")
+def main(
+        data_dir: str,
+        tables: T.Tuple[str, ...],
+        jobs: int,
+        memory_mb: int,
+        tmp_dir: T.Optional[str],
+):
+    """ Removes duplicate rows from CSV files in DATA_DIR """
+    logging.basicConfig(level=logging.INFO)
+    file_names = sorted(f for f in os.listdir(data_dir) if f.endswith('.csv'))
+    if tables:
+        file_names = [f for f in file_names if f[:-len('.csv')] in tables]
+    for f in file_names:
+        n_records, n_removed = remove_duplicates(os.path.join(data_dir, f), jobs, memory_mb, tmp_dir=tmp_dir)
+        log.info(f"{f}: {n_removed} duplicates removed from {n_records} rows")
+        arrow_file_name = os.path.join(data_dir, f"{f[:-len('.csv')]}.arrow")
+        if n_removed > 0 and os.path.exists(arrow_file_name):
+            # columnar files are written by the parser only (see loading/columnar.py) and readers prefer them to CSV
+            os.remove(arrow_file_name)
+            log.warning(f"{os.path.basename(arrow_file_name)} removed, as it still has the duplicates")
+
 
 if __name__ == '__main__':
-    if not gc.isenabled():
-        gc.enable()
-    t = tqdm(os.listdir('data'))
-    for f in t:
-        if str(f).endswith('csv'):
-            t.set_postfix_str(f)
-            df = pd.read_csv(os.path.join('data', f))
-            df.drop_duplicates(inplace=True)
-            df.to_csv(os.path.join('data', f), quoting=csv.QUOTE_NONNUMERIC, index=False)
-            del df
-            gc.collect()
-    t.close()
+    main()